@@ -3,13 +3,15 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, ValidationError
+from typing import Dict, Optional
+import time
 
-from app.core.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.core.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, AUTH_TOKEN_CLAIMS
 from app.models.user import User
 from app.services.user_service import authenticate_user, create_user, get_user_by_email
-from app.auth.password import get_password_hash
+from app.services.user_cache import user_cache, lookup_user, observe_auth
+from app.auth.password import password_hasher, PasswordHashingBusy
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/token")
@@ -36,6 +38,40 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def user_claims(user: User) -> Dict:
+    """Token claims describing the user, so requests can skip the user lookup (AUTH_TOKEN_CLAIMS)"""
+    return {
+        "uid": user.id,
+        "active": user.is_active,
+        "name": user.full_name,
+        "created": user.created_at.isoformat(),
+    }
+
+def user_from_claims(payload: Dict) -> Optional[User]:
+    """The user described by a token's claims, or None for tokens issued without them"""
+    if "uid" not in payload:
+        return None
+    try:
+        return User(
+            id=payload["uid"],
+            email=payload["sub"],
+            full_name=payload.get("name"),
+            is_active=payload.get("active", True),
+            created_at=datetime.fromisoformat(payload["created"]),
+        )
+    except (KeyError, TypeError, ValueError, ValidationError):
+        return None
+
+def active_user(user: User) -> User:
+    """The user, unless their account is deactivated"""
+    if user.is_active is False:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Inactive user",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -50,14 +86,31 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = get_user_by_email(email=token_data.email)
+    if AUTH_TOKEN_CLAIMS:
+        start = time.perf_counter()
+        user = user_from_claims(payload)
+        if user is not None:
+            user_cache.record_saved()
+            observe_auth("claims", time.perf_counter() - start)
+            return active_user(user)
+    user = await lookup_user(token_data.email)
     if user is None:
         raise credentials_exception
-    return user
+    return active_user(user)
+
+def busy_exception(e: PasswordHashingBusy) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-ins right now, please retry shortly",
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(form_data.username, form_data.password)
+    except PasswordHashingBusy as e:
+        raise busy_exception(e)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -65,22 +118,27 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    claims = {"sub": user.email, **(user_claims(user) if AUTH_TOKEN_CLAIMS else {})}
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data=claims, expires_delta=access_token_expires
     )
+    user_cache.put(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register_user(user_data: UserCreate):
-    existing_user = get_user_by_email(user_data.email)
+    existing_user = await get_user_by_email(user_data.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered",
         )
     
-    hashed_password = get_password_hash(user_data.password)
-    user = create_user(
+    try:
+        hashed_password = await password_hasher.hash(user_data.password)
+    except PasswordHashingBusy as e:
+        raise busy_exception(e)
+    user = await create_user(
         email=user_data.email,
         hashed_password=hashed_password,
         full_name=user_data.full_name
@@ -6,10 +6,9 @@ from datetime import datetime
 
 from app.api.endpoints.auth import get_current_user
 from app.models.user import User
-from app.services.content_service import process_and_store_content
+from app.services.content_service import process_and_store_content, CONTENT_STORED
 from app.db.vector_store import get_user_document_chunks
-from langchain_openai import OpenAIEmbeddings
-from app.core.config import OPENAI_API_KEY
+from app.services.providers import get_embeddings
 
 router = APIRouter()
 
@@ -31,8 +30,7 @@ async def process_content(
     current_user: User = Depends(get_current_user)
 ):
     try:
-        # Initialize OpenAI embeddings
-        embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+        embeddings = get_embeddings()
         
         # Process and store content directly using the updated function
         processing_result = process_and_store_content(
@@ -41,7 +39,7 @@ async def process_content(
             embeddings=embeddings
         )
         
-        if processing_result:
+        if processing_result == CONTENT_STORED:
             # If content was successfully processed and stored
             return {
                 "success": True,
@@ -90,8 +88,7 @@ async def get_document_chunks(
         List of document chunks with their metadata
     """
     try:
-        # Initialize OpenAI embeddings
-        embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+        embeddings = get_embeddings()
         
         # Get document chunks
         chunks = get_user_document_chunks(
@@ -1,12 +1,16 @@
 # History Endpoints
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 from typing import Dict, List, Optional
 from datetime import datetime
 
 from app.api.endpoints.auth import get_current_user
+from app.core.config import BROWSING_BATCH_MAX
 from app.models.user import User
-from app.db.history_store import save_browsing_history, get_user_history
+from app.db.storage_factory import get_user_history
+from app.db.pagination import InvalidCursor, decode_cursor, next_cursor
+from app.services.browsing_recorder import record_visits
 
 router = APIRouter()
 
@@ -33,36 +37,76 @@ class QueryHistoryItem(BaseModel):
 class HistoryResponse(BaseModel):
     browsing_history: List[HistoryItem]
     query_history: List[QueryHistoryItem]
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page; None when there are no more
 
-@router.post("/record", status_code=status.HTTP_201_CREATED)
+class BatchHistoryRequest(BaseModel):
+    visits: List[HistoryRequest] = Field(..., min_length=1, max_length=BROWSING_BATCH_MAX)
+
+class RecordHistoryResponse(BaseModel):
+    success: bool
+    ids: List[str]  # saved visits, oldest first
+    duplicates: int  # visits dropped as repeats of a recent visit to the same URL
+
+async def _record(user_id: str, visits: List[HistoryRequest]) -> Dict:
+    try:
+        return await run_in_threadpool(record_visits, user_id, [visit.model_dump() for visit in visits])
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error recording history: {str(e)}"
+        )
+
+@router.post("/record", status_code=status.HTTP_201_CREATED, response_model=RecordHistoryResponse)
 async def record_history(
     request_body: HistoryRequest,
     request: Request,
     current_user: User = Depends(get_current_user)
 ):
+    """Record one page visit; prefer /record/batch for tab listeners"""
+    result = await _record(current_user.id, [request_body])
+    return {"success": True, **result}
 
-    
-    if current_user:
-        print(f"Authenticated user ID: {current_user.id}")
-    else:
-        print(f"User not authenticated or current_user is None.")
+@router.post("/record/batch", status_code=status.HTTP_201_CREATED, response_model=RecordHistoryResponse)
+async def record_history_batch(
+    request_body: BatchHistoryRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Record a batch of page visits
 
-    return {"success": True, "message": "History recorded successfully"}
+    Visits to a URL within BROWSING_DEDUP_WINDOW_S of an earlier visit are
+    dropped; the rest are saved with a single write.
+    """
+    result = await _record(current_user.id, request_body.visits)
+    return {"success": True, **result}
 
 @router.get("", response_model=HistoryResponse)
 async def get_history(
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
     offset: int = 0,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
+    """
+    Browsing and query history, newest first
+
+    Page through with `cursor` (the previous response's next_cursor);
+    `offset` is kept for older clients and ignored when a cursor is given.
+    """
+    try:
+        before = decode_cursor(cursor) if cursor else None
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     try:
-        history = get_user_history(
+        history = await get_user_history(
             user_id=current_user.id, 
             limit=limit,
-            offset=offset
+            offset=0 if cursor else offset,
+            before=before
         )
         
-        return history
+        return {**history, "next_cursor": next_cursor(history, limit)}
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,29 +1,68 @@
 # Query Endpoints
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from pydantic import BaseModel
-from typing import Dict, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
 from datetime import datetime
 
 from app.api.endpoints.auth import get_current_user
 from app.models.user import User
-from app.services.query_service import answer_query
-from app.db.history_store import save_query_history, get_query_history, delete_user_history, delete_specific_query
+from app.core.config import BATCH_MAX_QUESTIONS
+from app.core.logging import get_logger, sample_payload
+from app.services.query_service import answer_query, answer_questions
+from app.services.history_writer import history_writer
+from app.db.storage_factory import get_query_history, search_query_history, delete_user_history, delete_specific_query
+from app.db.pagination import InvalidCursor, decode_cursor, next_cursor
 
 router = APIRouter()
+logger = get_logger(__name__)
 
 class QueryRequest(BaseModel):
     query: str
     url: str
     timestamp: datetime
+    retrieval_mode: Optional[Literal["dense", "lexical", "hybrid"]] = None  # None uses RETRIEVAL_MODE
 
 class QueryResponse(BaseModel):
     success: bool
     answer: str
     sources: Optional[Dict] = None
     confidence: Optional[float] = None
+    prompt_tokens: Optional[int] = None  # tokens sent to the LLM for this answer
+    timings: Optional[Dict[str, float]] = None  # per-stage milliseconds, plus "sequential" and "elapsed"
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_QUESTIONS)
+    url: str
+    timestamp: datetime
+    retrieval_mode: Optional[Literal["dense", "lexical", "hybrid"]] = None  # None uses RETRIEVAL_MODE
+
+class BatchQueryResult(BaseModel):
+    query: str
+    answer: str
+    sources: Optional[Dict] = None
+    confidence: Optional[float] = None
+
+class BatchQueryResponse(BaseModel):
+    success: bool
+    results: List[BatchQueryResult]
+    prompt_tokens: Optional[int] = None  # tokens sent to the LLM for all answers
+    timings: Optional[Dict[str, float]] = None
 
 class QueryHistoryResponse(BaseModel):
     history: list
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page; None when there are no more
+
+class HistorySearchResult(BaseModel):
+    id: str
+    query: str
+    answer: str
+    url: str
+    timestamp: datetime
+    score: float  # relevance boosted by recency; higher is better
+
+class HistorySearchResponse(BaseModel):
+    results: List[HistorySearchResult]
 
 class DeleteHistoryRequest(BaseModel):
     history_type: Optional[str] = "query"  # "query", "browsing", or "all"
@@ -38,10 +77,8 @@ async def ask_query(
     current_user: User = Depends(get_current_user)
 ):
     
-    if current_user:
-        print(f"Authenticated user ID: {current_user.id}")
-    else:
-        print(f"User not authenticated or current_user is None.")
+    if not current_user:
+        logger.warning("Unauthenticated /ask request")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -49,14 +86,20 @@ async def ask_query(
         )
 
     try:
-        result = answer_query(
+        # answer_query blocks on I/O; run it off the event loop
+        result = await run_in_threadpool(
+            answer_query,
             user_id=current_user.id,
             query=request_body.query,
-            url=request_body.url
+            url=request_body.url,
+            retrieval_mode=request_body.retrieval_mode
         )
         
-        print(f"[{current_user.id}] Calling save_query_history with query='{request_body.query}', answer='{result.get('answer')}', url='{request_body.url}'")
-        save_query_history(
+        if sample_payload():
+            logger.info("Query payload", extra={"user_id": current_user.id, "url": request_body.url,
+                                                "query": request_body.query, "answer": result.get("answer")})
+        # Queued for the background writer; the answer does not wait for the database
+        await history_writer.save(
             user_id=current_user.id,
             query=request_body.query,
             answer=result.get("answer"), # Ensure this is correctly passed
@@ -68,25 +111,77 @@ async def ask_query(
             "success": True,
             "answer": result.get("answer"),
             "sources": result.get("sources"),
-            "confidence": result.get("confidence")
+            "confidence": result.get("confidence"),
+            "prompt_tokens": result.get("prompt_tokens"),
+            "timings": result.get("timings")
         }
     except Exception as e:
-        print(f"!!! Exception in /ask endpoint for user {current_user.id if current_user else 'Unknown'} !!!")
+        logger.exception("Error answering query", extra={"user_id": current_user.id, "url": request_body.url})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing query: {str(e)}"
         )
 
+@router.post("/ask/batch", response_model=BatchQueryResponse)
+async def ask_queries(
+    request_body: BatchQueryRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Answer several questions about the same page in one pass.
+    Each question still gets its own answer, sources and history entry.
+    """
+    try:
+        result = await run_in_threadpool(
+            answer_questions,
+            user_id=current_user.id,
+            questions=request_body.questions,
+            url=request_body.url,
+            retrieval_mode=request_body.retrieval_mode
+        )
+        
+        for item in result["results"]:
+            await history_writer.save(
+                user_id=current_user.id,
+                query=item["query"],
+                answer=item["answer"],
+                url=request_body.url,
+                timestamp=request_body.timestamp
+            )
+        
+        return {
+            "success": True,
+            "results": result["results"],
+            "prompt_tokens": result.get("prompt_tokens"),
+            "timings": result.get("timings")
+        }
+    except Exception as e:
+        logger.exception("Error answering batch of queries", extra={"user_id": current_user.id, "url": request_body.url})
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing queries: {str(e)}"
+        )
+
 @router.get("/history", response_model=QueryHistoryResponse)
 async def read_query_history(
+    limit: int = Query(10, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
+    try:
+        before = decode_cursor(cursor).get("query_history") if cursor else None
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if cursor and before is None:
+        return {"history": [], "next_cursor": None}
+
     try:
         # Get query history for user
-        history_data = get_query_history(current_user.id)
+        history_data = await get_query_history(current_user.id, limit, 0, before)
         
         return {
-            "history": history_data
+            "history": history_data,
+            "next_cursor": next_cursor({"query_history": history_data}, limit)
         }
     except Exception as e:
         raise HTTPException(
@@ -94,6 +189,29 @@ async def read_query_history(
             detail=f"Error retrieving query history: {str(e)}"
         )
 
+@router.get("/history/search", response_model=HistorySearchResponse)
+async def search_history(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Full-text search over the user's past questions and answers,
+    ranked by relevance and recency
+    """
+    try:
+        results = await search_query_history(current_user.id, q, limit)
+        
+        return {
+            "results": results
+        }
+    except Exception as e:
+        logger.exception("Error searching query history", extra={"user_id": current_user.id})
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error searching query history: {str(e)}"
+        )
+
 @router.delete("/history", status_code=status.HTTP_200_OK)
 async def clear_user_history(
     request_body: DeleteHistoryRequest,
@@ -103,7 +221,9 @@ async def clear_user_history(
     Clear user's query history
     """
     try:
-        success = delete_user_history(current_user.id, request_body.history_type)
+        # Entries still queued for the writer would otherwise be saved after the delete
+        await history_writer.flush_user(current_user.id)
+        success = await delete_user_history(current_user.id, request_body.history_type)
         
         if success:
             return {
@@ -115,6 +235,8 @@ async def clear_user_history(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to clear history"
             )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -129,27 +251,25 @@ async def delete_specific_query_endpoint(
     """
     Delete a specific query from user's history
     """
-    print(f"DELETE request for query_id: {query_id}, user_id: {current_user.id}")
-    
     try:
-        success = delete_specific_query(current_user.id, query_id)
+        # The query may have just been asked and still be queued for the writer
+        await history_writer.flush_user(current_user.id)
+        success = await delete_specific_query(current_user.id, query_id)
         
         if success:
-            print(f"Successfully deleted query {query_id} for user {current_user.id}")
             return {
                 "success": True,
                 "message": "Query deleted successfully"
             }
         else:
-            print(f"Failed to delete query {query_id} for user {current_user.id}")
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Query not found or already deleted"
             )
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Exception while deleting query {query_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error deleting query", extra={"user_id": current_user.id, "query_id": query_id})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error deleting query: {str(e)}"
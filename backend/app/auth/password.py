@@ -1,6 +1,21 @@
 # Password utility functions
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
 from passlib.context import CryptContext
 
+from app.core.config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_MAX, PASSWORD_HASH_NICE
+from app.core.logging import get_logger
+from app.core.metrics import REGISTRY, gauge_lines, observe_stage
+
+logger = get_logger(__name__)
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password, hashed_password):
@@ -8,3 +23,103 @@ def verify_password(plain_password, hashed_password):
 
 def get_password_hash(password):
     return pwd_context.hash(password)
+
+class PasswordHashingBusy(Exception):
+    """Too many password hashes waiting; the caller should answer 503 and retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Password hashing is busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+def _lower_priority(nice: int):
+    """Thread initializer: lower the worker thread's OS scheduling priority (Linux), so the event loop wins the CPU"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except (AttributeError, OSError):
+        pass
+
+class PasswordHasher:
+    """
+    bcrypt hashing and verification off the event loop
+
+    bcrypt takes a few hundred milliseconds of CPU per call, so calls run in
+    a dedicated pool of `workers` threads (bcrypt releases the GIL) at a
+    lowered OS priority, leaving the event loop free to serve queries. At
+    most `max_pending` calls may be waiting or running; beyond that calls
+    fail at once with PasswordHashingBusy (load shedding) rather than
+    queueing behind a login storm, with a Retry-After estimate from the
+    recent hashing time.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_QUEUE_MAX,
+                 nice: int = PASSWORD_HASH_NICE):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.nice = nice
+        self.pending = 0  # calls waiting or running; only changed on the event loop
+        self.hash_seconds = 0.3  # running average of one bcrypt call
+        self.counters = {"verified": 0, "hashed": 0, "rejected": 0}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="password-hash",
+                initializer=_lower_priority if self.nice else None,
+                initargs=(self.nice,) if self.nice else (),
+            )
+        return self._executor
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained"""
+        return max(1, math.ceil(self.pending * self.hash_seconds / self.workers))
+
+    async def _run(self, stage: str, fn: Callable, *args):
+        if self.pending >= self.max_pending:
+            self.counters["rejected"] += 1
+            logger.warning("Password hashing busy, refusing request", extra={"pending": self.pending})
+            raise PasswordHashingBusy(self.retry_after())
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            # run_in_executor does not carry the request's context (its ID for logging) over by itself
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pool(), contextvars.copy_context().run, self._timed, fn, *args
+            )
+        finally:
+            self.pending -= 1
+            observe_stage(stage, time.perf_counter() - start)
+
+    def _timed(self, fn: Callable, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.hash_seconds += 0.1 * (time.perf_counter() - start - self.hash_seconds)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        result = await self._run("password_verify", verify_password, plain_password, hashed_password)
+        self.counters["verified"] += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        result = await self._run("password_hash", get_password_hash, password)
+        self.counters["hashed"] += 1
+        return result
+
+    def stats(self):
+        return {**self.counters, "pending": self.pending, "hash_ms": round(self.hash_seconds * 1000, 1)}
+
+# The process-wide hasher
+password_hasher = PasswordHasher()
+
+def _collect_metrics() -> List[str]:
+    stats = password_hasher.stats()
+    lines = []
+    lines += gauge_lines("askify_password_hash_pending", "Password hashes waiting or running", {(): stats["pending"]})
+    lines += gauge_lines("askify_password_hash_rejected_total", "Logins and registrations refused because hashing was busy",
+                         {(): stats["rejected"]}, kind="counter")
+    return lines
+
+REGISTRY.add_collector(_collect_metrics)
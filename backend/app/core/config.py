@@ -15,14 +15,172 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-for-jwt")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
+# Users resolved from tokens are cached for AUTH_USER_CACHE_TTL_S (0 disables), at most AUTH_USER_CACHE_MAX
+# of them, least recently used evicted first. With AUTH_TOKEN_CLAIMS, new tokens also carry the user's id,
+# active flag, name and creation time, and requests with such a token need no user lookup at all; changes
+# to the user then reach those requests only when the token is renewed. Without claims, a change made to a
+# user row (there is no endpoint for it) reaches requests within AUTH_USER_CACHE_TTL_S.
+AUTH_USER_CACHE_TTL_S = float(os.getenv("AUTH_USER_CACHE_TTL_S", "300"))
+AUTH_USER_CACHE_MAX = int(os.getenv("AUTH_USER_CACHE_MAX", "10000"))
+AUTH_TOKEN_CLAIMS = os.getenv("AUTH_TOKEN_CLAIMS", "False") == "True"
+
+# Password hashing (bcrypt) runs in PASSWORD_HASH_WORKERS threads at lowered OS priority (PASSWORD_HASH_NICE,
+# 0 keeps it), off the event loop. Beyond PASSWORD_HASH_QUEUE_MAX hashes waiting or running, logins and
+# registrations are refused with 503 and Retry-After instead of queueing.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+PASSWORD_HASH_QUEUE_MAX = int(os.getenv("PASSWORD_HASH_QUEUE_MAX", "32"))
+PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE", "10"))
+
 # OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "gpt-4o-mini")
+
+# Model provider: "openai", or "fake" for deterministic local models (offline load and regression testing)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+FAKE_EMBEDDING_DIM = int(os.getenv("FAKE_EMBEDDING_DIM", "256"))
+FAKE_EMBEDDING_LATENCY_MS = float(os.getenv("FAKE_EMBEDDING_LATENCY_MS", "0"))  # per API call
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))  # per API call
+
+# Outbound policy for LLM and embedding calls: adaptive (AIMD) concurrency limit per API,
+# jittered retries capped by a retry budget, and hedging of slow embedding requests
+OUTBOUND_POLICY_ENABLED = os.getenv("OUTBOUND_POLICY_ENABLED", "True") == "True"
+OPENAI_TIMEOUT_S = float(os.getenv("OPENAI_TIMEOUT_S", "30"))
+OUTBOUND_INITIAL_CONCURRENCY = int(os.getenv("OUTBOUND_INITIAL_CONCURRENCY", "8"))
+OUTBOUND_MIN_CONCURRENCY = int(os.getenv("OUTBOUND_MIN_CONCURRENCY", "1"))
+OUTBOUND_MAX_CONCURRENCY = int(os.getenv("OUTBOUND_MAX_CONCURRENCY", "64"))
+OUTBOUND_QUEUE_TIMEOUT_S = float(os.getenv("OUTBOUND_QUEUE_TIMEOUT_S", "30"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+OUTBOUND_RETRY_BASE_MS = float(os.getenv("OUTBOUND_RETRY_BASE_MS", "200"))
+OUTBOUND_RETRY_MAX_MS = float(os.getenv("OUTBOUND_RETRY_MAX_MS", "8000"))
+OUTBOUND_RETRY_BUDGET_RATIO = float(os.getenv("OUTBOUND_RETRY_BUDGET_RATIO", "0.2"))  # retries per call
+HEDGE_EMBEDDINGS = os.getenv("HEDGE_EMBEDDINGS", "True") == "True"  # query embeddings only; batches are not hedged
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))  # hedge after this latency percentile
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))  # calls of a kind observed before hedging it starts
 
 # Database
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Supabase is reached through its PostgREST API (SUPABASE_REST_URL overrides SUPABASE_URL/rest/v1, e.g. a
+# local stand-in), over one shared connection pool for async code and one for worker threads
+SUPABASE_REST_URL = os.getenv("SUPABASE_REST_URL")
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "True") == "True"
+SUPABASE_POOL_MAX_CONNECTIONS = int(os.getenv("SUPABASE_POOL_MAX_CONNECTIONS", "20"))  # per pool
+SUPABASE_POOL_MAX_KEEPALIVE = int(os.getenv("SUPABASE_POOL_MAX_KEEPALIVE", "20"))  # idle connections kept open
+SUPABASE_POOL_KEEPALIVE_S = float(os.getenv("SUPABASE_POOL_KEEPALIVE_S", "30"))
+SUPABASE_POOL_TIMEOUT_S = float(os.getenv("SUPABASE_POOL_TIMEOUT_S", "5"))  # waiting for a free connection
+SUPABASE_CONNECT_TIMEOUT_S = float(os.getenv("SUPABASE_CONNECT_TIMEOUT_S", "3"))
+SUPABASE_TIMEOUT_S = float(os.getenv("SUPABASE_TIMEOUT_S", "10"))  # reading and writing
 VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH", "./chromadb")
 
+# History storage: "supabase", "sqlite" (one WAL-mode database) or "local" (append-only JSONL logs).
+# Local logs are compacted in the background once deleted records and tombstones make up
+# LOCAL_HISTORY_COMPACT_RATIO of their lines (and at least LOCAL_HISTORY_COMPACT_MIN_LINES lines).
+STORAGE_MODE = os.getenv("STORAGE_MODE", "supabase").lower()
+LOCAL_HISTORY_COMPACT_RATIO = float(os.getenv("LOCAL_HISTORY_COMPACT_RATIO", "0.5"))
+LOCAL_HISTORY_COMPACT_MIN_LINES = int(os.getenv("LOCAL_HISTORY_COMPACT_MIN_LINES", "1000"))
+LOCAL_HISTORY_COMPACT_INTERVAL_MINUTES = int(os.getenv("LOCAL_HISTORY_COMPACT_INTERVAL_MINUTES", "10"))  # 0 disables
+
+# Query history write-behind: answers return before their history entry is saved. A background task
+# saves entries in batches of up to HISTORY_BATCH_SIZE, at most HISTORY_FLUSH_INTERVAL_MS after the first
+# was queued. With HISTORY_QUEUE_MAX entries queued, requests wait up to HISTORY_ENQUEUE_TIMEOUT_S for room
+# and then save their entry themselves.
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "True") == "True"
+HISTORY_QUEUE_MAX = int(os.getenv("HISTORY_QUEUE_MAX", "10000"))
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL_MS = float(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "200"))
+HISTORY_ENQUEUE_TIMEOUT_S = float(os.getenv("HISTORY_ENQUEUE_TIMEOUT_S", "2"))
+HISTORY_WRITE_RETRIES = int(os.getenv("HISTORY_WRITE_RETRIES", "3"))
+
+# History archival: entries older than HISTORY_ARCHIVE_AFTER_DAYS (0 disables) are moved out of the
+# primary store into compressed columnar segment files per user under HISTORY_ARCHIVE_DIR, checked every
+# HISTORY_ARCHIVE_INTERVAL_MINUTES. History pages continue into the archive once the primary store runs out.
+# With several nodes, HISTORY_ARCHIVE_DIR must be storage they all share, or each node would see (and
+# delete from) different archived history. With Supabase, archival only runs once HISTORY_ARCHIVE_SHARED
+# confirms that (or that there is a single node).
+HISTORY_ARCHIVE_AFTER_DAYS = int(os.getenv("HISTORY_ARCHIVE_AFTER_DAYS", "0"))
+HISTORY_ARCHIVE_SHARED = os.getenv("HISTORY_ARCHIVE_SHARED", "False") == "True"
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", os.path.join(os.getenv("LOCAL_DB_DIR", "./local_db"), "history_archive"))
+HISTORY_ARCHIVE_CODEC = os.getenv("HISTORY_ARCHIVE_CODEC", "zstd").lower()  # "zstd" (needs zstandard, else gzip) or "gzip"
+HISTORY_ARCHIVE_SEGMENT_ROWS = int(os.getenv("HISTORY_ARCHIVE_SEGMENT_ROWS", "1000"))
+HISTORY_ARCHIVE_INTERVAL_MINUTES = int(os.getenv("HISTORY_ARCHIVE_INTERVAL_MINUTES", "60"))
+HISTORY_ARCHIVE_CACHE_SEGMENTS = int(os.getenv("HISTORY_ARCHIVE_CACHE_SEGMENTS", "32"))  # decoded segments kept in memory
+
+# Browsing history ingestion (/history/record/batch): a visit to a URL the user visited less than
+# BROWSING_DEDUP_WINDOW_S earlier is dropped (tab events repeat). Recent visits are remembered per node
+# for at most BROWSING_DEDUP_MAX_KEYS user/URL pairs. Requests carry at most BROWSING_BATCH_MAX visits.
+BROWSING_DEDUP_WINDOW_S = float(os.getenv("BROWSING_DEDUP_WINDOW_S", "30"))  # 0 keeps every visit
+BROWSING_DEDUP_MAX_KEYS = int(os.getenv("BROWSING_DEDUP_MAX_KEYS", "100000"))
+BROWSING_BATCH_MAX = int(os.getenv("BROWSING_BATCH_MAX", "500"))
+
+# History search (/query/history/search): text matches are ranked by relevance times
+# (1 + HISTORY_SEARCH_RECENCY_WEIGHT * 0.5 ** (age in days / HISTORY_SEARCH_HALF_LIFE_DAYS))
+HISTORY_SEARCH_RECENCY_WEIGHT = float(os.getenv("HISTORY_SEARCH_RECENCY_WEIGHT", "0.5"))
+HISTORY_SEARCH_HALF_LIFE_DAYS = float(os.getenv("HISTORY_SEARCH_HALF_LIFE_DAYS", "30"))
+HISTORY_SEARCH_CANDIDATES = int(os.getenv("HISTORY_SEARCH_CANDIDATES", "200"))  # best text matches re-ranked
+HISTORY_SEARCH_MAX_USERS = int(os.getenv("HISTORY_SEARCH_MAX_USERS", "100"))  # local store: indexes kept in memory
+
+# Vector index (HNSW) parameters, applied when a user's collection is created.
+# Space, M and construction ef are fixed for the life of a collection; changing them needs a rebuild
+# (app.db.retention.rebuild_collection). Search ef is applied to existing collections too (Chroma 1.x).
+HNSW_SPACE = os.getenv("HNSW_SPACE", "l2").lower()  # "l2", "cosine" or "ip"
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "100"))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "10"))
+
+# Stored chunk vector encoding: "none" (float32 in the HNSW index), "int8" or "binary".
+# Quantized vectors are kept with the chunk and searched per page instead of through HNSW.
+# Each mode has its own collections; turning quantization on encodes the stored float vectors into
+# the new collections in the background at startup. python -m app.db.retention --drop-unused deletes the old ones.
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+
+# Ingestion: chunk texts are embedded in batches of this size, this many batches at a time
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+
+# Vector store retention (0 disables a limit). Off by default: it deletes stored pages, and a page's
+# last use only counts queries, not re-ingestion.
+RETENTION_MAX_PAGES = int(os.getenv("RETENTION_MAX_PAGES", "0"))  # per user
+RETENTION_MAX_CHUNKS = int(os.getenv("RETENTION_MAX_CHUNKS", "0"))  # per user
+RETENTION_TTL_DAYS = int(os.getenv("RETENTION_TTL_DAYS", "0"))  # by ingestion time
+RETENTION_INTERVAL_MINUTES = int(os.getenv("RETENTION_INTERVAL_MINUTES", "0"))  # 0 disables the background job
+RETENTION_REBUILD_THRESHOLD = float(os.getenv("RETENTION_REBUILD_THRESHOLD", "0.3"))  # deleted fraction
+RETENTION_REBUILD_IDLE_SECONDS = int(os.getenv("RETENTION_REBUILD_IDLE_SECONDS", "600"))
+
+# Retrieval
+# "dense" (embeddings only), "lexical" (BM25 only, no query embedding) or "hybrid" (both, fused;
+# lexical hits must also pass DENSE_RELEVANCE_THRESHOLD)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense").lower()
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+DENSE_RELEVANCE_THRESHOLD = float(os.getenv("DENSE_RELEVANCE_THRESHOLD", "0.5"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+LEXICAL_INDEX_MAX_PAGES = int(os.getenv("LEXICAL_INDEX_MAX_PAGES", "1000"))
+
+# Context packing: retrieved chunks are deduplicated and trimmed to fit these token limits
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))  # all chunks together
+CONTEXT_CHUNK_MAX_TOKENS = int(os.getenv("CONTEXT_CHUNK_MAX_TOKENS", "400"))  # per chunk
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))  # repeated sentence fraction
+
+# Batch questions (/query/ask/batch): several questions about one page answered in one LLM call
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "10"))
+BATCH_CONTEXT_TOKEN_BUDGET = int(os.getenv("BATCH_CONTEXT_TOKEN_BUDGET", "3000"))  # shared by all questions
+
+# Logging: level, "json" (one object per line) or "text", and the fraction of requests whose
+# full question and answer are logged (0 keeps payloads out of the logs)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0"))
+
+# Metrics: Prometheus text on /metrics with stage, HTTP and outbound call metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "False") == "True"
+
+# Per-request profiling: requests sending the X-Askify-Profile header with this token are
+# sampled and their folded stacks saved to PROFILE_DIR (empty token disables profiling)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
 # CORS
 CORS_ORIGINS = [
     "chrome-extension://",  # Your Chrome extension ID will be added here
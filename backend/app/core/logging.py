@@ -0,0 +1,125 @@
+# Structured, non-blocking logging with request-id correlation
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from app.core.config import LOG_LEVEL, LOG_FORMAT, LOG_PAYLOAD_SAMPLE_RATE
+
+# Logger namespace of the application; every module logs under it via get_logger(__name__)
+ROOT_LOGGER = "app"
+
+# Correlates the log lines of one HTTP request (set by the request-id middleware)
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# Attributes every LogRecord has; anything else on a record came from `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id, in the caller's thread before they are queued"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queues a copy of each record with its message merged and traceback rendered, but not formatted"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            # Render tracebacks here, where the frames are still live (only happens on errors)
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, request id, message and any `extra` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development, with `extra` fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s [%(request_id)s] %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extras = " ".join(
+            f"{key}={value}" for key, value in record.__dict__.items()
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_")
+        )
+        return f"{line} {extras}" if extras else line
+
+_listener = None
+_setup_lock = threading.Lock()
+
+def setup_logging():
+    """
+    Route the application's log records through a queue to a background thread
+
+    Callers only format the message and enqueue the record; serializing it
+    and writing to stdout happen on the QueueListener thread, so a slow
+    terminal or log collector never blocks a request. Safe to call more
+    than once.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        log_queue = queue.SimpleQueue()
+        queue_handler = _QueueHandler(log_queue)
+        queue_handler.addFilter(RequestIdFilter())
+
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.setLevel(LOG_LEVEL)
+        logger.addHandler(queue_handler)
+        logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Write out every queued record and stop the background writer"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def get_logger(name: str) -> logging.Logger:
+    """The logger for a module (pass __name__), with logging set up on first use"""
+    setup_logging()
+    return logging.getLogger(name)
+
+def sample_payload() -> bool:
+    """
+    Whether to log full request payloads (questions, answers) for this request;
+    LOG_PAYLOAD_SAMPLE_RATE of requests, none by default
+    """
+    return LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE
@@ -0,0 +1,135 @@
+# Opt-in sampling profiler for single requests, writing flamegraph-compatible folded stacks
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.core.config import PROFILE_TOKEN, PROFILE_DIR, PROFILE_INTERVAL_MS
+
+# Request header carrying PROFILE_TOKEN; only requests that present it are profiled
+PROFILE_HEADER = "X-Askify-Profile"
+
+# Leaf frames of threads that are parked rather than working; their samples are dropped
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("socket.py", "accept"),
+    ("handlers.py", "dequeue"),  # the log writer thread waiting for records
+}
+
+# At most one request is profiled at a time, so profiling never piles up overhead
+_active = threading.Lock()
+
+def profile_requested(header_value: Optional[str]) -> bool:
+    """Whether a request's profile header carries the configured token"""
+    if not PROFILE_TOKEN or not header_value:
+        return False
+    return hmac.compare_digest(header_value.encode(), PROFILE_TOKEN.encode())
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread every `interval_ms` while running
+
+    Request handlers hand work to thread pools (ingestion, embeddings, the
+    LLM call), so sampling all threads catches that work where a
+    deterministic profiler attached to one thread would not. Samples are
+    aggregated as folded stacks ("thread;file:function;... count"), the input
+    format of flamegraph.pl, speedscope and inferno. Other requests running
+    at the same time are sampled too.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self.duration = 0.0
+
+    def _sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(labels))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def save(self, name: str) -> str:
+        """Write the folded stacks to PROFILE_DIR; returns the file path"""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{name}.folded")
+        with open(path, "w") as f:
+            f.write(self.folded())
+        return path
+
+def try_start_profiler() -> Optional[SamplingProfiler]:
+    """A running profiler, or None if another request is being profiled"""
+    if not _active.acquire(blocking=False):
+        return None
+    profiler = SamplingProfiler()
+    profiler.start()
+    return profiler
+
+def finish_profiler(profiler: SamplingProfiler, name: str) -> str:
+    """Stop `profiler`, save its profile and let the next request be profiled"""
+    try:
+        profiler.stop()
+        return profiler.save(name)
+    finally:
+        _active.release()
+
+def top_functions(path: str, limit: int = 25) -> Dict[str, Dict[str, int]]:
+    """Functions with the most samples in a folded profile, inclusive and self"""
+    inclusive, own = Counter(), Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            frames = stack.split(";")[1:]  # drop the thread name
+            for frame in set(frames):
+                inclusive[frame] += int(count)
+            if frames:
+                own[frames[-1]] += int(count)
+    return {frame: {"inclusive": samples, "self": own[frame]} for frame, samples in inclusive.most_common(limit)}
+
+if __name__ == "__main__":
+    # Summarize a saved profile: python -m app.core.profiling profiles/<file>.folded
+    for frame, counts in top_functions(sys.argv[1]).items():
+        print(f"{counts['inclusive']:7d} {counts['self']:7d}  {frame}")
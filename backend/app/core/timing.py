@@ -0,0 +1,68 @@
+# Per-request stage timings
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from app.core.config import METRICS_ENABLED
+from app.core.metrics import observe_stage
+
+class StageTimings:
+    """
+    Wall-clock timings of the stages of one request
+
+    Stages may run concurrently on different threads. `summary()` reports
+    each stage's duration, the sum of all stages (what a strictly sequential
+    request would take) and the elapsed time of the request itself (the
+    critical path); the difference is the time saved by overlapping stages.
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add(name, elapsed)
+            observe_stage(name, elapsed, failed)
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self._stages[name] = self._stages.get(name, 0.0) + seconds
+
+    def summary(self) -> Dict[str, float]:
+        """Stage durations plus "sequential" and "elapsed" totals, in milliseconds"""
+        with self._lock:
+            stages = {name: round(seconds * 1000, 1) for name, seconds in self._stages.items()}
+            sequential = sum(self._stages.values())
+        stages["sequential"] = round(sequential * 1000, 1)
+        stages["elapsed"] = round((time.perf_counter() - self._start) * 1000, 1)
+        return stages
+
+@contextmanager
+def timed(timings: "StageTimings", name: str):
+    """
+    Time a stage into `timings` (if given) and the stage duration metric (if
+    METRICS_ENABLED); does nothing when neither is collecting
+    """
+    if timings is None and not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings.add(name, elapsed)
+        observe_stage(name, elapsed, failed)
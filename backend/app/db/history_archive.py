@@ -0,0 +1,455 @@
+# History archival tier: old entries in compressed columnar segment files per user, read after the primary store
+import asyncio
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+from app.core.config import (
+    STORAGE_MODE, HISTORY_ARCHIVE_AFTER_DAYS, HISTORY_ARCHIVE_DIR, HISTORY_ARCHIVE_CODEC, HISTORY_ARCHIVE_SHARED,
+    HISTORY_ARCHIVE_SEGMENT_ROWS, HISTORY_ARCHIVE_CACHE_SEGMENTS, HISTORY_SEARCH_CANDIDATES, HISTORY_SEARCH_MAX_USERS,
+)
+from app.core.logging import get_logger
+from app.db.history_search import HistorySearchIndex, rank_matches
+from app.db.pagination import HISTORY_TABLES, Keyset, last_keyset
+
+logger = get_logger(__name__)
+
+# Columns kept per table; anything else a backend returns (e.g. Supabase's search vector) is dropped
+ARCHIVE_COLUMNS = {
+    "query_history": ("id", "user_id", "query", "answer", "url", "timestamp", "metadata"),
+    "browsing_history": ("id", "user_id", "url", "title", "timestamp", "metadata"),
+}
+
+# Segment file: MAGIC, a 4-byte header length, the JSON header, then one compressed blob per column
+MAGIC = b"ASKSEG1\n"
+
+# Rows moved per round of the archival job
+ARCHIVE_BATCH = 5000
+
+@lru_cache(maxsize=1)
+def _zstd():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+def _codec() -> str:
+    """The codec for new segments: zstd if configured and installed, else gzip"""
+    return "zstd" if HISTORY_ARCHIVE_CODEC == "zstd" and _zstd() is not None else "gzip"
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=9).compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if _zstd() is None:
+            raise RuntimeError("History archive segment is zstd-compressed; install zstandard to read it")
+        return _zstd().ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+def _key(row: Dict) -> Keyset:
+    return str(row["timestamp"]), str(row["id"])
+
+def write_segment(path: str, table: str, rows: List[Dict], codec: str):
+    """Write rows, ordered by (timestamp, id), as a segment file with one compressed blob per column"""
+    blobs, columns, offset = [], {}, 0
+    for name in ARCHIVE_COLUMNS[table]:
+        values = [str(row[name]) if name == "timestamp" else row.get(name) for row in rows]
+        blob = _compress(json.dumps(values, separators=(",", ":"), default=str).encode(), codec)
+        columns[name] = [offset, len(blob)]
+        blobs.append(blob)
+        offset += len(blob)
+    header = json.dumps({"table": table, "codec": codec, "rows": len(rows), "columns": columns}).encode()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack(">I", len(header)) + header + b"".join(blobs))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class Segment:
+    """A segment file in memory; each column is decompressed the first time it is read"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f"Not a history archive segment: {path}")
+        (length,) = struct.unpack_from(">I", data, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(data[start:start + length])
+        self._data = data[start + length:]
+        self._columns: Dict[str, List] = {}
+        self.keys: List[Keyset] = list(zip(self.column("timestamp"), self.column("id")))
+
+    def column(self, name: str) -> List:
+        if name not in self._columns:
+            offset, length = self.header["columns"][name]
+            self._columns[name] = json.loads(_decompress(self._data[offset:offset + length], self.header["codec"]))
+        return self._columns[name]
+
+    def row(self, i: int) -> Dict:
+        return {name: self.column(name)[i] for name in self.header["columns"]}
+
+    def rows(self) -> List[Dict]:
+        return [self.row(i) for i in range(len(self.keys))]
+
+class HistoryArchive:
+    """
+    Archived history rows as immutable segment files, per table and user
+
+    Each user's directory holds segments of up to `segment_rows` rows
+    ordered by (timestamp, id), and a manifest listing each segment's first
+    and last keyset. Reads open only the segments overlapping the requested
+    page, newest first, and decode only the columns they return; decoded
+    segments are kept in a small LRU cache. Search builds a BM25 index over
+    a user's archived questions and answers, kept until their set of
+    segments changes. Changes write new segment files
+    and then replace the manifest, so readers see either the old or the new
+    set of segments.
+    """
+
+    def __init__(self, root: str = HISTORY_ARCHIVE_DIR, segment_rows: int = HISTORY_ARCHIVE_SEGMENT_ROWS,
+                 cache_segments: int = HISTORY_ARCHIVE_CACHE_SEGMENTS):
+        self.root = root
+        self.segment_rows = segment_rows
+        self.cache_segments = cache_segments
+        self._lock = threading.Lock()  # serializes changes to the archive
+        self._cache: "OrderedDict[str, Segment]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # {user_id: (segment files, index, {record id: (segment file, row)})}, least recently used first
+        self._search_indexes: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _dir(self, table: str, user_id: str) -> str:
+        return os.path.join(self.root, table, hashlib.sha256(user_id.encode()).hexdigest()[:32])
+
+    def _manifest(self, table: str, user_id: str) -> List[Dict]:
+        """The user's segments ordered by last keyset: {"file", "rows", "first", "last"}"""
+        try:
+            with open(os.path.join(self._dir(table, user_id), "manifest.json")) as f:
+                return json.load(f)["segments"]
+        except FileNotFoundError:
+            return []
+
+    def _save_manifest(self, table: str, user_id: str, segments: List[Dict]):
+        segments.sort(key=lambda segment: segment["last"])
+        path = os.path.join(self._dir(table, user_id), "manifest.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"table": table, "user_id": user_id, "segments": segments}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _segment(self, path: str) -> Segment:
+        with self._cache_lock:
+            segment = self._cache.get(path)
+            if segment is not None:
+                self._cache.move_to_end(path)
+                return segment
+        segment = Segment(path)
+        with self._cache_lock:
+            self._cache[path] = segment
+            while len(self._cache) > self.cache_segments:
+                self._cache.popitem(last=False)
+        return segment
+
+    def _forget(self, paths: List[str]):
+        with self._cache_lock:
+            for path in paths:
+                self._cache.pop(path, None)
+
+    def _write(self, table: str, user_id: str, rows: List[Dict]) -> Dict:
+        """Write rows (in keyset order) as a new segment; returns its manifest entry"""
+        name = f"{str(rows[0]['timestamp'])[:10]}-{uuid.uuid4().hex[:12]}.seg"
+        write_segment(os.path.join(self._dir(table, user_id), name), table, rows, _codec())
+        return {"file": name, "rows": len(rows), "first": list(_key(rows[0])), "last": list(_key(rows[-1]))}
+
+    def add(self, table: str, user_id: str, rows: List[Dict]) -> int:
+        """
+        Archive a user's rows; rows already archived are skipped
+
+        Safe to repeat after a crash between archiving rows and deleting
+        them from the primary store. Returns the number of rows added.
+        """
+        with self._lock:
+            directory = self._dir(table, user_id)
+            os.makedirs(directory, exist_ok=True)
+            segments = self._manifest(table, user_id)
+            rows = sorted({row["id"]: row for row in rows}.values(), key=_key)
+            first, last = list(_key(rows[0])), list(_key(rows[-1]))
+            archived = set()
+            for segment in segments:
+                if segment["first"] <= last and segment["last"] >= first:
+                    archived.update(self._segment(os.path.join(directory, segment["file"])).column("id"))
+            rows = [row for row in rows if row["id"] not in archived]
+            if not rows:
+                return 0
+
+            # Top up the newest segment while it is small and the new rows follow it, so that frequent
+            # runs do not leave a segment per run
+            replaced = []
+            tail = segments[-1] if segments else None
+            if tail and tail["rows"] < self.segment_rows and tail["last"] < list(_key(rows[0])):
+                replaced.append(tail)
+                rows = self._segment(os.path.join(directory, tail["file"])).rows() + rows
+            added = [self._write(table, user_id, rows[i:i + self.segment_rows])
+                     for i in range(0, len(rows), self.segment_rows)]
+            self._save_manifest(table, user_id, [segment for segment in segments if segment not in replaced] + added)
+            self._remove_files(directory, replaced)
+            return len(rows) - sum(segment["rows"] for segment in replaced)
+
+    def _remove_files(self, directory: str, segments: List[Dict]):
+        paths = [os.path.join(directory, segment["file"]) for segment in segments]
+        self._forget(paths)
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def newest(self, table: str, user_id: str, limit: int, before: Optional[Keyset] = None, _retry: bool = True) -> List[Dict]:
+        """Up to `limit` archived rows of a user, newest first, starting after the keyset `before`"""
+        directory = self._dir(table, user_id)
+        bound = list(before) if before else None
+        found: List[tuple] = []  # (keyset, segment, index)
+        for segment in reversed(self._manifest(table, user_id)):
+            if bound is not None and segment["first"] >= bound:
+                continue
+            if len(found) >= limit and segment["last"] < list(found[limit - 1][0]):
+                break  # every remaining segment ends before the page does
+            try:
+                data = self._segment(os.path.join(directory, segment["file"]))
+            except FileNotFoundError:
+                if not _retry:
+                    raise
+                # Replaced since the manifest was read; read the current set of segments
+                return self.newest(table, user_id, limit, before, _retry=False)
+            end = bisect.bisect_left(data.keys, tuple(before)) if before else len(data.keys)
+            found += [(data.keys[i], data, i) for i in range(end - 1, max(-1, end - 1 - limit), -1)]
+            found.sort(key=lambda item: item[0], reverse=True)
+            del found[limit:]
+        return [data.row(i) for _, data, i in found]
+
+    def _search_index(self, user_id: str) -> tuple:
+        """The user's archive search index with each record's location, rebuilt when their segments change"""
+        directory = self._dir("query_history", user_id)
+        segments = self._manifest("query_history", user_id)
+        files = tuple(segment["file"] for segment in segments)
+        with self._cache_lock:
+            cached = self._search_indexes.get(user_id)
+            if cached is not None and cached[0] == files:
+                self._search_indexes.move_to_end(user_id)
+                return cached
+        index, locations = HistorySearchIndex(), {}
+        for name in files:
+            data = self._segment(os.path.join(directory, name))
+            for i, (record_id, query, answer) in enumerate(zip(data.column("id"), data.column("query"), data.column("answer"))):
+                index.add(record_id, query, answer)
+                locations[record_id] = (name, i)
+        entry = (files, index, locations)
+        with self._cache_lock:
+            self._search_indexes[user_id] = entry
+            while len(self._search_indexes) > HISTORY_SEARCH_MAX_USERS:
+                self._search_indexes.popitem(last=False)
+        return entry
+
+    def search(self, user_id: str, text: str, limit: int, _retry: bool = True) -> List[Dict]:
+        """A user's archived questions and answers matching `text`, ranked like the primary store's matches"""
+        try:
+            _, index, locations = self._search_index(user_id)
+            directory = self._dir("query_history", user_id)
+            matches = []
+            for record_id, relevance in index.search(text, HISTORY_SEARCH_CANDIDATES):
+                name, i = locations[record_id]
+                matches.append((self._segment(os.path.join(directory, name)).row(i), relevance))
+        except FileNotFoundError:
+            if not _retry:
+                raise
+            # Replaced since the manifest was read; search the current set of segments
+            return self.search(user_id, text, limit, _retry=False)
+        return rank_matches(matches, limit)
+
+    def delete(self, table: str, user_id: str, record_id: str) -> bool:
+        """Delete one archived row; returns whether the user had it"""
+        with self._lock:
+            directory = self._dir(table, user_id)
+            segments = self._manifest(table, user_id)
+            for segment in segments:
+                data = self._segment(os.path.join(directory, segment["file"]))
+                if record_id not in data.column("id"):
+                    continue
+                rows = [row for row in data.rows() if row["id"] != record_id]
+                kept = [other for other in segments if other is not segment]
+                self._save_manifest(table, user_id, kept + ([self._write(table, user_id, rows)] if rows else []))
+                self._remove_files(directory, [segment])
+                return True
+            return False
+
+    def delete_user(self, table: str, user_id: str):
+        """Delete all of a user's archived rows in a table"""
+        with self._lock:
+            directory = self._dir(table, user_id)
+            self._forget([os.path.join(directory, segment["file"]) for segment in self._manifest(table, user_id)])
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def stats(self) -> Dict[str, int]:
+        """Segments, rows and bytes on disk"""
+        totals = {"users": 0, "segments": 0, "rows": 0, "bytes": 0}
+        for table in HISTORY_TABLES:
+            table_dir = os.path.join(self.root, table)
+            if not os.path.isdir(table_dir):
+                continue
+            for user_dir in os.listdir(table_dir):
+                try:
+                    with open(os.path.join(table_dir, user_dir, "manifest.json")) as f:
+                        segments = json.load(f)["segments"]
+                except (FileNotFoundError, ValueError):
+                    continue
+                totals["users"] += 1
+                totals["segments"] += len(segments)
+                totals["rows"] += sum(segment["rows"] for segment in segments)
+                totals["bytes"] += sum(os.path.getsize(os.path.join(table_dir, user_dir, segment["file"]))
+                                       for segment in segments)
+        return totals
+
+# The process-wide archive
+archive = HistoryArchive()
+
+def with_archive(backend: Dict[str, Callable]) -> Dict[str, Callable]:
+    """
+    A storage backend's functions with archived rows included
+
+    History reads that come back short continue into the archive from the
+    last row returned (or from the cursor), so cursor pagination runs
+    through the primary store and then the archive. Offset pagination only
+    reaches the archive on the page where the primary store runs out.
+    Deletes apply to both tiers. Search merges the best matches of both by
+    score. The functions are coroutines, like the backend's (see
+    storage_factory); the archive's disk reads run in a worker thread.
+    """
+    get_query_history = backend["get_query_history"]
+    search_query_history = backend["search_query_history"]
+    get_user_history = backend["get_user_history"]
+    delete_user_history = backend["delete_user_history"]
+    delete_specific_query = backend["delete_specific_query"]
+
+    async def continue_into_archive(table: str, user_id: str, rows: List[Dict], limit: int, offset: int,
+                                    before: Optional[Keyset]) -> List[Dict]:
+        if len(rows) >= limit or (offset and not rows):
+            return rows
+        older = await asyncio.to_thread(
+            archive.newest, table, user_id, limit - len(rows), last_keyset(rows) if rows else before
+        )
+        return rows + older
+
+    async def tiered_query_history(user_id: str, limit: int = 10, offset: int = 0,
+                                   before: Optional[Keyset] = None) -> List[Dict]:
+        rows = await get_query_history(user_id, limit=limit, offset=offset, before=before)
+        return await continue_into_archive("query_history", user_id, rows, limit, offset, before)
+
+    async def tiered_user_history(user_id: str, limit: int = 100, offset: int = 0,
+                                  before: Optional[Dict[str, Keyset]] = None) -> Dict:
+        history = await get_user_history(user_id, limit=limit, offset=offset, before=before)
+        for table in HISTORY_TABLES:
+            if before is None or table in before:
+                history[table] = await continue_into_archive(table, user_id, history[table], limit, offset,
+                                                             (before or {}).get(table))
+        return history
+
+    async def search_everywhere(user_id: str, text: str, limit: int = 20) -> List[Dict]:
+        results = await search_query_history(user_id, text, limit)
+        try:
+            results = results + await asyncio.to_thread(archive.search, user_id, text, limit)
+        except OSError:
+            logger.exception("Error searching archived history", extra={"user_id": user_id})
+        merged = {}
+        # A row can be in both tiers briefly, between being archived and deleted from the primary store
+        for row in sorted(results, key=lambda row: row["score"], reverse=True):
+            merged.setdefault(str(row["id"]), row)
+        return list(merged.values())[:limit]
+
+    async def delete_user_history_everywhere(user_id: str, history_type: str = "all") -> bool:
+        deleted = await delete_user_history(user_id, history_type)
+        try:
+            if history_type in ["query", "all"]:
+                await asyncio.to_thread(archive.delete_user, "query_history", user_id)
+            if history_type in ["browsing", "all"]:
+                await asyncio.to_thread(archive.delete_user, "browsing_history", user_id)
+        except OSError:
+            logger.exception("Error deleting archived history", extra={"user_id": user_id, "history_type": history_type})
+            return False
+        return deleted
+
+    async def delete_specific_query_everywhere(user_id: str, query_id: str) -> bool:
+        if await delete_specific_query(user_id, query_id):
+            return True
+        try:
+            return await asyncio.to_thread(archive.delete, "query_history", user_id, query_id)
+        except OSError:
+            logger.exception("Error deleting archived query", extra={"user_id": user_id, "query_id": query_id})
+            return False
+
+    return {
+        **backend,
+        "get_query_history": tiered_query_history,
+        "get_user_history": tiered_user_history,
+        "search_query_history": search_everywhere,
+        "delete_user_history": delete_user_history_everywhere,
+        "delete_specific_query": delete_specific_query_everywhere,
+    }
+
+def archive_old_history(now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Move history older than HISTORY_ARCHIVE_AFTER_DAYS from the primary store into the archive
+
+    Rows are archived first and deleted from the primary store afterwards,
+    so an interrupted run loses nothing and the next one finishes it.
+    Returns the number of rows moved per table.
+    """
+    from app.db.storage_factory import oldest_history_rows, delete_history_rows
+
+    if STORAGE_MODE == "supabase" and not HISTORY_ARCHIVE_SHARED:
+        # Supabase is shared by every node but the archive directory is per node unless made otherwise
+        raise RuntimeError("Archiving Supabase history needs HISTORY_ARCHIVE_SHARED=True (a shared HISTORY_ARCHIVE_DIR or a single node)")
+
+    cutoff = (now or datetime.utcnow()) - timedelta(days=HISTORY_ARCHIVE_AFTER_DAYS)
+    moved = {}
+    for table in HISTORY_TABLES:
+        moved[table] = 0
+        while True:
+            rows = oldest_history_rows(table, cutoff, ARCHIVE_BATCH)
+            if not rows:
+                break
+            by_user: Dict[str, List[Dict]] = {}
+            for row in rows:
+                by_user.setdefault(str(row["user_id"]), []).append(row)
+            for user_id, user_rows in by_user.items():
+                archive.add(table, user_id, user_rows)
+            deleted = delete_history_rows(table, [row["id"] for row in rows])
+            moved[table] += deleted
+            if deleted == 0:
+                logger.warning("Archived history rows could not be deleted from the primary store", extra={"table": table})
+                break
+            if len(rows) < ARCHIVE_BATCH:
+                break
+    logger.info("Archived old history", extra={"cutoff": cutoff.isoformat(), **moved})
+    return moved
+
+if __name__ == "__main__":
+    # Run one archival pass by hand: python -m app.db.history_archive
+    if HISTORY_ARCHIVE_AFTER_DAYS <= 0:
+        raise SystemExit("Set HISTORY_ARCHIVE_AFTER_DAYS to archive history")
+    print(json.dumps({"moved": archive_old_history(), "archive": archive.stats()}, indent=2))
@@ -0,0 +1,101 @@
+# Full-text search over query history: an incremental in-memory index and relevance/recency ranking
+import math
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from app.core.config import BM25_K1, BM25_B, HISTORY_SEARCH_RECENCY_WEIGHT, HISTORY_SEARCH_HALF_LIFE_DAYS
+from app.db.lexical_index import tokenize
+
+# Question terms count this many times more than answer terms
+QUERY_FIELD_WEIGHT = 2
+
+def search_terms(text: str) -> List[str]:
+    """Distinct search terms of a search box entry, in order"""
+    return list(dict.fromkeys(tokenize(text)))
+
+class HistorySearchIndex:
+    """
+    BM25 index over one user's query history (question and answer text)
+
+    Unlike BM25Index, entries can be added and removed one at a time, so the
+    index follows saves and deletes instead of being rebuilt.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}  # term -> {record id: term frequency}
+        self.lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, record_id: str, query: str, answer: str):
+        if record_id in self.lengths:
+            return
+        counts = Counter(tokenize(query or "") * QUERY_FIELD_WEIGHT + tokenize(answer or ""))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[record_id] = tf
+        self.lengths[record_id] = sum(counts.values())
+        self.total_length += self.lengths[record_id]
+
+    def remove(self, record_id: str, query: str, answer: str):
+        length = self.lengths.pop(record_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in set(tokenize(query or "")) | set(tokenize(answer or "")):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(record_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def search(self, text: str, k: int) -> List[Tuple[str, float]]:
+        """The `k` best matching record ids with their BM25 scores"""
+        doc_count = len(self.lengths)
+        avg_length = self.total_length / doc_count if doc_count else 1.0
+        scores: Dict[str, float] = {}
+        for term in search_terms(text):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for record_id, tf in postings.items():
+                length_norm = 1 - self.b + self.b * self.lengths[record_id] / (avg_length or 1.0)
+                scores[record_id] = scores.get(record_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+def _age_days(timestamp: str, now: datetime) -> float:
+    try:
+        moment = datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        return math.inf
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return max(0.0, (now - moment).total_seconds() / 86400)
+
+def rank_matches(matches: List[Tuple[Dict, float]], limit: int) -> List[Dict]:
+    """
+    Order text matches by relevance boosted by recency
+
+    score = relevance * (1 + HISTORY_SEARCH_RECENCY_WEIGHT * 0.5 ** (age_days / HISTORY_SEARCH_HALF_LIFE_DAYS)),
+    so relevance decides and recency breaks near-ties (the Supabase search
+    function uses the same formula).
+
+    Args:
+        matches: (history row, relevance) pairs, relevance higher is better
+        limit: Maximum number of rows to return
+
+    Returns:
+        The rows, best first, each with its "score"
+    """
+    now = datetime.utcnow()
+    scored = []
+    for row, relevance in matches:
+        boost = 1 + HISTORY_SEARCH_RECENCY_WEIGHT * 0.5 ** (_age_days(row.get("timestamp"), now) / HISTORY_SEARCH_HALF_LIFE_DAYS)
+        scored.append({**row, "score": round(relevance * boost, 4)})
+    scored.sort(key=lambda row: row["score"], reverse=True)
+    return scored[:limit]
@@ -1,13 +1,22 @@
 # History storage using Supabase
+import asyncio
 import uuid
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
-from supabase import create_client
 
-from app.core.config import SUPABASE_URL, SUPABASE_KEY
+from app.core.config import (
+    HISTORY_SEARCH_CANDIDATES, HISTORY_SEARCH_RECENCY_WEIGHT, HISTORY_SEARCH_HALF_LIFE_DAYS,
+)
+from app.core.logging import get_logger
+from app.db.pagination import HISTORY_TABLES, Keyset
+from app.db.supabase_client import get_async_db, get_db
 
-# Initialize Supabase client
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+logger = get_logger(__name__)
+
+# The reads and deletes behind the API endpoints are coroutines on the async
+# client. The saves and the archive job's reads run in worker threads (the
+# write-behind writer, the browsing recorder, the archive job) and use the
+# blocking client.
 
 def save_browsing_history(
     user_id: str,
@@ -29,9 +38,6 @@ def save_browsing_history(
     Returns:
         The ID of the history entry
     """
-    import traceback
-    traceback.print_stack()
-    
     history_id = str(uuid.uuid4())
     
     history_data = {
@@ -45,11 +51,37 @@ def save_browsing_history(
     
     # Insert into Supabase
 
-    supabase.table("browsing_history").insert(history_data).execute()
+    get_db().table("browsing_history").insert(history_data).execute()
 
     
     return history_id
 
+def save_browsing_history_batch(entries: List[Dict]) -> List[str]:
+    """
+    Save several browsing history entries with one multi-row insert
+    
+    Args:
+        entries: Dicts with user_id, url, title and timestamp, and optionally an id and metadata
+    
+    Returns:
+        The IDs of the entries, in order
+    """
+    rows = [
+        {
+            "id": entry.get("id") or str(uuid.uuid4()),
+            "user_id": entry["user_id"],
+            "url": entry["url"],
+            "title": entry["title"],
+            "timestamp": entry["timestamp"].isoformat(),
+            "metadata": entry.get("metadata") or {}
+        }
+        for entry in entries
+    ]
+    
+    get_db().table("browsing_history").insert(rows).execute()
+    
+    return [row["id"] for row in rows]
+
 def save_query_history(
     user_id: str,
     query: str,
@@ -81,46 +113,83 @@ def save_query_history(
         "timestamp": timestamp.isoformat()
     }
     
-    supabase.table("query_history").insert(query_data).execute()
+    get_db().table("query_history").insert(query_data).execute()
     
     return query_id
 
-def get_user_history(user_id: str, limit: int = 100, offset: int = 0):
+def save_query_history_batch(entries: List[Dict]) -> List[str]:
     """
-    Get a user's browsing and query history
+    Save several query history entries with one multi-row insert
     
     Args:
-        user_id: The user's ID
-        limit: Maximum number of items to return
-        offset: Number of items to skip
+        entries: Dicts with user_id, query, answer, url and timestamp, and optionally an id
     
     Returns:
-        Dict containing browsing and query history
+        The IDs of the entries, in order
     """
-    # Get browsing history
-    browsing_response = supabase.table("browsing_history")\
-        .select("*")\
-        .eq("user_id", user_id)\
-        .order("timestamp", desc=True)\
-        .limit(limit)\
-        .offset(offset)\
-        .execute()
+    rows = [
+        {
+            "id": entry.get("id") or str(uuid.uuid4()),
+            "user_id": entry["user_id"],
+            "query": entry["query"],
+            "answer": entry["answer"],
+            "url": entry["url"],
+            "timestamp": entry["timestamp"].isoformat()
+        }
+        for entry in entries
+    ]
     
-    # Get query history
-    query_response = supabase.table("query_history")\
+    get_db().table("query_history").insert(rows).execute()
+    
+    return [row["id"] for row in rows]
+
+async def _newest_first(table: str, user_id: str, limit: int, offset: int, before: Optional[Keyset]) -> List[Dict]:
+    """A page of a user's rows ordered by (timestamp, id), newest first, starting after `before`"""
+    request = get_async_db().table(table)\
         .select("*")\
-        .eq("user_id", user_id)\
+        .eq("user_id", user_id)
+    
+    if before:
+        timestamp, row_id = before
+        # Cursor ids are any non-empty string; quoted so they cannot change the filter
+        row_id = row_id.replace("\\", "\\\\").replace('"', '\\"')
+        request = request.or_(f'timestamp.lt."{timestamp}",and(timestamp.eq."{timestamp}",id.lt."{row_id}")')
+    
+    response = await request\
         .order("timestamp", desc=True)\
+        .order("id", desc=True)\
         .limit(limit)\
         .offset(offset)\
         .execute()
     
-    return {
-        "browsing_history": browsing_response.data,
-        "query_history": query_response.data
-    }
+    return response.data
+
+async def get_user_history(user_id: str, limit: int = 100, offset: int = 0, before: Optional[Dict[str, Keyset]] = None):
+    """
+    Get a user's browsing and query history
+    
+    The two tables are read at the same time.
+    
+    Args:
+        user_id: The user's ID
+        limit: Maximum number of items to return per table
+        offset: Number of items to skip
+        before: Keyset of the last row already returned, per table; tables
+            missing from it are not read (they have no more rows)
+    
+    Returns:
+        Dict containing browsing and query history
+    """
+    tables = HISTORY_TABLES if before is None else [table for table in HISTORY_TABLES if table in before]
+    pages = await asyncio.gather(*(
+        _newest_first(table, user_id, limit, offset, (before or {}).get(table))
+        for table in tables
+    ))
+    read = dict(zip(tables, pages))
+    
+    return {table: read.get(table, []) for table in HISTORY_TABLES}
 
-def get_query_history(user_id: str, limit: int = 10, offset: int = 0):
+async def get_query_history(user_id: str, limit: int = 10, offset: int = 0, before: Optional[Keyset] = None):
     """
     Get a user's query history
     
@@ -128,22 +197,86 @@ def get_query_history(user_id: str, limit: int = 10, offset: int = 0):
         user_id: The user's ID
         limit: Maximum number of items to return
         offset: Number of items to skip
+        before: Keyset (timestamp, id) of the last item already returned
     
     Returns:
         List of query history items
     """
-    # Get query history
-    query_response = supabase.table("query_history")\
+    return await _newest_first("query_history", user_id, limit, offset, before)
+
+async def search_query_history(user_id: str, text: str, limit: int = 20) -> List[Dict]:
+    """
+    Search a user's questions and answers
+    
+    Runs the search_query_history function from supabase_setup.sql, which
+    matches against the full-text index and ranks by relevance and recency.
+    
+    Args:
+        user_id: The user's ID
+        text: The search text
+        limit: Maximum number of items to return
+    
+    Returns:
+        Matching query history items, best first, each with a "score"
+    """
+    response = await get_async_db().rpc("search_query_history", {
+        "p_user_id": user_id,
+        "p_query": text,
+        "p_limit": limit,
+        "p_candidates": HISTORY_SEARCH_CANDIDATES,
+        "p_recency_weight": HISTORY_SEARCH_RECENCY_WEIGHT,
+        "p_half_life_days": HISTORY_SEARCH_HALF_LIFE_DAYS
+    }).execute()
+    
+    return response.data
+
+def oldest_history_rows(table: str, before: datetime, limit: int = 1000) -> List[Dict]:
+    """
+    Rows of any user older than a point in time, oldest first (for archiving)
+    
+    Args:
+        table: "browsing_history" or "query_history"
+        before: Only rows with an earlier timestamp are returned
+        limit: Maximum number of rows to return
+    
+    Returns:
+        List of rows ordered by (timestamp, id)
+    """
+    response = get_db().table(table)\
         .select("*")\
-        .eq("user_id", user_id)\
-        .order("timestamp", desc=True)\
+        .lt("timestamp", before.isoformat())\
+        .order("timestamp")\
+        .order("id")\
         .limit(limit)\
-        .offset(offset)\
         .execute()
     
-    return query_response.data
+    return response.data
+
+# Ids per delete request, keeping the id list within URL length limits
+DELETE_CHUNK = 200
+
+def delete_history_rows(table: str, ids: List[str]) -> int:
+    """
+    Delete rows of any user by id
+    
+    Args:
+        table: "browsing_history" or "query_history"
+        ids: IDs of the rows to delete
+    
+    Returns:
+        The number of rows deleted
+    """
+    deleted = 0
+    for start in range(0, len(ids), DELETE_CHUNK):
+        response = get_db().table(table)\
+            .delete()\
+            .in_("id", ids[start:start + DELETE_CHUNK])\
+            .execute()
+        deleted += len(response.data)
+    
+    return deleted
 
-def delete_user_history(user_id: str, history_type: str = "all") -> bool:
+async def delete_user_history(user_id: str, history_type: str = "all") -> bool:
     """
     Delete a user's history (query history, browsing history, or both)
     
@@ -157,24 +290,24 @@ def delete_user_history(user_id: str, history_type: str = "all") -> bool:
     try:
         if history_type in ["query", "all"]:
             # Delete query history
-            supabase.table("query_history")\
+            await get_async_db().table("query_history")\
                 .delete()\
                 .eq("user_id", user_id)\
                 .execute()
         
         if history_type in ["browsing", "all"]:
             # Delete browsing history
-            supabase.table("browsing_history")\
+            await get_async_db().table("browsing_history")\
                 .delete()\
                 .eq("user_id", user_id)\
                 .execute()
         
         return True
     except Exception as e:
-        print(f"Error deleting user history: {str(e)}")
+        logger.exception("Error deleting user history", extra={"user_id": user_id, "history_type": history_type})
         return False
 
-def delete_specific_query(user_id: str, query_id: str) -> bool:
+async def delete_specific_query(user_id: str, query_id: str) -> bool:
     """
     Delete a specific query from user's history
     
@@ -187,27 +320,24 @@ def delete_specific_query(user_id: str, query_id: str) -> bool:
     """
     try:
         # First check if the query exists
-        existing_query = supabase.table("query_history")\
+        existing_query = await get_async_db().table("query_history")\
             .select("id")\
             .eq("user_id", user_id)\
             .eq("id", query_id)\
             .execute()
         
         if not existing_query.data:
-            print(f"Query with id {query_id} not found for user {user_id}")
+            logger.info("Query to delete not found", extra={"user_id": user_id, "query_id": query_id})
             return False
         
         # Delete the query
-        result = supabase.table("query_history")\
+        result = await get_async_db().table("query_history")\
             .delete()\
             .eq("user_id", user_id)\
             .eq("id", query_id)\
             .execute()
         
-        print(f"Successfully deleted query {query_id} for user {user_id}")
         return True
     except Exception as e:
-        print(f"Error deleting specific query: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error deleting query", extra={"user_id": user_id, "query_id": query_id})
         return False
@@ -0,0 +1,147 @@
+# In-process BM25 lexical index over each page's chunks
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from app.core.config import LEXICAL_INDEX_MAX_PAGES, BM25_K1, BM25_B
+
+# Identifier-friendly tokens: keeps things like "get_user_by_email", "ERR_SSL_PROTOCOL",
+# "0x80070005" or "v1.2.3" intact, and also emits their sub-parts (see tokenize).
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+(?:[._\-:/][A-Za-z0-9]+)*")
+SUBTOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it its
+me my of on or so that the their them there these this those to was what when where
+which who why will with you your about page article tell explain describe
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase lexical terms.
+
+    Compound identifiers are kept as a single term and are also split into
+    their parts, so both "get_user_by_email" and "email" match.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group(0)
+        parts = SUBTOKEN_PATTERN.findall(token)
+        if len(parts) > 1:
+            terms.append(token)
+        terms.extend(part for part in parts if part not in STOPWORDS)
+    return terms
+
+class BM25Index:
+    """Okapi BM25 inverted index over a fixed list of documents"""
+
+    def __init__(self, documents: Sequence[Document], k1: float = BM25_K1, b: float = BM25_B):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+
+        for doc_idx, doc in enumerate(self.documents):
+            term_counts = Counter(tokenize(doc.page_content))
+            self.doc_lengths.append(sum(term_counts.values()))
+            for term, tf in term_counts.items():
+                self.postings.setdefault(term, []).append((doc_idx, tf))
+
+        doc_count = len(self.documents)
+        self.avg_doc_length = (sum(self.doc_lengths) / doc_count) if doc_count else 0.0
+        self.idf = {
+            term: math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[Document, float]]:
+        """
+        Score the indexed documents against a query
+
+        Args:
+            query: The query text
+            k: Maximum number of results to return
+
+        Returns:
+            List of (document, BM25 score) tuples, best first. Documents that
+            share no terms with the query are never returned.
+        """
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for doc_idx, tf in postings:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_idx] / (self.avg_doc_length or 1.0)
+                scores[doc_idx] = scores.get(doc_idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[doc_idx], score) for doc_idx, score in ranked]
+
+# Page indexes keyed by (user_id, url), least recently used first
+_page_indexes: "OrderedDict[Tuple[str, str], BM25Index]" = OrderedDict()
+_lock = threading.Lock()
+
+def index_page(user_id: str, url: str, documents: Sequence[Document]) -> BM25Index:
+    """
+    Build (or replace) the lexical index for one page
+
+    Args:
+        user_id: The user's unique identifier
+        url: The URL of the page
+        documents: The page's chunks
+
+    Returns:
+        The new index
+    """
+    index = BM25Index(documents)
+    with _lock:
+        _page_indexes[(user_id, url)] = index
+        _page_indexes.move_to_end((user_id, url))
+        while len(_page_indexes) > LEXICAL_INDEX_MAX_PAGES:
+            _page_indexes.popitem(last=False)
+    return index
+
+def get_page_index(
+    user_id: str,
+    url: str,
+    loader: Optional[Callable[[], List[Document]]] = None
+) -> Optional[BM25Index]:
+    """
+    Get the lexical index for a page, rebuilding it with `loader` if it was evicted
+    or the process restarted since the page was ingested
+
+    Args:
+        user_id: The user's unique identifier
+        url: The URL of the page
+        loader: Optional callable returning the page's stored chunks
+
+    Returns:
+        The page index, or None if the page has no chunks
+    """
+    with _lock:
+        index = _page_indexes.get((user_id, url))
+        if index is not None:
+            _page_indexes.move_to_end((user_id, url))
+            return index
+
+    if loader is None:
+        return None
+    documents = loader()
+    if not documents:
+        return None
+    return index_page(user_id, url, documents)
+
+def drop_page_index(user_id: str, url: str):
+    """Forget the lexical index for a page"""
+    with _lock:
+        _page_indexes.pop((user_id, url), None)
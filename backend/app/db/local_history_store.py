@@ -1,22 +1,300 @@
-# Local file-based history store for testing without Supabase
+# Local file-based history store: append-only JSONL logs with an in-memory index, no database needed
+import bisect
+import heapq
+import itertools
 import json
-import uuid
 import os
-from typing import Dict, List, Optional
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
+from app.core.config import (
+    LOCAL_HISTORY_COMPACT_RATIO, LOCAL_HISTORY_COMPACT_MIN_LINES, HISTORY_SEARCH_CANDIDATES, HISTORY_SEARCH_MAX_USERS,
+)
+from app.core.logging import get_logger
+from app.db.history_search import HistorySearchIndex, rank_matches
+from app.db.pagination import HISTORY_TABLES, Keyset
+
 # Local storage file paths
-LOCAL_DB_DIR = "./local_db"
+LOCAL_DB_DIR = os.getenv("LOCAL_DB_DIR", "./local_db")
+QUERY_HISTORY_LOG = os.path.join(LOCAL_DB_DIR, "query_history.jsonl")
+BROWSING_HISTORY_LOG = os.path.join(LOCAL_DB_DIR, "browsing_history.jsonl")
+
+# Whole-file JSON arrays written by earlier versions, migrated into the logs on first use
 QUERY_HISTORY_FILE = os.path.join(LOCAL_DB_DIR, "query_history.json")
 BROWSING_HISTORY_FILE = os.path.join(LOCAL_DB_DIR, "browsing_history.json")
 
-def ensure_local_db_dir():
-    """Ensure the local database directory exists"""
-    os.makedirs(LOCAL_DB_DIR, exist_ok=True)
+logger = get_logger(__name__)
+
+# Parses one log line; skips json.loads' per-call encoding detection, which costs a third of a startup scan
+_parse_line = json.JSONDecoder().decode
+
+# (timestamp, id, byte offset, user_id) of one live record; sorts like ORDER BY timestamp, id
+Entry = Tuple[str, str, int, str]
+
+class _Index:
+    """Live records of a log: per user in timestamp order, and by id"""
+
+    def __init__(self):
+        self.by_user: Dict[str, List[Entry]] = {}
+        self.by_id: Dict[str, Entry] = {}
+        self.lines = 0    # lines in the log
+        self.garbage = 0  # lines compaction would drop: deleted records and tombstones
+
+    def put(self, record_id: str, user_id: str, timestamp: str, offset: int):
+        if record_id in self.by_id:
+            self.garbage += self.remove(record_id)
+        user_id = sys.intern(user_id)
+        entry = (timestamp, record_id, offset, user_id)
+        self.by_id[record_id] = entry
+        entries = self.by_user.setdefault(user_id, [])
+        if not entries or entries[-1] <= entry:
+            entries.append(entry)  # the usual case: records arrive in time order
+        else:
+            bisect.insort(entries, entry)
+
+    def remove(self, record_id: str) -> int:
+        entry = self.by_id.pop(record_id, None)
+        if entry is None:
+            return 0
+        entries = self.by_user[entry[3]]
+        del entries[bisect.bisect_left(entries, entry)]
+        if not entries:
+            del self.by_user[entry[3]]
+        return 1
+
+    def remove_user(self, user_id: str) -> int:
+        entries = self.by_user.pop(user_id, [])
+        for entry in entries:
+            del self.by_id[entry[1]]
+        return len(entries)
+
+    def apply(self, record: Dict, offset: int):
+        """Replay one log line: a record, or a tombstone for a record or for all of a user's records"""
+        self.lines += 1
+        if "deleted" in record:
+            self.garbage += 1 + self.remove(record["deleted"])
+        elif "deleted_user" in record:
+            self.garbage += 1 + self.remove_user(record["deleted_user"])
+        else:
+            self.put(record["id"], record["user_id"], record.get("timestamp", ""), offset)
+
+class HistoryLog:
+    """
+    One history table as an append-only JSONL file
+
+    Saves and deletes append a line (deletes append a tombstone) instead of
+    rewriting the file, and reads seek straight to a user's newest records
+    through an in-memory index built by replaying the log on first use.
+    Deleted records stay in the file until compact() rewrites it with only
+    the live ones.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._index: Optional[_Index] = None
+        self._writer = None
+        self._reader = None
+
+    def _scan(self) -> Tuple[_Index, int]:
+        """Build the index from the file; returns it with the length of the file's complete lines"""
+        index, offset, unreadable = _Index(), 0, 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn write at the end, from a crash mid-append
+                try:
+                    index.apply(_parse_line(line.decode()), offset)
+                except (ValueError, KeyError, TypeError, UnicodeDecodeError):
+                    index.lines += 1
+                    index.garbage += 1
+                    unreadable += 1
+                offset += len(line)
+        if unreadable:
+            logger.warning("Skipped unreadable history log lines", extra={"file": self.path, "lines": unreadable})
+        return index, offset
+
+    def _open(self):
+        """Load the index and open the file handles (caller holds the lock)"""
+        if self._index is not None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        open(self.path, "ab").close()
+        self._index, end = self._scan()
+        if end < os.path.getsize(self.path):
+            logger.warning("Truncating incomplete last line of history log", extra={"file": self.path})
+            os.truncate(self.path, end)
+        self._writer = open(self.path, "ab")
+        self._reader = open(self.path, "rb")
+
+    def _close(self):
+        for handle in (self._writer, self._reader):
+            if handle:
+                handle.close()
+        self._writer = self._reader = None
+
+    def _append(self, *records: Dict):
+        """Write records as lines with a single write and apply them to the index (caller holds the lock)"""
+        offset = self._writer.tell()
+        lines = [(json.dumps(record, default=str) + "\n").encode() for record in records]
+        self._writer.write(b"".join(lines))
+        self._writer.flush()
+        for record, line in zip(records, lines):
+            self._index.apply(record, offset)
+            offset += len(line)
+
+    def _read(self, entry: Entry) -> Dict:
+        self._reader.seek(entry[2])
+        return _parse_line(self._reader.readline().decode())
+
+    def load(self) -> Dict:
+        """Build the index now rather than on the first request; returns stats()"""
+        with self._lock:
+            self._open()
+        return self.stats()
+
+    def append(self, *records: Dict):
+        with self._lock:
+            self._open()
+            self._append(*records)
+
+    def newest(self, user_id: str, limit: int, offset: int = 0, before: Optional[Keyset] = None) -> List[Dict]:
+        """A user's records, newest first, starting after the (timestamp, id) keyset `before`"""
+        with self._lock:
+            self._open()
+            entries = self._index.by_user.get(user_id, [])
+            end = bisect.bisect_left(entries, before) if before else len(entries)
+            end = max(0, end - offset)
+            return [self._read(entry) for entry in reversed(entries[max(0, end - limit):end])]
+
+    def get(self, record_ids: List[str]) -> Dict[str, Dict]:
+        """Live records by id; ids that are not live are left out"""
+        with self._lock:
+            self._open()
+            entries = [self._index.by_id.get(record_id) for record_id in record_ids]
+            return {entry[1]: self._read(entry) for entry in entries if entry is not None}
+
+    def delete(self, user_id: str, record_id: str) -> Optional[Dict]:
+        """Delete one of a user's records; returns it, or None if the user has no such record"""
+        with self._lock:
+            self._open()
+            entry = self._index.by_id.get(record_id)
+            if entry is None or entry[3] != user_id:
+                return None
+            record = self._read(entry)
+            self._append({"deleted": record_id})
+            return record
+
+    def older_than(self, timestamp: str, limit: int) -> List[Dict]:
+        """Up to `limit` records of any user with a timestamp before `timestamp`, oldest first"""
+        with self._lock:
+            self._open()
+            old = [entries[:bisect.bisect_left(entries, (timestamp,))] for entries in self._index.by_user.values()]
+            return [self._read(entry) for entry in itertools.islice(heapq.merge(*old), limit)]
+
+    def delete_many(self, record_ids: List[str]) -> Dict[str, str]:
+        """Delete records of any user with one append; returns the user id of each deleted record, by id"""
+        with self._lock:
+            self._open()
+            deleted = {record_id: self._index.by_id[record_id][3] for record_id in record_ids if record_id in self._index.by_id}
+            if deleted:
+                self._append(*({"deleted": record_id} for record_id in deleted))
+            return deleted
+
+    def delete_user(self, user_id: str):
+        with self._lock:
+            self._open()
+            if user_id in self._index.by_user:
+                self._append({"deleted_user": user_id})
+
+    def records(self) -> List[Dict]:
+        """Every live record in log order (empty if the log does not exist)"""
+        if self._index is None and not os.path.exists(self.path):
+            return []
+        with self._lock:
+            self._open()
+            return [self._read(entry) for entry in sorted(self._index.by_id.values(), key=lambda e: e[2])]
+
+    def stats(self) -> Dict:
+        index = self._index
+        return {
+            "lines": index.lines if index else 0,
+            "live": len(index.by_id) if index else 0,
+            "garbage": index.garbage if index else 0,
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+    def needs_compaction(self) -> bool:
+        index = self._index
+        return (
+            index is not None
+            and index.garbage >= LOCAL_HISTORY_COMPACT_MIN_LINES
+            and index.garbage >= LOCAL_HISTORY_COMPACT_RATIO * index.lines
+        )
+
+    def compact(self):
+        """
+        Rewrite the log with only its live records
+
+        The live records are copied without holding the lock, so saves and
+        reads carry on; lines appended meanwhile are then copied and replayed
+        under the lock before the new file replaces the old one.
+        """
+        with self._compact_lock:
+            with self._lock:
+                self._open()
+                live = list(self._index.by_id.values())
+                copied_to = self._writer.tell()
+            live.sort(key=lambda entry: entry[2])
+
+            index = _Index()
+            tmp_path = self.path + ".compact"
+            with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+                for timestamp, record_id, offset, user_id in live:
+                    src.seek(offset)
+                    line = src.readline()
+                    index.lines += 1
+                    index.put(record_id, user_id, timestamp, dst.tell())
+                    dst.write(line)
+                with self._lock:
+                    src.seek(copied_to)
+                    for line in src:
+                        index.apply(_parse_line(line.decode()), dst.tell())
+                        dst.write(line)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                    self._close()
+                    os.replace(tmp_path, self.path)
+                    self._index = index
+                    self._writer = open(self.path, "ab")
+                    self._reader = open(self.path, "rb")
+
+_logs: Dict[str, HistoryLog] = {}
+_logs_lock = threading.Lock()
+
+# Search indexes of the users who searched recently, least recently used first. Built from the
+# user's records on their first search, then kept up to date by saves and deletes.
+_search_indexes: "OrderedDict[str, HistorySearchIndex]" = OrderedDict()
+_search_lock = threading.Lock()
+
+class _IndexBuild:
+    """A search index being built outside _search_lock, with the changes to replay onto it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.changes: List[Tuple[str, Dict]] = []  # ("add" or "remove", record), in order
+        self.invalidated = False
+
+# Builds in progress, by user
+_index_builds: Dict[str, _IndexBuild] = {}
 
 def load_json_file(file_path: str) -> List[Dict]:
     """Load data from a JSON file"""
-    ensure_local_db_dir()
     if not os.path.exists(file_path):
         return []
     try:
@@ -25,11 +303,58 @@ def load_json_file(file_path: str) -> List[Dict]:
     except (json.JSONDecodeError, FileNotFoundError):
         return []
 
-def save_json_file(file_path: str, data: List[Dict]):
-    """Save data to a JSON file"""
-    ensure_local_db_dir()
-    with open(file_path, 'w') as f:
-        json.dump(data, f, indent=2, default=str)
+def migrate_json_file(json_path: str, log_path: str) -> int:
+    """
+    Convert a JSON array file of an earlier version into a log, once
+
+    The JSON file is renamed to <name>.migrated afterwards, so it is kept but never read again.
+    Returns the number of records migrated.
+    """
+    if not os.path.exists(json_path) or os.path.exists(log_path):
+        return 0
+    records = sorted(load_json_file(json_path), key=lambda x: x.get("timestamp", ""))
+    tmp_path = log_path + ".migrating"
+    with open(tmp_path, "w") as f:
+        for record in records:
+            if record.get("id") and record.get("user_id"):
+                f.write(json.dumps(record, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, log_path)
+    os.replace(json_path, json_path + ".migrated")
+    logger.info("Migrated JSON history to log", extra={"file": json_path, "records": len(records)})
+    return len(records)
+
+def _log(log_path: str, json_path: str) -> HistoryLog:
+    log = _logs.get(log_path)
+    if log is None:
+        with _logs_lock:
+            log = _logs.get(log_path)
+            if log is None:
+                migrate_json_file(json_path, log_path)
+                log = _logs[log_path] = HistoryLog(log_path)
+    return log
+
+def _query_log() -> HistoryLog:
+    return _log(QUERY_HISTORY_LOG, QUERY_HISTORY_FILE)
+
+def _browsing_log() -> HistoryLog:
+    return _log(BROWSING_HISTORY_LOG, BROWSING_HISTORY_FILE)
+
+def load_history_logs() -> Dict[str, Dict]:
+    """Build both logs' indexes (at startup, so no request waits for it)"""
+    return {"query_history": _query_log().load(), "browsing_history": _browsing_log().load()}
+
+def compact_history_logs() -> Dict[str, Dict]:
+    """Compact the logs that have accumulated enough deleted records; returns stats of those compacted"""
+    compacted = {}
+    for name, log in (("query_history", _query_log()), ("browsing_history", _browsing_log())):
+        if log.needs_compaction():
+            before = log.stats()
+            log.compact()
+            compacted[name] = {"before": before, "after": log.stats()}
+            logger.info("Compacted history log", extra={"log": name, **compacted[name]})
+    return compacted
 
 def save_query_history(
     user_id: str,
@@ -41,7 +366,7 @@ def save_query_history(
 ) -> str:
     """Save a query history entry"""
     query_id = str(uuid.uuid4())
-    
+
     query_data = {
         "id": query_id,
         "user_id": user_id,
@@ -51,79 +376,161 @@ def save_query_history(
         "timestamp": timestamp.isoformat(),
         "metadata": metadata or {}
     }
-    
-    # Load existing data
-    history = load_json_file(QUERY_HISTORY_FILE)
-    
-    # Add new entry
-    history.append(query_data)
-    
-    # Save back to file
-    save_json_file(QUERY_HISTORY_FILE, history)
-    
-    print(f"[LOCAL] Saved query history: {query_id} for user {user_id}")
+
+    _query_log().append(query_data)
+    _index_for_search(query_data)
+
+    logger.debug("Saved query history", extra={"user_id": user_id, "query_id": query_id})
     return query_id
 
-def get_query_history(user_id: str, limit: int = 10, offset: int = 0) -> List[Dict]:
-    """Get a user's query history"""
-    history = load_json_file(QUERY_HISTORY_FILE)
-    
-    # Filter by user_id and sort by timestamp (newest first)
-    user_history = [item for item in history if item.get("user_id") == user_id]
-    user_history.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-    
-    # Apply pagination
-    start = offset
-    end = offset + limit
-    
-    print(f"[LOCAL] Retrieved {len(user_history[start:end])} query history items for user {user_id}")
-    return user_history[start:end]
+def save_query_history_batch(entries: List[Dict]) -> List[str]:
+    """Save several query history entries with one append to the log; returns their ids"""
+    records = [
+        {
+            "id": entry.get("id") or str(uuid.uuid4()),
+            "user_id": entry["user_id"],
+            "query": entry["query"],
+            "answer": entry["answer"],
+            "url": entry["url"],
+            "timestamp": entry["timestamp"].isoformat(),
+            "metadata": entry.get("metadata") or {}
+        }
+        for entry in entries
+    ]
+
+    _query_log().append(*records)
+    _index_for_search(*records)
+
+    logger.debug("Saved query history batch", extra={"entries": len(records)})
+    return [record["id"] for record in records]
+
+def get_user_history(user_id: str, limit: int = 100, offset: int = 0, before: Optional[Dict[str, Keyset]] = None) -> Dict:
+    """Get a user's browsing and query history; with `before`, only the tables it has a keyset for"""
+    logs = {"browsing_history": _browsing_log(), "query_history": _query_log()}
+    return {
+        table: logs[table].newest(user_id, limit, offset, before and before[table]) if before is None or table in before else []
+        for table in HISTORY_TABLES
+    }
+
+def get_query_history(user_id: str, limit: int = 10, offset: int = 0, before: Optional[Keyset] = None) -> List[Dict]:
+    """Get a user's query history, newest first"""
+    return _query_log().newest(user_id, limit, offset, before)
+
+def _index_for_search(*records: Dict):
+    """Add saved records to the search indexes of their users, where those are loaded"""
+    with _search_lock:
+        for record in records:
+            _change_search_index(record["user_id"], "add", record)
+
+def _change_search_index(user_id: str, change: str, record: Dict):
+    """Apply a saved or deleted record to the user's loaded index, or queue it for one being built (caller holds _search_lock)"""
+    index = _search_indexes.get(user_id)
+    if index is not None:
+        getattr(index, change)(record["id"], record.get("query"), record.get("answer"))
+    elif user_id in _index_builds:
+        _index_builds[user_id].changes.append((change, record))
+
+def _drop_search_index(user_id: str):
+    """Forget the user's index, to be rebuilt on their next search (caller holds _search_lock)"""
+    _search_indexes.pop(user_id, None)
+    if user_id in _index_builds:
+        _index_builds[user_id].invalidated = True
+
+def _search_index(user_id: str) -> HistorySearchIndex:
+    """
+    The user's search index, built from their records if it is not loaded
+
+    Building reads all of the user's records, so it runs outside
+    _search_lock; saves and deletes meanwhile are queued and replayed onto
+    the new index when it is installed. Other searches of the same user
+    wait for the build instead of repeating it.
+    """
+    while True:
+        with _search_lock:
+            index = _search_indexes.get(user_id)
+            if index is not None:
+                _search_indexes.move_to_end(user_id)
+                return index
+            build = _index_builds.get(user_id)
+            if build is None:
+                build = _index_builds[user_id] = _IndexBuild()
+                break
+        build.done.wait()
+
+    try:
+        index = HistorySearchIndex()
+        for record in _query_log().newest(user_id, limit=sys.maxsize):
+            index.add(record["id"], record.get("query"), record.get("answer"))
+        with _search_lock:
+            # Adding a record already read, or removing one never read, does nothing
+            for change, record in build.changes:
+                getattr(index, change)(record["id"], record.get("query"), record.get("answer"))
+            if not build.invalidated:
+                _search_indexes[user_id] = index
+                while len(_search_indexes) > HISTORY_SEARCH_MAX_USERS:
+                    _search_indexes.popitem(last=False)
+    finally:
+        with _search_lock:
+            _index_builds.pop(user_id, None)
+        build.done.set()
+    return index
+
+def search_query_history(user_id: str, text: str, limit: int = 20) -> List[Dict]:
+    """Search a user's questions and answers; best matches first, ranked by relevance and recency"""
+    index = _search_index(user_id)
+    with _search_lock:
+        candidates = index.search(text, HISTORY_SEARCH_CANDIDATES)
+    records = _query_log().get([record_id for record_id, _ in candidates])
+    return rank_matches([(records[record_id], score) for record_id, score in candidates if record_id in records], limit)
+
+def _history_log(table: str) -> HistoryLog:
+    if table not in HISTORY_TABLES:
+        raise ValueError(f"Unknown history table: {table}")
+    return _query_log() if table == "query_history" else _browsing_log()
+
+def oldest_history_rows(table: str, before: datetime, limit: int = 1000) -> List[Dict]:
+    """Up to `limit` records of any user with a timestamp before `before`, oldest first (for archiving)"""
+    return _history_log(table).older_than(before.isoformat(), limit)
+
+def delete_history_rows(table: str, ids: List[str]) -> int:
+    """Delete records of any user by id; returns how many were deleted"""
+    deleted = _history_log(table).delete_many(ids)
+    if table == "query_history":
+        # Rebuilt on the users' next search
+        with _search_lock:
+            for user_id in set(deleted.values()):
+                _drop_search_index(user_id)
+    return len(deleted)
 
 def delete_user_history(user_id: str, history_type: str = "all") -> bool:
     """Delete a user's history"""
     try:
         if history_type in ["query", "all"]:
-            history = load_json_file(QUERY_HISTORY_FILE)
-            filtered_history = [item for item in history if item.get("user_id") != user_id]
-            save_json_file(QUERY_HISTORY_FILE, filtered_history)
-            print(f"[LOCAL] Deleted all query history for user {user_id}")
-        
+            _query_log().delete_user(user_id)
+            with _search_lock:
+                _drop_search_index(user_id)
+
         if history_type in ["browsing", "all"]:
-            history = load_json_file(BROWSING_HISTORY_FILE)
-            filtered_history = [item for item in history if item.get("user_id") != user_id]
-            save_json_file(BROWSING_HISTORY_FILE, filtered_history)
-            print(f"[LOCAL] Deleted all browsing history for user {user_id}")
-        
+            _browsing_log().delete_user(user_id)
+
         return True
     except Exception as e:
-        print(f"[LOCAL] Error deleting user history: {str(e)}")
+        logger.exception("Error deleting user history", extra={"user_id": user_id, "history_type": history_type})
         return False
 
 def delete_specific_query(user_id: str, query_id: str) -> bool:
     """Delete a specific query from user's history"""
     try:
-        history = load_json_file(QUERY_HISTORY_FILE)
-        
-        # Find the query to delete
-        original_count = len(history)
-        filtered_history = [
-            item for item in history 
-            if not (item.get("user_id") == user_id and item.get("id") == query_id)
-        ]
-        
-        if len(filtered_history) == original_count:
-            print(f"[LOCAL] Query {query_id} not found for user {user_id}")
+        record = _query_log().delete(user_id, query_id)
+        if record is None:
+            logger.info("Query to delete not found", extra={"user_id": user_id, "query_id": query_id})
             return False
-        
-        # Save the filtered history
-        save_json_file(QUERY_HISTORY_FILE, filtered_history)
-        print(f"[LOCAL] Successfully deleted query {query_id} for user {user_id}")
+        with _search_lock:
+            _change_search_index(user_id, "remove", record)
         return True
-        
+
     except Exception as e:
-        print(f"[LOCAL] Error deleting specific query: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error deleting query", extra={"user_id": user_id, "query_id": query_id})
         return False
 
 def save_browsing_history(
@@ -135,7 +542,7 @@ def save_browsing_history(
 ) -> str:
     """Save a browsing history entry"""
     history_id = str(uuid.uuid4())
-    
+
     history_data = {
         "id": history_id,
         "user_id": user_id,
@@ -144,15 +551,27 @@ def save_browsing_history(
         "timestamp": timestamp.isoformat(),
         "metadata": metadata or {}
     }
-    
-    # Load existing data
-    history = load_json_file(BROWSING_HISTORY_FILE)
-    
-    # Add new entry
-    history.append(history_data)
-    
-    # Save back to file
-    save_json_file(BROWSING_HISTORY_FILE, history)
-    
-    print(f"[LOCAL] Saved browsing history: {history_id} for user {user_id}")
+
+    _browsing_log().append(history_data)
+
+    logger.debug("Saved browsing history", extra={"user_id": user_id, "history_id": history_id})
     return history_id
+
+def save_browsing_history_batch(entries: List[Dict]) -> List[str]:
+    """Save several browsing history entries with one append to the log; returns their ids"""
+    records = [
+        {
+            "id": entry.get("id") or str(uuid.uuid4()),
+            "user_id": entry["user_id"],
+            "url": entry["url"],
+            "title": entry["title"],
+            "timestamp": entry["timestamp"].isoformat(),
+            "metadata": entry.get("metadata") or {}
+        }
+        for entry in entries
+    ]
+
+    _browsing_log().append(*records)
+
+    logger.debug("Saved browsing history batch", extra={"entries": len(records)})
+    return [record["id"] for record in records]
@@ -0,0 +1,117 @@
+# Page table: page-level attributes stored once per ingested page, keyed by content_id
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence
+
+from app.core.config import VECTOR_DB_PATH
+
+PAGE_DB_FILE = os.path.join(VECTOR_DB_PATH, "pages.sqlite3")
+
+# Attributes every chunk used to carry in its metadata
+PAGE_FIELDS = ("source", "domain", "url_path", "full_url", "timestamp", "summary")
+
+_local = threading.local()
+
+def _connection() -> sqlite3.Connection:
+    """One connection per thread; the schema is created on first use"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(VECTOR_DB_PATH, exist_ok=True)
+        conn = sqlite3.connect(PAGE_DB_FILE, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                content_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                domain TEXT,
+                url_path TEXT,
+                full_url TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                summary TEXT
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_user_url ON pages(user_id, full_url)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_user_source ON pages(user_id, source)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_user_domain ON pages(user_id, domain)")
+        _local.conn = conn
+    return conn
+
+def add_page(user_id: str, content_id: str, attributes: Dict):
+    """
+    Record a newly ingested page
+
+    Args:
+        user_id: The user's unique identifier
+        content_id: The page's content ID, shared by all its chunks
+        attributes: Page-level fields (see PAGE_FIELDS)
+    """
+    conn = _connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO pages (content_id, user_id, source, domain, url_path, full_url, timestamp, summary) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (content_id, user_id, *(attributes.get(field) for field in PAGE_FIELDS)),
+        )
+
+def find_content_ids(user_id: str, field: str, value: str) -> List[str]:
+    """
+    Content IDs of a user's pages matching one page attribute
+
+    Args:
+        user_id: The user's unique identifier
+        field: "full_url", "source" or "domain"
+        value: The value to match exactly
+    """
+    if field not in ("full_url", "source", "domain"):
+        raise ValueError(f"Pages cannot be looked up by '{field}'")
+    rows = _connection().execute(
+        f"SELECT content_id FROM pages WHERE user_id = ? AND {field} = ?", (user_id, value)
+    ).fetchall()
+    return [row["content_id"] for row in rows]
+
+def get_pages(content_ids: Sequence[str]) -> Dict[str, Dict]:
+    """
+    Page attributes for a set of content IDs
+
+    Returns:
+        {content_id: {field: value}}, without fields that are not set
+    """
+    unique_ids = list(dict.fromkeys(content_id for content_id in content_ids if content_id))
+    pages = {}
+    # Stay under SQLite's bound parameter limit
+    for offset in range(0, len(unique_ids), 500):
+        batch = unique_ids[offset:offset + 500]
+        rows = _connection().execute(
+            f"SELECT * FROM pages WHERE content_id IN ({','.join('?' * len(batch))})", batch
+        ).fetchall()
+        for row in rows:
+            pages[row["content_id"]] = {
+                field: row[field] for field in PAGE_FIELDS if row[field] is not None
+            }
+    return pages
+
+def with_page_attributes(metadatas: Sequence[Optional[Dict]]) -> List[Dict]:
+    """
+    Merge page attributes back into chunk metadata, so callers see the same
+    fields chunks used to carry. Legacy chunks that still carry them are
+    returned unchanged.
+    """
+    pages = get_pages([(metadata or {}).get("content_id") for metadata in metadatas])
+    merged = []
+    for metadata in metadatas:
+        metadata = metadata or {}
+        page = pages.get(metadata.get("content_id"), {})
+        merged.append({**page, **metadata})
+    return merged
+
+def delete_pages(content_ids: Sequence[str]):
+    """Delete pages by content ID"""
+    conn = _connection()
+    with conn:
+        conn.executemany("DELETE FROM pages WHERE content_id = ?", [(content_id,) for content_id in content_ids])
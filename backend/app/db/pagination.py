@@ -0,0 +1,56 @@
+# Opaque keyset cursors for newest-first history pages
+import base64
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# History tables, in the order get_user_history returns them
+HISTORY_TABLES = ("browsing_history", "query_history")
+
+# (timestamp, id) of the last row a client has seen; the next page holds the rows ordered before it
+Keyset = Tuple[str, str]
+
+class InvalidCursor(ValueError):
+    """A cursor that was not produced by encode_cursor"""
+
+def encode_cursor(positions: Dict[str, Keyset]) -> str:
+    """A URL-safe cursor holding one keyset per history table"""
+    payload = json.dumps({table: list(position) for table, position in positions.items()}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Dict[str, Keyset]:
+    """
+    The keysets in a cursor, by table
+
+    Timestamps are validated, since backends put them into queries; ids only
+    have to be non-empty strings, as backends use different id formats (and
+    imported rows keep theirs). Raises InvalidCursor for anything
+    encode_cursor could not have produced.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        positions = {}
+        for table, (timestamp, row_id) in payload.items():
+            if table not in HISTORY_TABLES:
+                raise ValueError(table)
+            datetime.fromisoformat(timestamp)
+            if not isinstance(row_id, str) or not row_id:
+                raise ValueError(row_id)
+            positions[table] = (timestamp, row_id)
+        return positions
+    except (ValueError, TypeError, AttributeError):
+        raise InvalidCursor("Invalid cursor")
+
+def last_keyset(rows: List[Dict]) -> Keyset:
+    """The keyset of a page's last row"""
+    return str(rows[-1]["timestamp"]), str(rows[-1]["id"])
+
+def next_cursor(pages: Dict[str, List[Dict]], limit: int) -> Optional[str]:
+    """
+    The cursor for the pages after `pages`, or None when every table is exhausted
+
+    Only tables whose page was full are included; a table missing from a
+    cursor has no more rows and is not read again.
+    """
+    positions = {table: last_keyset(rows) for table, rows in pages.items() if rows and len(rows) >= limit}
+    return encode_cursor(positions) if positions else None
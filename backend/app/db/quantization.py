@@ -0,0 +1,98 @@
+# Compact chunk vector encodings (int8 scalar and binary quantization)
+import math
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+
+def encode_vector(vector: Sequence[float], mode: str) -> Tuple[bytes, float]:
+    """
+    Encode one embedding for compact storage
+
+    int8: symmetric scalar quantization, one signed byte per dimension plus
+    a per-vector scale (4x smaller than float32).
+    binary: one sign bit per dimension (32x smaller than float32); the scale
+    is the vector norm divided by sqrt(dim), so a dequantized vector keeps
+    its magnitude.
+
+    Args:
+        vector: The float embedding
+        mode: "int8" or "binary"
+
+    Returns:
+        (codes, scale)
+    """
+    values = np.asarray(vector, dtype=np.float32)
+    if mode == "int8":
+        scale = float(np.abs(values).max()) / 127.0 or 1.0
+        codes = np.clip(np.rint(values / scale), -127, 127).astype(np.int8).tobytes()
+    elif mode == "binary":
+        scale = float(np.linalg.norm(values)) / math.sqrt(len(values)) or 1.0
+        codes = np.packbits(values > 0).tobytes()
+    else:
+        raise ValueError(f"Unknown quantization mode '{mode}'")
+    return codes, scale
+
+def decode_vectors(encoded: Sequence[Tuple[bytes, float]], mode: str, dim: int) -> np.ndarray:
+    """
+    Decode stored codes into an (n, dim) float32 matrix
+
+    Binary codes decode to +/-scale per dimension. Scoring a full-precision
+    query against these is the usual rescoring step for binary embeddings:
+    much closer to float ranking than Hamming distance alone.
+    """
+    rows = []
+    for codes, scale in encoded:
+        if mode == "int8":
+            rows.append(np.frombuffer(codes, dtype=np.int8).astype(np.float32) * scale)
+        else:
+            bits = np.unpackbits(np.frombuffer(codes, dtype=np.uint8))[:dim]
+            rows.append((bits.astype(np.float32) * 2.0 - 1.0) * scale)
+    if not rows:
+        return np.zeros((0, dim), dtype=np.float32)
+    return np.vstack(rows)
+
+def hamming_candidates(query: np.ndarray, encoded: Sequence[Tuple[bytes, float]], limit: int) -> List[int]:
+    """Indices of the `limit` binary codes closest to the query's sign bits"""
+    query_bits = np.packbits(query > 0)
+    distances = [
+        int(np.unpackbits(np.bitwise_xor(query_bits, np.frombuffer(codes, dtype=np.uint8))).sum())
+        for codes, scale in encoded
+    ]
+    return sorted(range(len(distances)), key=distances.__getitem__)[:limit]
+
+def similarity_to_relevance(similarity: float, space: str) -> float:
+    """
+    Map a cosine similarity between unit vectors to the relevance score LangChain's
+    Chroma wrapper reports for the same pair, so one threshold works on both paths.
+    `space` is the collection's hnsw:space, which may predate the current HNSW_SPACE.
+    """
+    if space == "l2":
+        # Chroma reports squared L2 distance; LangChain maps it with 1 - d / sqrt(2)
+        return 1.0 - (2.0 - 2.0 * similarity) / math.sqrt(2)
+    # cosine: 1 - cosine distance; ip: 1 - (1 - dot)
+    return similarity
+
+def score_vectors(query: Sequence[float], encoded: Sequence[Tuple[bytes, float]], mode: str, k: int,
+                  space: str) -> List[Tuple[int, float]]:
+    """
+    Rank encoded vectors against a full-precision query
+
+    For binary codes, candidates are first shortlisted by Hamming distance
+    (4k of them) and then rescored with the float query.
+
+    Returns:
+        List of (index into `encoded`, relevance score for `space`), best first
+    """
+    query_vector = np.asarray(query, dtype=np.float32)
+    indices = list(range(len(encoded)))
+    if mode == "binary" and len(encoded) > 4 * k:
+        indices = hamming_candidates(query_vector, encoded, 4 * k)
+
+    matrix = decode_vectors([encoded[i] for i in indices], mode, len(query_vector))
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+    similarities = (matrix @ query_vector) / np.where(norms == 0, 1.0, norms)
+
+    ranked = sorted(zip(indices, similarities.tolist()), key=lambda item: item[1], reverse=True)[:k]
+    return [(index, similarity_to_relevance(similarity, space)) for index, similarity in ranked]
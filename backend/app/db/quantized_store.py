@@ -0,0 +1,70 @@
+# SQLite side store for quantized chunk vectors
+import os
+import sqlite3
+import threading
+from typing import List, Sequence, Tuple
+
+from app.core.config import VECTOR_DB_PATH
+
+QUANTIZED_DB_FILE = os.path.join(VECTOR_DB_PATH, "quantized_vectors.sqlite3")
+
+_local = threading.local()
+
+def _connection() -> sqlite3.Connection:
+    """One connection per thread; the schema is created on first use"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(VECTOR_DB_PATH, exist_ok=True)
+        conn = sqlite3.connect(QUANTIZED_DB_FILE, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunk_vectors (
+                chunk_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                encoding TEXT NOT NULL,
+                codes BLOB NOT NULL,
+                scale REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_vectors_page ON chunk_vectors(user_id, url)")
+        _local.conn = conn
+    return conn
+
+def add_vectors(user_id: str, url: str, encoding: str, rows: Sequence[Tuple[str, bytes, float]]):
+    """
+    Store encoded vectors for one page
+
+    Args:
+        user_id: The user's unique identifier
+        url: The URL of the page
+        encoding: "int8" or "binary"
+        rows: (chunk_id, codes, scale) tuples
+    """
+    conn = _connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_vectors (chunk_id, user_id, url, encoding, codes, scale) VALUES (?, ?, ?, ?, ?, ?)",
+            [(chunk_id, user_id, url, encoding, codes, scale) for chunk_id, codes, scale in rows],
+        )
+
+def get_page_vectors(user_id: str, url: str, encoding: str) -> List[Tuple[str, bytes, float]]:
+    """
+    Load the encoded vectors of one page
+
+    Returns:
+        List of (chunk_id, codes, scale) tuples
+    """
+    return _connection().execute(
+        "SELECT chunk_id, codes, scale FROM chunk_vectors WHERE user_id = ? AND url = ? AND encoding = ?",
+        (user_id, url, encoding),
+    ).fetchall()
+
+def delete_vectors(chunk_ids: Sequence[str]):
+    """Delete encoded vectors by chunk ID"""
+    conn = _connection()
+    with conn:
+        conn.executemany("DELETE FROM chunk_vectors WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
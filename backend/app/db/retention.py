@@ -0,0 +1,456 @@
+# Vector store retention: TTL and LRU eviction of stored pages, plus index compaction
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from app.core.config import (
+    VECTOR_DB_PATH,
+    RETENTION_MAX_PAGES,
+    RETENTION_MAX_CHUNKS,
+    RETENTION_TTL_DAYS,
+    RETENTION_REBUILD_THRESHOLD,
+    RETENTION_REBUILD_IDLE_SECONDS,
+    VECTOR_QUANTIZATION,
+)
+from app.core.logging import get_logger
+from app.db.vector_store import (
+    PLACEHOLDER_EMBEDDING,
+    chroma_client,
+    collection_lock,
+    collection_name_for_user,
+    get_index_params,
+    user_id_from_collection,
+)
+from app.db.lexical_index import drop_page_index
+from app.db.quantization import encode_vector
+from app.db.quantized_store import add_vectors, delete_vectors
+from app.db.page_store import get_pages, delete_pages, with_page_attributes
+
+PAGE_ACCESS_FILE = os.path.join(VECTOR_DB_PATH, "page_access.json")
+# Float collections already copied into quantized ones: {"<collection>:<mode>": chunk count copied}
+MIGRATIONS_FILE = os.path.join(VECTOR_DB_PATH, "quantization_migrations.json")
+REBUILD_SUFFIX = "__rebuild"
+BATCH_SIZE = 500
+
+logger = get_logger(__name__)
+
+# Last time each page was queried: {user_id: {url: iso timestamp}}.
+# Updated in memory on the hot path and written to disk by the compaction job.
+_page_access: Optional[Dict[str, Dict[str, str]]] = None
+_access_lock = threading.Lock()
+
+def _load_page_access() -> Dict[str, Dict[str, str]]:
+    global _page_access
+    if _page_access is None:
+        try:
+            with open(PAGE_ACCESS_FILE, "r") as f:
+                _page_access = json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            _page_access = {}
+    return _page_access
+
+def save_page_access():
+    """Persist the page access times"""
+    with _access_lock:
+        snapshot = json.dumps(_load_page_access())
+    tmp_path = f"{PAGE_ACCESS_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(snapshot)
+    os.replace(tmp_path, PAGE_ACCESS_FILE)
+
+def record_page_access(user_id: str, url: str, when: Optional[datetime] = None):
+    """Mark a page as just queried, for LRU eviction"""
+    stamp = (when or datetime.utcnow()).isoformat()
+    with _access_lock:
+        _load_page_access().setdefault(user_id, {})[url] = stamp
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _collection_names() -> List[str]:
+    # list_collections returns names in newer Chroma releases and Collection objects in older ones
+    return [c if isinstance(c, str) else c.name for c in chroma_client.list_collections()]
+
+def select_pages_to_evict(
+    pages: Dict[str, Dict],
+    now: datetime,
+    max_pages: int = RETENTION_MAX_PAGES,
+    max_chunks: int = RETENTION_MAX_CHUNKS,
+    ttl_days: int = RETENTION_TTL_DAYS
+) -> List[str]:
+    """
+    Decide which pages of one user to evict
+
+    Pages older than the TTL (by ingestion time) go first. Then, while the
+    user is over the page or chunk limit, the least recently queried pages
+    are evicted. A limit of 0 disables that rule.
+
+    Args:
+        pages: {url: {"ids": [...], "ingested": iso, "last_used": iso}}
+        now: Current UTC time
+
+    Returns:
+        List of URLs to evict
+    """
+    evicted = []
+    remaining = dict(pages)
+
+    if ttl_days > 0:
+        cutoff = (now - timedelta(days=ttl_days)).isoformat()
+        for url, page in pages.items():
+            if page["ingested"] < cutoff:
+                evicted.append(url)
+                del remaining[url]
+
+    chunk_count = sum(len(page["ids"]) for page in remaining.values())
+    for url in sorted(remaining, key=lambda u: remaining[u]["last_used"]):
+        over_pages = max_pages > 0 and len(remaining) > max_pages
+        over_chunks = max_chunks > 0 and chunk_count > max_chunks
+        if not (over_pages or over_chunks):
+            break
+        chunk_count -= len(remaining[url]["ids"])
+        del remaining[url]
+        evicted.append(url)
+
+    return evicted
+
+def _group_pages(user_id: str, collection) -> Dict[str, Dict]:
+    """Group a collection's chunk ids by page, with ingestion and last query times"""
+    results = collection.get(include=["metadatas"])
+    with _access_lock:
+        access = dict(_load_page_access().get(user_id, {}))
+    page_rows = get_pages([(metadata or {}).get("content_id") for metadata in results["metadatas"]])
+
+    pages: Dict[str, Dict] = {}
+    for chunk_id, metadata in zip(results["ids"], results["metadatas"]):
+        # Page attributes come from the page table, or from the chunk itself for legacy chunks
+        metadata = {**page_rows.get((metadata or {}).get("content_id"), {}), **(metadata or {})}
+        url = metadata.get("source") or metadata.get("full_url") or ""
+        ingested = metadata.get("timestamp") or ""
+        page = pages.setdefault(url, {"ids": [], "content_ids": set(), "ingested": ingested})
+        page["ids"].append(chunk_id)
+        if metadata.get("content_id"):
+            page["content_ids"].add(metadata["content_id"])
+        page["ingested"] = min(page["ingested"], ingested) if page["ingested"] else ingested
+
+    for url, page in pages.items():
+        page["last_used"] = max(page["ingested"], access.get(url, ""))
+    return pages
+
+def _copy_collection(source, target):
+    """Copy every record of one collection into another, in batches"""
+    total = source.count()
+    for offset in range(0, total, BATCH_SIZE):
+        batch = source.get(offset=offset, limit=BATCH_SIZE, include=["embeddings", "documents", "metadatas"])
+        if batch["ids"]:
+            target.add(
+                ids=batch["ids"],
+                embeddings=batch["embeddings"],
+                documents=batch["documents"],
+                metadatas=batch["metadatas"],
+            )
+
+def _sync_collection(source, target):
+    """Bring a copy up to date with records added to or deleted from its source since it was made"""
+    source_ids = set(source.get(include=[])["ids"])
+    target_ids = set(target.get(include=[])["ids"])
+    added = sorted(source_ids - target_ids)
+    for offset in range(0, len(added), BATCH_SIZE):
+        batch = source.get(ids=added[offset:offset + BATCH_SIZE], include=["embeddings", "documents", "metadatas"])
+        target.add(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"],
+        )
+    removed = sorted(target_ids - source_ids)
+    for offset in range(0, len(removed), BATCH_SIZE):
+        target.delete(ids=removed[offset:offset + BATCH_SIZE])
+
+def rebuild_collection(collection_name: str):
+    """
+    Rebuild a collection from its live records
+
+    Chroma marks deleted HNSW elements instead of removing them, so after
+    large deletions the index keeps its size and search visits dead nodes.
+    Copying the live records into a fresh collection drops them, and also
+    applies the currently configured HNSW parameters.
+
+    The bulk copy runs while the collection stays in use. The swap holds the
+    collection's lock: what was ingested during the copy is carried over,
+    and ingestion and requests opening the collection wait until the
+    rebuilt one is in place.
+    """
+    temp_name = f"{collection_name}{REBUILD_SUFFIX}"
+    try:
+        chroma_client.delete_collection(temp_name)
+    except Exception:
+        pass
+
+    source = chroma_client.get_collection(collection_name)
+    temp = chroma_client.create_collection(name=temp_name, metadata=get_index_params())
+    _copy_collection(source, temp)
+
+    with collection_lock(collection_name):
+        _sync_collection(source, temp)
+        chroma_client.delete_collection(collection_name)
+        _finish_rebuild(collection_name, temp)
+
+def _finish_rebuild(collection_name: str, temp):
+    """Swap a rebuilt collection into place once the original has been deleted"""
+    try:
+        temp.modify(name=collection_name)
+    except Exception:
+        # After an interrupted rebuild, a request may have recreated the collection: merge its records in
+        recreated = chroma_client.get_collection(collection_name)
+        _copy_collection(recreated, temp)
+        chroma_client.delete_collection(collection_name)
+        temp.modify(name=collection_name)
+
+def _recover_interrupted_rebuilds(names: List[str]):
+    """Finish rebuilds that were interrupted after the original collection was deleted"""
+    for name in names:
+        if not name.endswith(REBUILD_SUFFIX):
+            continue
+        original = name[: -len(REBUILD_SUFFIX)]
+        if original in names:
+            # The original is intact, so the copy is incomplete; discard it
+            chroma_client.delete_collection(name)
+        else:
+            logger.warning("Recovering interrupted collection rebuild", extra={"collection": original})
+            with collection_lock(original):
+                _finish_rebuild(original, chroma_client.get_collection(name))
+
+def _in_use(collection_name: str) -> bool:
+    """Whether a collection is a user collection of the configured VECTOR_QUANTIZATION mode"""
+    if not collection_name.startswith("user_") or collection_name.endswith(REBUILD_SUFFIX):
+        return False
+    return collection_name == collection_name_for_user(user_id_from_collection(collection_name))
+
+def drop_unused_collections() -> List[str]:
+    """
+    Delete the user collections of other VECTOR_QUANTIZATION modes
+
+    Switching modes leaves each user's previous collection behind (a switch
+    to quantized storage copies its records; a switch back uses it again).
+    Its chunks share IDs and pages with the collection in use, so only the
+    Chroma collection itself is deleted.
+
+    Returns:
+        Names of the deleted collections
+    """
+    dropped = []
+    for name in _collection_names():
+        if name.startswith("user_") and not name.endswith(REBUILD_SUFFIX) and not _in_use(name):
+            with collection_lock(name):
+                chroma_client.delete_collection(name)
+            dropped.append(name)
+    logger.info("Dropped unused collections", extra={"collections": len(dropped)})
+    return dropped
+
+def _load_migrations() -> Dict[str, int]:
+    try:
+        with open(MIGRATIONS_FILE, "r") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, FileNotFoundError):
+        return {}
+
+def _save_migrations(migrations: Dict[str, int]):
+    tmp_path = f"{MIGRATIONS_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(migrations, f)
+    os.replace(tmp_path, MIGRATIONS_FILE)
+
+def _migrate_collection(source, user_id: str) -> int:
+    """Copy one float collection into the user's quantized collection, returning the chunks copied"""
+    target_name = collection_name_for_user(user_id)
+    with collection_lock(target_name):
+        target = chroma_client.get_or_create_collection(name=target_name, metadata=get_index_params())
+    copied = 0
+    for offset in range(0, source.count(), BATCH_SIZE):
+        batch = source.get(offset=offset, limit=BATCH_SIZE, include=["embeddings", "documents", "metadatas"])
+        if not batch["ids"]:
+            break
+        with collection_lock(target_name):
+            # Chunks ingested since quantization was turned on, or copied by an interrupted pass
+            present = set(target.get(ids=batch["ids"], include=[])["ids"])
+            rows = [
+                row for row in zip(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+                if row[0] not in present
+            ]
+            if not rows:
+                continue
+            ids = [row[0] for row in rows]
+            metadatas = [row[3] or {} for row in rows]
+            by_page: Dict[str, List[tuple]] = {}
+            for (chunk_id, vector, _, _), page in zip(rows, with_page_attributes(metadatas)):
+                url = page.get("full_url") or page.get("source") or ""
+                by_page.setdefault(url, []).append((chunk_id, *encode_vector(vector, VECTOR_QUANTIZATION)))
+            for url, vectors in by_page.items():
+                add_vectors(user_id, url, VECTOR_QUANTIZATION, vectors)
+            target.add(
+                ids=ids,
+                documents=[row[2] for row in rows],
+                metadatas=metadatas,
+                embeddings=[PLACEHOLDER_EMBEDDING] * len(ids)
+            )
+            copied += len(ids)
+    return copied
+
+def migrate_to_quantized() -> Dict:
+    """
+    Copy each user's float collection into their collection of the configured quantized mode
+
+    Turning VECTOR_QUANTIZATION on gives users a collection of their own for
+    the mode; without this their stored pages would be missing from it. The
+    float vectors are encoded instead of embedding the pages again, and the
+    float collection is left in place (switching back to "none" uses it
+    again; --drop-unused deletes it). Runs in the background at startup, so
+    a user's older pages show up in their searches as their collection is copied.
+
+    Returns:
+        Summary with the number of collections and chunks migrated
+    """
+    if VECTOR_QUANTIZATION == "none":
+        return {"collections_migrated": 0, "chunks_copied": 0}
+    start = time.perf_counter()
+    migrations = _load_migrations()
+    migrated = copied = 0
+    for name in _collection_names():
+        if not name.startswith("user_") or name.endswith(REBUILD_SUFFIX):
+            continue
+        user_id = user_id_from_collection(name)
+        if name != collection_name_for_user(user_id, "none"):
+            continue
+        key = f"{name}:{VECTOR_QUANTIZATION}"
+        try:
+            source = chroma_client.get_collection(name)
+            total = source.count()
+            # Skipped unless pages were added to it since (quantization switched off and on again)
+            if not total or migrations.get(key) == total:
+                continue
+            logger.info("Quantizing stored vectors", extra={"user_id": user_id, "encoding": VECTOR_QUANTIZATION, "chunks": total})
+            copied += _migrate_collection(source, user_id)
+        except Exception as e:
+            logger.exception("Error quantizing collection", extra={"collection": name})
+            continue
+        migrations[key] = total
+        _save_migrations(migrations)
+        migrated += 1
+
+    summary = {
+        "collections_migrated": migrated,
+        "chunks_copied": copied,
+        "duration_seconds": round(time.perf_counter() - start, 3),
+    }
+    logger.info("Vector quantization migration finished", extra=summary)
+    return summary
+
+def compact_user_collection(collection_name: str, now: Optional[datetime] = None) -> Dict:
+    """
+    Apply the retention policy to one user collection
+
+    Args:
+        collection_name: The user's collection (see collection_name_for_user)
+        now: Current UTC time
+
+    Returns:
+        Dict with the number of evicted pages and chunks and whether the index was rebuilt
+    """
+    now = now or datetime.utcnow()
+    user_id = user_id_from_collection(collection_name)
+    collection = chroma_client.get_collection(collection_name)
+
+    pages = _group_pages(user_id, collection)
+    total_chunks = sum(len(page["ids"]) for page in pages.values())
+    evicted_urls = select_pages_to_evict(pages, now)
+
+    evicted_ids = [chunk_id for url in evicted_urls for chunk_id in pages[url]["ids"]]
+    for offset in range(0, len(evicted_ids), BATCH_SIZE):
+        collection.delete(ids=evicted_ids[offset:offset + BATCH_SIZE])
+    delete_vectors(evicted_ids)
+    delete_pages([content_id for url in evicted_urls for content_id in pages[url]["content_ids"]])
+
+    with _access_lock:
+        user_access = _load_page_access().get(user_id, {})
+        for url in evicted_urls:
+            user_access.pop(url, None)
+    for url in evicted_urls:
+        drop_page_index(user_id, url)
+
+    # Rebuild after large deletions, but not while the user is actively querying
+    rebuilt = False
+    last_activity = max((page["last_used"] for url, page in pages.items() if url not in evicted_urls), default="")
+    idle = last_activity < (now - timedelta(seconds=RETENTION_REBUILD_IDLE_SECONDS)).isoformat()
+    if total_chunks and len(evicted_ids) / total_chunks >= RETENTION_REBUILD_THRESHOLD and idle:
+        rebuild_collection(collection_name)
+        rebuilt = True
+
+    return {
+        "collection": collection_name,
+        "evicted_pages": len(evicted_urls),
+        "evicted_chunks": len(evicted_ids),
+        "remaining_chunks": total_chunks - len(evicted_ids),
+        "rebuilt": rebuilt,
+    }
+
+def run_compaction() -> Dict:
+    """
+    Run one retention and compaction pass over every user collection
+
+    Returns:
+        Summary with per-collection results and the disk space reclaimed
+    """
+    start = time.perf_counter()
+    bytes_before = _directory_size(VECTOR_DB_PATH)
+
+    names = _collection_names()
+    _recover_interrupted_rebuilds(names)
+
+    results = []
+    for name in names:
+        if not _in_use(name):
+            continue
+        try:
+            result = compact_user_collection(name)
+        except Exception as e:
+            logger.exception("Error compacting collection", extra={"collection": name})
+            continue
+        if result["evicted_chunks"]:
+            results.append(result)
+
+    save_page_access()
+    bytes_after = _directory_size(VECTOR_DB_PATH)
+    summary = {
+        "collections_compacted": len(results),
+        "evicted_pages": sum(r["evicted_pages"] for r in results),
+        "evicted_chunks": sum(r["evicted_chunks"] for r in results),
+        "rebuilt": sum(1 for r in results if r["rebuilt"]),
+        "reclaimed_bytes": max(0, bytes_before - bytes_after),
+        "duration_seconds": round(time.perf_counter() - start, 3),
+        "results": results,
+    }
+    logger.info("Vector store compaction finished", extra={key: value for key, value in summary.items() if key != "results"})
+    return summary
+
+if __name__ == "__main__":
+    # Run a single pass from the command line: python -m app.db.retention
+    # With --drop-unused, delete the collections of other quantization modes instead;
+    # with --migrate, copy float collections into the configured quantized mode
+    if "--drop-unused" in sys.argv[1:]:
+        print(json.dumps(drop_unused_collections(), indent=2))
+    elif "--migrate" in sys.argv[1:]:
+        print(json.dumps(migrate_to_quantized(), indent=2))
+    else:
+        print(json.dumps(run_compaction(), indent=2))
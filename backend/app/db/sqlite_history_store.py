@@ -0,0 +1,320 @@
+# History storage in an embedded SQLite database (WAL mode)
+import json
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.core.config import HISTORY_SEARCH_CANDIDATES
+from app.core.logging import get_logger
+from app.db.history_search import rank_matches, search_terms
+from app.db.local_history_store import HistoryLog
+from app.db.pagination import HISTORY_TABLES, Keyset
+
+LOCAL_DB_DIR = os.getenv("LOCAL_DB_DIR", "./local_db")
+HISTORY_DB_FILE = os.getenv("SQLITE_HISTORY_PATH", os.path.join(LOCAL_DB_DIR, "history.sqlite3"))
+
+# History of the file-based local store (JSONL logs, or JSON files of earlier versions), imported once into a new database
+QUERY_HISTORY_FILE = os.path.join(LOCAL_DB_DIR, "query_history.json")
+BROWSING_HISTORY_FILE = os.path.join(LOCAL_DB_DIR, "browsing_history.json")
+QUERY_HISTORY_LOG = os.path.join(LOCAL_DB_DIR, "query_history.jsonl")
+BROWSING_HISTORY_LOG = os.path.join(LOCAL_DB_DIR, "browsing_history.jsonl")
+
+logger = get_logger(__name__)
+
+_local = threading.local()
+_import_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_history (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    query TEXT NOT NULL,
+    answer TEXT,
+    url TEXT,
+    timestamp TEXT NOT NULL,
+    metadata TEXT
+);
+DROP INDEX IF EXISTS idx_query_history_user_time;
+CREATE INDEX IF NOT EXISTS idx_query_history_user_time_id ON query_history(user_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_query_history_time_id ON query_history(timestamp, id);
+CREATE TABLE IF NOT EXISTS browsing_history (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    title TEXT,
+    timestamp TEXT NOT NULL,
+    metadata TEXT
+);
+DROP INDEX IF EXISTS idx_browsing_history_user_time;
+CREATE INDEX IF NOT EXISTS idx_browsing_history_user_time_id ON browsing_history(user_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_browsing_history_time_id ON browsing_history(timestamp, id);
+-- Full-text index of query history for search. It indexes query_history's own rows (external content)
+-- by rowid and is kept in sync by the triggers below; rebuild it if the database is ever VACUUMed.
+CREATE VIRTUAL TABLE IF NOT EXISTS query_history_fts USING fts5(
+    user_id, query, answer, content='query_history', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS query_history_fts_insert AFTER INSERT ON query_history BEGIN
+    INSERT INTO query_history_fts(rowid, user_id, query, answer) VALUES (new.rowid, new.user_id, new.query, new.answer);
+END;
+CREATE TRIGGER IF NOT EXISTS query_history_fts_delete AFTER DELETE ON query_history BEGIN
+    INSERT INTO query_history_fts(query_history_fts, rowid, user_id, query, answer)
+    VALUES ('delete', old.rowid, old.user_id, old.query, old.answer);
+END;
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    applied_at TEXT NOT NULL
+);
+"""
+
+def _connection() -> sqlite3.Connection:
+    """One connection per thread; the schema is created (and JSON history imported) on first use"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(HISTORY_DB_FILE) or ".", exist_ok=True)
+        conn = sqlite3.connect(HISTORY_DB_FILE, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+        _build_search_index_once(conn)
+        _import_json_once(conn)
+    return conn
+
+def _row(row: sqlite3.Row) -> Dict:
+    item = dict(row)
+    item["metadata"] = json.loads(item["metadata"]) if item.get("metadata") else {}
+    return item
+
+def _load_json(file_path: str) -> List[Dict]:
+    if not os.path.exists(file_path):
+        return []
+    try:
+        with open(file_path, "r") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, FileNotFoundError):
+        logger.warning("Skipping unreadable history file", extra={"file": file_path})
+        return []
+
+def import_json_history(conn: Optional[sqlite3.Connection] = None) -> Dict[str, int]:
+    """
+    Copy the file-based local store's history into the database
+
+    Rows whose id is already present are skipped, so running it again is harmless.
+
+    Returns:
+        Number of rows read for each table
+    """
+    conn = conn or _connection()
+    queries = _load_json(QUERY_HISTORY_FILE) + HistoryLog(QUERY_HISTORY_LOG).records()
+    pages = _load_json(BROWSING_HISTORY_FILE) + HistoryLog(BROWSING_HISTORY_LOG).records()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO query_history (id, user_id, query, answer, url, timestamp, metadata) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (item.get("id") or str(uuid.uuid4()), item["user_id"], item.get("query", ""), item.get("answer"),
+                 item.get("url"), str(item.get("timestamp", "")), json.dumps(item.get("metadata") or {}))
+                for item in queries if item.get("user_id")
+            ],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO browsing_history (id, user_id, url, title, timestamp, metadata) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (item.get("id") or str(uuid.uuid4()), item["user_id"], item.get("url", ""), item.get("title"),
+                 str(item.get("timestamp", "")), json.dumps(item.get("metadata") or {}))
+                for item in pages if item.get("user_id")
+            ],
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO migrations (name, applied_at) VALUES ('json_import', ?)",
+            (datetime.utcnow().isoformat(),),
+        )
+    return {"query_history": len(queries), "browsing_history": len(pages)}
+
+def _build_search_index_once(conn: sqlite3.Connection):
+    """Index the rows of a database created before the full-text index existed"""
+    with _import_lock:
+        if conn.execute("SELECT 1 FROM migrations WHERE name = 'search_index'").fetchone():
+            return
+        with conn:
+            conn.execute("INSERT INTO query_history_fts(query_history_fts) VALUES ('rebuild')")
+            conn.execute(
+                "INSERT OR REPLACE INTO migrations (name, applied_at) VALUES ('search_index', ?)",
+                (datetime.utcnow().isoformat(),),
+            )
+
+def _import_json_once(conn: sqlite3.Connection):
+    """Import existing local history the first time any process opens the database"""
+    with _import_lock:
+        if conn.execute("SELECT 1 FROM migrations WHERE name = 'json_import'").fetchone():
+            return
+        counts = import_json_history(conn)
+        if any(counts.values()):
+            logger.info("Imported local history into SQLite", extra=counts)
+
+def save_query_history(
+    user_id: str,
+    query: str,
+    answer: str,
+    url: str,
+    timestamp: datetime,
+    metadata: Optional[Dict] = None
+) -> str:
+    """Save a query history entry"""
+    query_id = str(uuid.uuid4())
+    conn = _connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO query_history (id, user_id, query, answer, url, timestamp, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (query_id, user_id, query, answer, url, timestamp.isoformat(), json.dumps(metadata or {})),
+        )
+    return query_id
+
+def save_query_history_batch(entries: List[Dict]) -> List[str]:
+    """Save several query history entries in one transaction; returns their ids"""
+    rows = [
+        (entry.get("id") or str(uuid.uuid4()), entry["user_id"], entry["query"], entry["answer"], entry["url"],
+         entry["timestamp"].isoformat(), json.dumps(entry.get("metadata") or {}))
+        for entry in entries
+    ]
+    conn = _connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO query_history (id, user_id, query, answer, url, timestamp, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    return [row[0] for row in rows]
+
+def save_browsing_history(
+    user_id: str,
+    url: str,
+    title: str,
+    timestamp: datetime,
+    metadata: Optional[Dict] = None
+) -> str:
+    """Save a browsing history entry"""
+    history_id = str(uuid.uuid4())
+    conn = _connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO browsing_history (id, user_id, url, title, timestamp, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+            (history_id, user_id, url, title, timestamp.isoformat(), json.dumps(metadata or {})),
+        )
+    return history_id
+
+def save_browsing_history_batch(entries: List[Dict]) -> List[str]:
+    """Save several browsing history entries in one transaction; returns their ids"""
+    rows = [
+        (entry.get("id") or str(uuid.uuid4()), entry["user_id"], entry["url"], entry["title"],
+         entry["timestamp"].isoformat(), json.dumps(entry.get("metadata") or {}))
+        for entry in entries
+    ]
+    conn = _connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO browsing_history (id, user_id, url, title, timestamp, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    return [row[0] for row in rows]
+
+def _newest_first(table: str, user_id: str, limit: int, offset: int, before: Optional[Keyset] = None) -> List[Dict]:
+    """A page of a user's rows ordered by (timestamp, id), newest first, starting after `before`"""
+    keyset = "AND (timestamp, id) < (?, ?)" if before else ""
+    rows = _connection().execute(
+        f"SELECT * FROM {table} WHERE user_id = ? {keyset} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+        (user_id, *(before or ()), limit, offset),
+    ).fetchall()
+    return [_row(row) for row in rows]
+
+def get_query_history(user_id: str, limit: int = 10, offset: int = 0, before: Optional[Keyset] = None) -> List[Dict]:
+    """Get a user's query history, newest first"""
+    return _newest_first("query_history", user_id, limit, offset, before)
+
+def get_user_history(user_id: str, limit: int = 100, offset: int = 0, before: Optional[Dict[str, Keyset]] = None) -> Dict:
+    """Get a user's browsing and query history; with `before`, only the tables it has a keyset for"""
+    return {
+        table: _newest_first(table, user_id, limit, offset, before and before[table]) if before is None or table in before else []
+        for table in HISTORY_TABLES
+    }
+
+def _fts_string(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+def _match_expression(user_id: str, terms: List[str]) -> str:
+    """FTS5 query for rows of `user_id` containing any of `terms`"""
+    return f"user_id : {_fts_string(user_id)} AND ({' OR '.join(_fts_string(term) for term in terms)})"
+
+def search_query_history(user_id: str, text: str, limit: int = 20) -> List[Dict]:
+    """Search a user's questions and answers; best matches first, ranked by relevance and recency"""
+    terms = search_terms(text)
+    if not terms:
+        return []
+    rows = _connection().execute(
+        "SELECT q.*, bm25(query_history_fts, 0.0, 2.0, 1.0) AS bm25 FROM query_history_fts "
+        "JOIN query_history q ON q.rowid = query_history_fts.rowid "
+        "WHERE query_history_fts MATCH ? AND q.user_id = ? ORDER BY bm25 LIMIT ?",
+        (_match_expression(user_id, terms), user_id, HISTORY_SEARCH_CANDIDATES),
+    ).fetchall()
+    matches = []
+    for row in rows:
+        item = _row(row)
+        matches.append((item, -item.pop("bm25")))  # FTS5's bm25() is negated: lower is better
+    return rank_matches(matches, limit)
+
+def oldest_history_rows(table: str, before: datetime, limit: int = 1000) -> List[Dict]:
+    """Up to `limit` rows of any user with a timestamp before `before`, oldest first (for archiving)"""
+    if table not in HISTORY_TABLES:
+        raise ValueError(f"Unknown history table: {table}")
+    rows = _connection().execute(
+        f"SELECT * FROM {table} WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?", (before.isoformat(), limit)
+    ).fetchall()
+    return [_row(row) for row in rows]
+
+def delete_history_rows(table: str, ids: List[str]) -> int:
+    """Delete rows of any user by id; returns how many were deleted"""
+    if table not in HISTORY_TABLES:
+        raise ValueError(f"Unknown history table: {table}")
+    conn = _connection()
+    with conn:
+        return conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(row_id,) for row_id in ids]).rowcount
+
+def delete_user_history(user_id: str, history_type: str = "all") -> bool:
+    """Delete a user's history"""
+    try:
+        conn = _connection()
+        with conn:
+            if history_type in ["query", "all"]:
+                conn.execute("DELETE FROM query_history WHERE user_id = ?", (user_id,))
+            if history_type in ["browsing", "all"]:
+                conn.execute("DELETE FROM browsing_history WHERE user_id = ?", (user_id,))
+        return True
+    except sqlite3.Error:
+        logger.exception("Error deleting user history", extra={"user_id": user_id, "history_type": history_type})
+        return False
+
+def delete_specific_query(user_id: str, query_id: str) -> bool:
+    """Delete a specific query from user's history"""
+    try:
+        conn = _connection()
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM query_history WHERE user_id = ? AND id = ?", (user_id, query_id)
+            ).rowcount
+        if not deleted:
+            logger.info("Query to delete not found", extra={"user_id": user_id, "query_id": query_id})
+        return bool(deleted)
+    except sqlite3.Error:
+        logger.exception("Error deleting query", extra={"user_id": user_id, "query_id": query_id})
+        return False
+
+if __name__ == "__main__":
+    # Import the local history files by hand: python -m app.db.sqlite_history_store import
+    if sys.argv[1:] != ["import"]:
+        sys.exit("usage: python -m app.db.sqlite_history_store import")
+    print(json.dumps(import_json_history(), indent=2))
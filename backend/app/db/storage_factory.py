@@ -1,45 +1,136 @@
-# Storage Factory - chooses between Supabase and Local storage
-import os
+# Storage Factory - chooses between Supabase, SQLite and Local storage
+import asyncio
+import functools
 from typing import Union
 
+from app.core.config import STORAGE_MODE, HISTORY_ARCHIVE_AFTER_DAYS
+from app.core.logging import get_logger
+from app.core.metrics import instrument
+
+logger = get_logger(__name__)
+
 def get_storage_backend():
     """
     Returns the appropriate storage backend based on the STORAGE_MODE environment variable.
     """
-    storage_mode = os.getenv("STORAGE_MODE", "supabase").lower()
-    
-    if storage_mode == "local":
-        print("Using local file-based storage")
+    if STORAGE_MODE == "sqlite":
+        logger.info("Using SQLite storage")
+        from app.db.sqlite_history_store import (
+            save_query_history,
+            save_query_history_batch,
+            get_query_history,
+            search_query_history,
+            delete_user_history,
+            delete_specific_query,
+            save_browsing_history,
+            save_browsing_history_batch,
+            get_user_history,
+            oldest_history_rows,
+            delete_history_rows
+        )
+        return {
+            'save_query_history': save_query_history,
+            'save_query_history_batch': save_query_history_batch,
+            'get_query_history': get_query_history,
+            'search_query_history': search_query_history,
+            'delete_user_history': delete_user_history,
+            'delete_specific_query': delete_specific_query,
+            'save_browsing_history': save_browsing_history,
+            'save_browsing_history_batch': save_browsing_history_batch,
+            'get_user_history': get_user_history,
+            'oldest_history_rows': oldest_history_rows,
+            'delete_history_rows': delete_history_rows
+        }
+    elif STORAGE_MODE == "local":
+        logger.info("Using local file-based storage")
         from app.db.local_history_store import (
             save_query_history,
+            save_query_history_batch,
             get_query_history,
+            search_query_history,
             delete_user_history,
-            delete_specific_query
+            delete_specific_query,
+            save_browsing_history,
+            save_browsing_history_batch,
+            get_user_history,
+            oldest_history_rows,
+            delete_history_rows
         )
         return {
             'save_query_history': save_query_history,
+            'save_query_history_batch': save_query_history_batch,
             'get_query_history': get_query_history,
+            'search_query_history': search_query_history,
             'delete_user_history': delete_user_history,
-            'delete_specific_query': delete_specific_query
+            'delete_specific_query': delete_specific_query,
+            'save_browsing_history': save_browsing_history,
+            'save_browsing_history_batch': save_browsing_history_batch,
+            'get_user_history': get_user_history,
+            'oldest_history_rows': oldest_history_rows,
+            'delete_history_rows': delete_history_rows
         }
     else:
-        print("Using Supabase storage")
+        logger.info("Using Supabase storage")
         from app.db.history_store import (
             save_query_history,
+            save_query_history_batch,
             get_query_history,
+            search_query_history,
             delete_user_history,
-            delete_specific_query
+            delete_specific_query,
+            save_browsing_history,
+            save_browsing_history_batch,
+            get_user_history,
+            oldest_history_rows,
+            delete_history_rows
         )
         return {
             'save_query_history': save_query_history,
+            'save_query_history_batch': save_query_history_batch,
             'get_query_history': get_query_history,
+            'search_query_history': search_query_history,
             'delete_user_history': delete_user_history,
-            'delete_specific_query': delete_specific_query
+            'delete_specific_query': delete_specific_query,
+            'save_browsing_history': save_browsing_history,
+            'save_browsing_history_batch': save_browsing_history_batch,
+            'get_user_history': get_user_history,
+            'oldest_history_rows': oldest_history_rows,
+            'delete_history_rows': delete_history_rows
         }
 
-# Get the storage functions
-storage = get_storage_backend()
+# The functions behind the API endpoints, which await them
+ASYNC_FUNCTIONS = ("get_query_history", "search_query_history", "get_user_history", "delete_user_history", "delete_specific_query")
+
+def in_thread(fn):
+    """A coroutine function running blocking `fn` in a worker thread"""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return wrapper
+
+def get_storage():
+    """The storage backend's functions, reading through to the history archive when archival is enabled"""
+    backend = get_storage_backend()
+    # Supabase's are coroutines already; the SQLite and local stores' block on disk
+    backend = {
+        name: in_thread(fn) if name in ASYNC_FUNCTIONS and not asyncio.iscoroutinefunction(fn) else fn
+        for name, fn in backend.items()
+    }
+    if HISTORY_ARCHIVE_AFTER_DAYS > 0:
+        from app.db.history_archive import with_archive
+        backend = with_archive(backend)
+    return backend
+
+# Get the storage functions, each timed as a "history_<function>" stage
+storage = {name: instrument(f"history_{name}", fn) for name, fn in get_storage().items()}
 save_query_history = storage['save_query_history']
+save_query_history_batch = storage['save_query_history_batch']
 get_query_history = storage['get_query_history']
+search_query_history = storage['search_query_history']
 delete_user_history = storage['delete_user_history']
 delete_specific_query = storage['delete_specific_query']
+save_browsing_history = storage['save_browsing_history']
+save_browsing_history_batch = storage['save_browsing_history_batch']
+get_user_history = storage['get_user_history']
+oldest_history_rows = storage['oldest_history_rows']
+delete_history_rows = storage['delete_history_rows']
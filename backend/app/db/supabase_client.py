@@ -0,0 +1,112 @@
+# Shared Supabase clients: the PostgREST API over pooled HTTP/2 connections, for async code and for worker threads
+import asyncio
+import threading
+from typing import Optional, Tuple
+
+import httpx
+from postgrest import AsyncPostgrestClient, SyncPostgrestClient
+
+from app.core.config import (
+    METRICS_ENABLED, SUPABASE_URL, SUPABASE_KEY, SUPABASE_REST_URL, SUPABASE_HTTP2, SUPABASE_POOL_MAX_CONNECTIONS,
+    SUPABASE_POOL_MAX_KEEPALIVE, SUPABASE_POOL_KEEPALIVE_S, SUPABASE_POOL_TIMEOUT_S, SUPABASE_CONNECT_TIMEOUT_S,
+    SUPABASE_TIMEOUT_S,
+)
+from app.core.logging import get_logger
+from app.core.metrics import REGISTRY, Counter
+
+logger = get_logger(__name__)
+
+SUPABASE_REQUESTS = REGISTRY.register(Counter(
+    "askify_supabase_requests_total",
+    "Requests to the Supabase API, by connection pool, HTTP version and status",
+    ["pool", "http_version", "status"],
+))
+
+def rest_url() -> str:
+    if SUPABASE_REST_URL:
+        return SUPABASE_REST_URL.rstrip("/")
+    if not SUPABASE_URL:
+        raise RuntimeError("SUPABASE_URL is not set")
+    return f"{SUPABASE_URL.rstrip('/')}/rest/v1"
+
+def _http2() -> bool:
+    if not SUPABASE_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("h2 is not installed, using HTTP/1.1 for Supabase")
+        return False
+    return True
+
+def _headers():
+    return {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        "apikey": SUPABASE_KEY or "",
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+    }
+
+def _client_options() -> dict:
+    """httpx.Client / httpx.AsyncClient options of both pools"""
+    return {
+        "http2": _http2(),
+        "limits": httpx.Limits(
+            max_connections=SUPABASE_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=SUPABASE_POOL_KEEPALIVE_S,
+        ),
+        "timeout": httpx.Timeout(SUPABASE_TIMEOUT_S, connect=SUPABASE_CONNECT_TIMEOUT_S, pool=SUPABASE_POOL_TIMEOUT_S),
+        "follow_redirects": True,
+    }
+
+def _count(pool: str, response: httpx.Response):
+    if METRICS_ENABLED:
+        SUPABASE_REQUESTS.inc(pool=pool, http_version=response.http_version, status=str(response.status_code))
+
+async def _count_async(response: httpx.Response):
+    _count("async", response)
+
+def _count_threads(response: httpx.Response):
+    _count("threads", response)
+
+# The async client, with the event loop its connections belong to
+_async_client: Optional[Tuple[asyncio.AbstractEventLoop, AsyncPostgrestClient]] = None
+_sync_client: Optional[SyncPostgrestClient] = None
+_sync_lock = threading.Lock()
+
+def get_async_db() -> AsyncPostgrestClient:
+    """
+    The PostgREST client for coroutines, shared by everything on the running event loop
+
+    Requests are multiplexed over a pool of at most
+    SUPABASE_POOL_MAX_CONNECTIONS HTTP/2 connections; waiting longer than
+    SUPABASE_POOL_TIMEOUT_S for one raises httpx.PoolTimeout.
+    """
+    global _async_client
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client[0] is not loop:
+        http_client = httpx.AsyncClient(**_client_options(), event_hooks={"response": [_count_async]})
+        _async_client = (loop, AsyncPostgrestClient(rest_url(), headers=_headers(), http_client=http_client))
+    return _async_client[1]
+
+def get_db() -> SyncPostgrestClient:
+    """The PostgREST client for blocking code (storage backends, background jobs), shared by all threads"""
+    global _sync_client
+    if _sync_client is None:
+        with _sync_lock:
+            if _sync_client is None:
+                http_client = httpx.Client(**_client_options(), event_hooks={"response": [_count_threads]})
+                _sync_client = SyncPostgrestClient(rest_url(), headers=_headers(), http_client=http_client)
+    return _sync_client
+
+async def close_db():
+    """Close both pools' connections (on shutdown)"""
+    global _async_client, _sync_client
+    if _async_client is not None and _async_client[0] is asyncio.get_running_loop():
+        await _async_client[1].aclose()
+    _async_client = None
+    with _sync_lock:
+        if _sync_client is not None:
+            _sync_client.session.close()
+        _sync_client = None
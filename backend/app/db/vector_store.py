@@ -1,13 +1,39 @@
 # Vector database storage using ChromaDB
+import contextvars
 import os
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
+import numpy as np
 from chromadb.config import Settings
 from typing import Optional, List, Dict
 from datetime import datetime
 from urllib.parse import urlparse
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
-from app.core.config import VECTOR_DB_PATH
+from app.core.config import (
+    VECTOR_DB_PATH,
+    HNSW_SPACE,
+    HNSW_M,
+    HNSW_CONSTRUCTION_EF,
+    HNSW_SEARCH_EF,
+    VECTOR_QUANTIZATION,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CONCURRENCY,
+)
+from app.core.logging import get_logger
+from app.core.timing import timed
+from app.db.lexical_index import index_page
+from app.db.quantization import QUANTIZATION_MODES, encode_vector, score_vectors, similarity_to_relevance
+from app.db import quantized_store
+from app.db import page_store
+
+if VECTOR_QUANTIZATION not in QUANTIZATION_MODES:
+    raise ValueError(f"VECTOR_QUANTIZATION must be one of {QUANTIZATION_MODES}, got '{VECTOR_QUANTIZATION}'")
+
+logger = get_logger(__name__)
 
 # Ensure the vector DB directory exists
 os.makedirs(VECTOR_DB_PATH, exist_ok=True)
@@ -15,6 +41,174 @@ os.makedirs(VECTOR_DB_PATH, exist_ok=True)
 # Initialize ChromaDB client
 chroma_client = chromadb.PersistentClient(path=VECTOR_DB_PATH, settings=Settings(anonymized_telemetry=False))
 
+# HNSW settings that cannot be changed once a collection has been built
+IMMUTABLE_INDEX_PARAMS = ("hnsw:space", "hnsw:M", "hnsw:construction_ef")
+
+# Collections already reported as built with different settings
+_mismatched_collections = set()
+
+# Collections whose search ef has been brought to HNSW_SEARCH_EF in this process
+_search_ef_checked = set()
+
+# Quantized collections hold a one-dimensional placeholder embedding per chunk;
+# the real vector lives, encoded, in the quantized vector store
+PLACEHOLDER_EMBEDDING = [0.0]
+
+# Shared by all requests; bounds how many embedding API calls ingestion has in flight
+_embedding_executor = ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY, thread_name_prefix="embed")
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that splits embed_documents into batches and embeds
+    them concurrently, so a long page does not wait on one request after another
+    """
+
+    def __init__(self, embeddings: Embeddings, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1:
+            return self.embeddings.embed_documents(texts)
+        # Each batch runs in a copy of the caller's context, so its log lines keep the request ID
+        futures = [
+            _embedding_executor.submit(contextvars.copy_context().run, self.embeddings.embed_documents, batch)
+            for batch in batches
+        ]
+        vectors = []
+        for future in futures:
+            vectors.extend(future.result())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+class QuantizedVectorStore:
+    """
+    What get_vector_store_for_user returns for a quantized collection
+
+    Its records hold placeholder embeddings, so LangChain's search and add
+    methods would fail on the dimension or return meaningless results. Only
+    the raw collection (`_collection`) is exposed; search goes through
+    quantized_search and ingestion through add_to_vector_store.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name: str):
+        raise NotImplementedError(
+            f"{name} is not available on a quantized collection (VECTOR_QUANTIZATION={VECTOR_QUANTIZATION}); "
+            "use quantized_search or add_to_vector_store"
+        )
+
+def collection_name_for_user(user_id: str, mode: str = VECTOR_QUANTIZATION) -> str:
+    """
+    Name of the user's collection. Quantized collections get their own name,
+    since their records are not compatible with float collections.
+    """
+    if mode == "none":
+        return f"user_{user_id}"
+    return f"user_{user_id}_{mode}"
+
+def user_id_from_collection(collection_name: str) -> str:
+    """Inverse of collection_name_for_user"""
+    user_id = collection_name[len("user_"):]
+    for mode in QUANTIZATION_MODES:
+        if mode != "none" and user_id.endswith(f"_{mode}"):
+            return user_id[: -len(mode) - 1]
+    return user_id
+
+
+def get_index_params() -> Dict:
+    """
+    HNSW parameters for new collections, as Chroma collection metadata.
+    They are stored with each collection, so every collection records the
+    settings it was actually built with.
+    """
+    return {
+        "hnsw:space": HNSW_SPACE,
+        "hnsw:M": HNSW_M,
+        "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+        "hnsw:search_ef": HNSW_SEARCH_EF,
+    }
+
+# Per-collection locks, held while records are added and while a rebuild swaps the collection out
+_collection_locks: Dict[str, threading.RLock] = {}
+_collection_locks_guard = threading.Lock()
+
+def collection_lock(collection_name: str) -> threading.RLock:
+    """
+    Lock of one collection. Ingestion holds it while storing chunks and
+    opening the collection waits on it, so neither sees a collection that a
+    rebuild (see retention.rebuild_collection) has deleted but not yet replaced.
+    """
+    with _collection_locks_guard:
+        return _collection_locks.setdefault(collection_name, threading.RLock())
+
+def collection_missing(error: Exception) -> bool:
+    """Whether a Chroma error means the collection no longer exists (as after a rebuild swapped it out)"""
+    return type(error).__name__ in ("NotFoundError", "InvalidCollectionException") or "does not exist" in str(error)
+
+def _get_or_create_collection(collection_name: str):
+    """
+    Open a collection, creating it with the configured index parameters if needed.
+    Existing collections are never modified, so their recorded settings stay accurate.
+    """
+    with collection_lock(collection_name):
+        try:
+            return chroma_client.get_collection(name=collection_name)
+        except Exception:
+            pass
+        try:
+            return chroma_client.create_collection(name=collection_name, metadata=get_index_params())
+        except Exception:
+            # Another request created it in the meantime
+            return chroma_client.get_collection(name=collection_name)
+
+def _apply_search_ef(collection):
+    """
+    Bring an existing collection's search ef to HNSW_SEARCH_EF. Unlike the
+    other HNSW settings it can change after the index is built.
+    """
+    configuration = getattr(collection, "configuration", None) or {}
+    hnsw = configuration.get("hnsw") if isinstance(configuration, dict) else None
+    if hnsw is None:
+        # Before Chroma 1.0 the setting lives in the collection metadata, and modify() would replace
+        # all of it (hnsw:space included), so it takes a rebuild there
+        if (collection.metadata or {}).get("hnsw:search_ef", HNSW_SEARCH_EF) != HNSW_SEARCH_EF:
+            logger.warning(
+                "Collection has a different hnsw:search_ef; rebuild it to apply the configured one",
+                extra={"collection": collection.name}
+            )
+        return
+    if hnsw.get("ef_search") != HNSW_SEARCH_EF:
+        collection.modify(configuration={"hnsw": {"ef_search": HNSW_SEARCH_EF}})
+        logger.info("Applied search ef to collection", extra={"collection": collection.name, "search_ef": HNSW_SEARCH_EF})
+
+def _collection_space(collection) -> str:
+    """The distance space a collection was created with (Chroma's default is l2)"""
+    return (collection.metadata or {}).get("hnsw:space", "l2")
+
+def get_collection_index_params(user_id: str) -> Dict:
+    """
+    Get the HNSW parameters recorded on a user's collection
+
+    Args:
+        user_id: The user's unique identifier
+
+    Returns:
+        Dict of "hnsw:*" settings; Chroma's defaults apply to any missing key
+    """
+    collection = _get_or_create_collection(collection_name_for_user(user_id))
+    params = {key: value for key, value in (collection.metadata or {}).items() if key.startswith("hnsw:")}
+    configuration = getattr(collection, "configuration", None) or {}
+    if isinstance(configuration, dict) and configuration.get("hnsw"):
+        # Search ef changes go to the configuration only (see _apply_search_ef)
+        params["hnsw:search_ef"] = configuration["hnsw"].get("ef_search", params.get("hnsw:search_ef"))
+    return params
+
 def get_vector_store_for_user(user_id: str, embeddings):
     """
     Get or create a Chroma collection for the user
@@ -24,30 +218,51 @@ def get_vector_store_for_user(user_id: str, embeddings):
         embeddings: The embeddings model to use
     
     Returns:
-        A LangChain Chroma vector store instance
+        A LangChain Chroma vector store instance, or a QuantizedVectorStore
+        when VECTOR_QUANTIZATION is on
     """
     from langchain_chroma import Chroma
     
     # Create a unique collection name for this user
-    collection_name = f"user_{user_id}"
+    collection_name = collection_name_for_user(user_id)
     
 
-    # Use get_or_create_collection for robustness
+    # The index parameters only take effect when the collection is first created;
+    # existing collections keep the ones they were built with, except search ef.
+    index_params = get_index_params()
     try:
-        collection = chroma_client.get_or_create_collection(
-            name=collection_name,
-        )
+        collection = _get_or_create_collection(collection_name)
     except Exception as e:
-        print(f"Error in get_or_create_collection for {collection_name}: {e}")
+        logger.exception("Error in get_or_create_collection", extra={"collection": collection_name})
         # Re-raise the exception if you want to handle it further up
         # or handle it here (e.g., by raising an HTTPException)
         raise
 
+    recorded = collection.metadata or {}
+    if collection_name not in _mismatched_collections and any(
+        key in recorded and recorded[key] != index_params[key] for key in IMMUTABLE_INDEX_PARAMS
+    ):
+        _mismatched_collections.add(collection_name)
+        logger.warning(
+            "Collection was built with different HNSW settings; rebuild it to apply the configured ones",
+            extra={"user_id": user_id, "collection": collection_name}
+        )
+    if collection_name not in _search_ef_checked:
+        _search_ef_checked.add(collection_name)
+        try:
+            _apply_search_ef(collection)
+        except Exception as e:
+            logger.warning("Could not apply search ef to collection: %s", e, extra={"collection": collection_name})
+
+    if VECTOR_QUANTIZATION != "none":
+        return QuantizedVectorStore(collection)
+
     # Return as LangChain vectorstore
     return Chroma(
         client=chroma_client,
         collection_name=collection_name, 
-        embedding_function=embeddings
+        embedding_function=embeddings,
+        collection_metadata=collection.metadata
     )
 
 # Check if our collection has any documents
@@ -63,15 +278,11 @@ def collection_has_documents(user_id: str, embeddings) -> bool:
         True if the collection has documents, False otherwise
     """
     vector_store = get_vector_store_for_user(user_id, embeddings)
-    # A simple similarity search with an empty query to see if anything comes back
+    # Count the stored records directly instead of running a search, which would embed a dummy query
     try:
-        results = vector_store.similarity_search_with_score(
-            query=" ", 
-            k=1
-        )
-        return len(results) > 0
+        return vector_store._collection.count() > 0
     except Exception as e:
-        print(f"[{user_id}] Error checking if collection has documents: {e}")
+        logger.warning("Error checking if collection has documents: %s", e, extra={"user_id": user_id})
         return False
 
 def url_exists_in_vector_store(user_id: str, url: str, embeddings) -> bool:
@@ -89,25 +300,141 @@ def url_exists_in_vector_store(user_id: str, url: str, embeddings) -> bool:
 
     try:
         vector_store = get_vector_store_for_user(user_id, embeddings)
-        # Perform a search with a filter for the exact source URL
-        results = vector_store.similarity_search_with_score(
-            query=" ",  # Dummy query, filter is what matters
-            k=1,
-            filter={"source": url} 
+        # A metadata-only lookup; no embedding call is needed for an exact source match
+        results = vector_store._collection.get(
+            where=page_filter(user_id, "source", url),
+            limit=1,
+            include=[]
         )
-        exists = len(results) > 0
+        exists = len(results["ids"]) > 0
 
         return exists
     except Exception as e:
         return False
 
+def page_filter(user_id: str, field: str, value: str) -> Dict:
+    """
+    Chroma `where` clause selecting the chunks of pages whose attribute `field`
+    equals `value`. Page attributes live in the page table, so this resolves
+    them to content IDs; chunks stored before the page table existed still
+    carry the attribute themselves and are matched directly.
+
+    Args:
+        user_id: The user's unique identifier
+        field: "full_url", "source" or "domain"
+        value: The value to match
+    """
+    content_ids = page_store.find_content_ids(user_id, field, value)
+    if not content_ids:
+        return {field: value}
+    return {"$or": [{"content_id": {"$in": content_ids}}, {field: value}]}
+
+def with_page_metadata(documents: List[Document]) -> List[Document]:
+    """Fill the page-level attributes into each document's metadata, in place"""
+    merged = page_store.with_page_attributes([doc.metadata for doc in documents])
+    for doc, metadata in zip(documents, merged):
+        doc.metadata = metadata
+    return documents
+
+def get_page_documents(user_id: str, url: str, embeddings=None) -> List[Document]:
+    """
+    Load all stored chunks for a URL without running a similarity search
+
+    Args:
+        user_id: The user's unique identifier
+        url: The URL of the page
+        embeddings: The embeddings model to use
+
+    Returns:
+        List of the page's chunks as LangChain Documents
+    """
+    vector_store = get_vector_store_for_user(user_id, embeddings)
+    results = vector_store._collection.get(
+        where=page_filter(user_id, "full_url", url),
+        include=["documents", "metadatas"]
+    )
+    return with_page_metadata([
+        Document(page_content=text, metadata=metadata or {})
+        for text, metadata in zip(results["documents"], results["metadatas"])
+    ])
+
+def quantized_search(user_id: str, url: str, query_vector: List[float], k: int = 5) -> List[tuple]:
+    """
+    Search one page's quantized chunk vectors
+
+    Pages hold tens of chunks, so an exact scan of the decoded vectors is
+    cheaper than maintaining an approximate index over them.
+
+    Args:
+        user_id: The user's unique identifier
+        url: The URL of the page
+        query_vector: The full-precision query embedding
+        k: Maximum number of results
+
+    Returns:
+        List of (Document, relevance score) tuples, best first
+    """
+    collection = _get_or_create_collection(collection_name_for_user(user_id))
+    rows = quantized_store.get_page_vectors(user_id, url, VECTOR_QUANTIZATION)
+    ranked = score_vectors(
+        query_vector, [(codes, scale) for _, codes, scale in rows], VECTOR_QUANTIZATION, k, _collection_space(collection)
+    )
+    if not ranked:
+        return []
+
+    # Only the winning chunks' texts are loaded
+    results = collection.get(ids=[rows[i][0] for i, _ in ranked], include=["documents", "metadatas"])
+    documents = {
+        chunk_id: Document(page_content=text, metadata=metadata or {})
+        for chunk_id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+    }
+    with_page_metadata(list(documents.values()))
+    return [(documents[rows[i][0]], score) for i, score in ranked if rows[i][0] in documents]
+
+def chunk_relevance(user_id: str, url: str, chunk_ids: List[str], query_vector: List[float]) -> Dict[str, float]:
+    """
+    Relevance of specific chunks of a page to a query embedding, on the same
+    scale as dense search scores (so DENSE_RELEVANCE_THRESHOLD applies)
+
+    Args:
+        user_id: The user's unique identifier
+        url: The URL of the page
+        chunk_ids: The chunks to score
+        query_vector: The full-precision query embedding
+
+    Returns:
+        {chunk_id: relevance score}; chunks without a stored vector are left out
+    """
+    wanted = set(chunk_ids)
+    if not wanted:
+        return {}
+    collection = _get_or_create_collection(collection_name_for_user(user_id))
+    space = _collection_space(collection)
+    if VECTOR_QUANTIZATION != "none":
+        rows = [row for row in quantized_store.get_page_vectors(user_id, url, VECTOR_QUANTIZATION) if row[0] in wanted]
+        ranked = score_vectors(query_vector, [(codes, scale) for _, codes, scale in rows], VECTOR_QUANTIZATION, len(rows), space)
+        return {rows[i][0]: score for i, score in ranked}
+
+    results = collection.get(ids=list(wanted), include=["embeddings"])
+    if not results["ids"]:
+        return {}
+    matrix = np.asarray(results["embeddings"], dtype=np.float32)
+    query = np.asarray(query_vector, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+    similarities = (matrix @ query) / np.where(norms == 0, 1.0, norms)
+    return {
+        chunk_id: similarity_to_relevance(similarity, space)
+        for chunk_id, similarity in zip(results["ids"], similarities.tolist())
+    }
+
 def add_to_vector_store(
     user_id: str,
     content: str,
     url: str,
     summary: Optional[str] = None,
     embeddings=None,
-    timestamp: Optional[datetime] = None
+    timestamp: Optional[datetime] = None,
+    timings=None
 ) -> str:
     """
     Add content to the vector store using semantic chunking
@@ -119,33 +446,33 @@ def add_to_vector_store(
         summary: Optional summary of the content
         embeddings: The embeddings model to use
         timestamp: When the content was processed
+        timings: Optional StageTimings to record chunking, embedding and storage in
     
     Returns:
         The ID of the added content
     """
-    from langchain_openai import OpenAIEmbeddings
     from langchain_experimental.text_splitter import SemanticChunker
-    from app.core.config import OPENAI_API_KEY
+    from app.services.providers import get_embeddings
     
-    # If no embeddings model provided, use OpenAI
+    # If no embeddings model provided, use the configured provider's
     if embeddings is None:
-        embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+        embeddings = get_embeddings()
     
-    # Get vector store for user
-    vector_store = get_vector_store_for_user(user_id, embeddings)
+    # Sentence and chunk embeddings are requested in concurrent batches
+    batched_embeddings = BatchedEmbeddings(embeddings)
     
     # Use SemanticChunker for more intelligent, meaning-based chunking
-    print(f"[{user_id}] Using SemanticChunker for URL '{url}'")
+    logger.debug("Chunking page with SemanticChunker", extra={"user_id": user_id, "url": url})
     text_splitter = SemanticChunker(
-    OpenAIEmbeddings(), breakpoint_threshold_type="percentile", breakpoint_threshold_amount=80
+        batched_embeddings, breakpoint_threshold_type="percentile", breakpoint_threshold_amount=80
     )
     
     # Extract URL details for metadata
     parsed_url = urlparse(url)
     url_path = parsed_url.path
     
-    # Create detailed metadata for precise filtering
-    metadata = {
+    # Page-level attributes are stored once in the page table, not on every chunk
+    page_attributes = {
         "source": url,
         "domain": parsed_url.netloc,
         "url_path": url_path,
@@ -154,32 +481,48 @@ def add_to_vector_store(
     }
     
     if summary:
-        metadata["summary"] = summary
-    
-    # Create a document with the content and metadata
+        page_attributes["summary"] = summary
 
     # SemanticChunker expects a list of texts, not Documents
     # So we'll create chunks first, then convert to Documents with metadata
-    chunks = text_splitter.create_documents([content])
-    
-    
+    with timed(timings, "chunk"):
+        chunks = text_splitter.create_documents([content])
+
     # Generate a unique content ID
     content_id = str(uuid.uuid4())
     
-    # Ensure each chunk has complete metadata
+    # Chunks only carry the page key and their own fields
     for i, chunk in enumerate(chunks):
-        # Add chunk ID and content ID to metadata
         chunk.metadata["chunk_id"] = f"{content_id}_{i}"
         chunk.metadata["content_id"] = content_id
-        
-        # Add all our custom metadata
-        for key, value in metadata.items():
-            chunk.metadata[key] = value
+        chunk.metadata["chunk_index"] = i
+    
+    with timed(timings, "embed_chunks"):
+        vectors = batched_embeddings.embed_documents([chunk.page_content for chunk in chunks])
     
     # Add chunks to vector store
+    collection_name = collection_name_for_user(user_id)
+    with timed(timings, "store"), collection_lock(collection_name):
+        if VECTOR_QUANTIZATION != "none":
+            quantized_store.add_vectors(user_id, url, VECTOR_QUANTIZATION, [
+                (chunk.metadata["chunk_id"], *encode_vector(vector, VECTOR_QUANTIZATION))
+                for chunk, vector in zip(chunks, vectors)
+            ])
+        # Reopened under the lock: a rebuild may have replaced the collection while the page was embedded
+        _get_or_create_collection(collection_name).add(
+            ids=[chunk.metadata["chunk_id"] for chunk in chunks],
+            documents=[chunk.page_content for chunk in chunks],
+            metadatas=[chunk.metadata for chunk in chunks],
+            embeddings=vectors if VECTOR_QUANTIZATION == "none" else [PLACEHOLDER_EMBEDDING] * len(chunks)
+        )
 
-    vector_store.add_documents(chunks)
+        # Record the page once its chunks are stored; until then the URL does not count as ingested
+        page_store.add_page(user_id, content_id, page_attributes)
 
+    # Build the page's lexical index while the chunks are at hand
+    for chunk in chunks:
+        chunk.metadata.update(page_attributes)
+    index_page(user_id, url, chunks)
     
     return content_id
 
@@ -197,8 +540,6 @@ def get_user_document_chunks(user_id: str, embeddings, url: Optional[str] = None
         List of document chunks with their metadata
     """
     try:
-        print(f"[{user_id}] Retrieving document chunks" + (f" for URL: {url}" if url else ""))
-        
         # Get vector store for user
         vector_store = get_vector_store_for_user(user_id, embeddings)
         
@@ -211,7 +552,7 @@ def get_user_document_chunks(user_id: str, embeddings, url: Optional[str] = None
             # Try full_url first
             try:
                 # Try exact URL match
-                filter_dict = {"full_url": url}
+                filter_dict = page_filter(user_id, "full_url", url)
                 results = collection.get(
                     where=filter_dict,
                     limit=limit
@@ -219,7 +560,7 @@ def get_user_document_chunks(user_id: str, embeddings, url: Optional[str] = None
                 
                 # If no results, try source filter
                 if not results["metadatas"]:
-                    filter_dict = {"source": url}
+                    filter_dict = page_filter(user_id, "source", url)
                     results = collection.get(
                         where=filter_dict,
                         limit=limit
@@ -229,30 +570,31 @@ def get_user_document_chunks(user_id: str, embeddings, url: Optional[str] = None
                     if not results["metadatas"]:
                         parsed_url = urlparse(url)
                         domain = parsed_url.netloc
-                        filter_dict = {"domain": domain}
+                        filter_dict = page_filter(user_id, "domain", domain)
                         results = collection.get(
                             where=filter_dict,
                             limit=limit
                         )
             except Exception as e:
-                print(f"[{user_id}] Error with URL filter: {e}. Getting all documents.")
+                logger.warning("Error with URL filter: %s; getting all documents", e, extra={"user_id": user_id, "url": url})
                 results = collection.get(limit=limit)
         else:
             # Get all documents
             results = collection.get(limit=limit)
         
-        # Format the results
+        # Format the results, with page attributes joined back into each chunk's metadata
+        metadatas = page_store.with_page_attributes(results["metadatas"])
         chunks = []
         for i in range(len(results["ids"])):
             chunk = {
                 "id": results["ids"][i],
                 "content": results["documents"][i],
-                "metadata": results["metadatas"][i] if i < len(results["metadatas"]) else {}
+                "metadata": metadatas[i] if i < len(metadatas) else {}
             }
             chunks.append(chunk)
         
-        print(f"[{user_id}] Retrieved {len(chunks)} document chunks")
+        logger.debug("Retrieved document chunks", extra={"user_id": user_id, "url": url, "chunks": len(chunks)})
         return chunks
     except Exception as e:
-        print(f"[{user_id}] Error retrieving document chunks: {e}")
+        logger.exception("Error retrieving document chunks", extra={"user_id": user_id, "url": url})
         return []
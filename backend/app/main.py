@@ -1,9 +1,29 @@
 # Main FastAPI application
-from fastapi import FastAPI
+import asyncio
+import os
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from app.core.config import CORS_ORIGINS, API_V1_PREFIX, PROJECT_NAME, DEBUG
+from app.core.config import (
+    CORS_ORIGINS, API_V1_PREFIX, PROJECT_NAME, DEBUG, RETENTION_INTERVAL_MINUTES, METRICS_ENABLED, PROFILE_TOKEN,
+    STORAGE_MODE, LOCAL_HISTORY_COMPACT_INTERVAL_MINUTES, HISTORY_ARCHIVE_AFTER_DAYS, HISTORY_ARCHIVE_INTERVAL_MINUTES,
+    HISTORY_ARCHIVE_SHARED, VECTOR_QUANTIZATION,
+)
+from app.core.metrics import REGISTRY, HTTP_REQUESTS, HTTP_REQUEST_DURATION
+from app.core.logging import get_logger, request_id_var
+from app.core.profiling import PROFILE_HEADER, profile_requested, try_start_profiler, finish_profiler
 from app.api.routes import api_router
+from app.db.retention import migrate_to_quantized, run_compaction, save_page_access
+from app.db.supabase_client import close_db
+from app.services.outbound_policy import outbound_stats
+from app.services.history_writer import history_writer, start_history_writer
+
+logger = get_logger(__name__)
 
 app = FastAPI(
     title=PROJECT_NAME,
@@ -20,9 +40,125 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if METRICS_ENABLED:
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # Label by endpoint function, not the raw path, to keep the number of series bounded
+            endpoint = request.scope.get("endpoint")
+            handler = endpoint.__name__ if endpoint else "unmatched"
+            HTTP_REQUESTS.inc(method=request.method, handler=handler, status=status)
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, method=request.method, handler=handler)
+
+if PROFILE_TOKEN:
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        if not profile_requested(request.headers.get(PROFILE_HEADER)):
+            return await call_next(request)
+        profiler = try_start_profiler()
+        if profiler is None:
+            response = await call_next(request)
+            response.headers[PROFILE_HEADER] = "busy"
+            return response
+        try:
+            response = await call_next(request)
+        finally:
+            name = re.sub(r"[^A-Za-z0-9]+", "_", f"{request.method}{request.url.path}").strip("_")
+            path = await asyncio.to_thread(finish_profiler, profiler, name)
+        logger.info("Saved request profile", extra={
+            "method": request.method, "path": request.url.path,
+            "samples": profiler.samples, "seconds": round(profiler.duration, 3), "file": path,
+        })
+        response.headers[PROFILE_HEADER] = os.path.basename(path)
+        return response
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    """Tag the request's log lines with an id (the client's X-Request-ID, or a new one) and echo it back"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # Include API routes
 app.include_router(api_router, prefix=API_V1_PREFIX)
 
+async def vector_store_retention_job():
+    """Periodically evict old and least recently used pages and compact the vector store"""
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL_MINUTES * 60)
+        try:
+            await asyncio.to_thread(run_compaction)
+        except Exception as e:
+            logger.exception("Vector store compaction failed")
+
+async def quantization_migration_job():
+    """Copy stored float vectors into the configured quantized collections, once, after startup"""
+    try:
+        await asyncio.to_thread(migrate_to_quantized)
+    except Exception as e:
+        logger.exception("Vector quantization migration failed")
+
+async def history_log_compaction_job():
+    """Periodically rewrite the local history logs without their deleted records"""
+    from app.db.local_history_store import compact_history_logs
+    while True:
+        await asyncio.sleep(LOCAL_HISTORY_COMPACT_INTERVAL_MINUTES * 60)
+        try:
+            await asyncio.to_thread(compact_history_logs)
+        except Exception as e:
+            logger.exception("History log compaction failed")
+
+async def history_archive_job():
+    """Periodically move old history out of the primary store into the archive"""
+    from app.db.history_archive import archive_old_history
+    while True:
+        await asyncio.sleep(HISTORY_ARCHIVE_INTERVAL_MINUTES * 60)
+        try:
+            await asyncio.to_thread(archive_old_history)
+        except Exception as e:
+            logger.exception("History archival failed")
+
+@app.on_event("startup")
+async def start_background_jobs():
+    start_history_writer()
+    if RETENTION_INTERVAL_MINUTES > 0:
+        app.state.retention_task = asyncio.create_task(vector_store_retention_job())
+    if VECTOR_QUANTIZATION != "none":
+        app.state.quantization_task = asyncio.create_task(quantization_migration_job())
+    if STORAGE_MODE == "local":
+        from app.db.local_history_store import load_history_logs
+        start = time.perf_counter()
+        stats = await asyncio.to_thread(load_history_logs)
+        logger.info("Loaded history log indexes", extra={"seconds": round(time.perf_counter() - start, 3), **stats})
+        if LOCAL_HISTORY_COMPACT_INTERVAL_MINUTES > 0:
+            app.state.history_compaction_task = asyncio.create_task(history_log_compaction_job())
+    if HISTORY_ARCHIVE_AFTER_DAYS > 0 and HISTORY_ARCHIVE_INTERVAL_MINUTES > 0:
+        if STORAGE_MODE == "supabase" and not HISTORY_ARCHIVE_SHARED:
+            logger.error("History archival is not started: with Supabase it needs HISTORY_ARCHIVE_SHARED=True")
+        else:
+            app.state.history_archive_task = asyncio.create_task(history_archive_job())
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    for name in ("retention_task", "quantization_task", "history_compaction_task", "history_archive_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    await history_writer.stop()
+    save_page_access()
+    await close_db()
+
 @app.get("/")
 async def root():
     return {"message": f"Welcome to {PROJECT_NAME} API"}
@@ -35,3 +171,20 @@ async def health_check():
         "service": PROJECT_NAME,
         "version": "1.0.0"
     }
+
+@app.get("/health/outbound")
+async def outbound_health():
+    """Concurrency limits, queueing, retries, hedges and latency percentiles of LLM and embedding calls"""
+    return outbound_stats()
+
+@app.get("/health/history-writer")
+async def history_writer_health():
+    """Queued and unsaved query history entries, the age of the oldest one, and write counters"""
+    return history_writer.stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics: stage durations, HTTP requests and outbound API calls"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,120 @@
+# Browsing history ingestion: batches of visits, deduplicated per URL and saved with one write
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import METRICS_ENABLED, BROWSING_DEDUP_WINDOW_S, BROWSING_DEDUP_MAX_KEYS
+from app.core.logging import get_logger
+from app.core.metrics import REGISTRY, Counter
+from app.db.storage_factory import save_browsing_history_batch
+
+logger = get_logger(__name__)
+
+BROWSING_VISITS = REGISTRY.register(Counter(
+    "askify_browsing_visits_total", "Browsing history visits received, by outcome", ["outcome"]
+))
+
+# (user id, URL without fragment)
+VisitKey = Tuple[str, str]
+
+def _seconds(timestamp: datetime) -> float:
+    """Epoch seconds, reading naive timestamps as UTC"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+def visit_key(user_id: str, url: str) -> VisitKey:
+    """Visits differing only in the URL fragment (#section) are the same page"""
+    return user_id, url.split("#", 1)[0]
+
+class VisitDeduplicator:
+    """
+    Drops repeat visits to a URL within `window` seconds of the last kept one
+
+    Tab listeners report the same page several times (activation, reloads,
+    in-page navigation); only the first visit in each window is kept.
+    Windows are measured on the visits' own timestamps, so a batch sent late
+    deduplicates the same way as one sent live. The last kept visit time of
+    up to `max_keys` user/URL pairs is remembered, least recently visited
+    forgotten first; state is per process.
+    """
+
+    def __init__(self, window: float = BROWSING_DEDUP_WINDOW_S, max_keys: int = BROWSING_DEDUP_MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self._last: "OrderedDict[VisitKey, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def admit(self, user_id: str, visits: List[Dict]) -> Tuple[List[Dict], Dict[VisitKey, Optional[float]]]:
+        """
+        The visits to keep, in time order, and the state needed to forget() them
+
+        Args:
+            user_id: The user's ID
+            visits: Dicts with url and timestamp (and any other fields, passed through)
+
+        Returns:
+            The kept visits, and the previous last-visit time of each key they updated
+        """
+        if self.window <= 0:
+            return sorted(visits, key=lambda visit: _seconds(visit["timestamp"])), {}
+        kept, previous = [], {}
+        with self._lock:
+            for visit in sorted(visits, key=lambda visit: _seconds(visit["timestamp"])):
+                key = visit_key(user_id, visit["url"])
+                seen = _seconds(visit["timestamp"])
+                last = self._last.get(key)
+                if last is not None and abs(seen - last) < self.window:
+                    continue
+                previous.setdefault(key, last)
+                self._last[key] = seen if last is None else max(seen, last)
+                self._last.move_to_end(key)
+                kept.append(visit)
+            while len(self._last) > self.max_keys:
+                self._last.popitem(last=False)
+        return kept, previous
+
+    def forget(self, previous: Dict[VisitKey, Optional[float]]):
+        """Undo an admit() whose visits could not be saved, so a retry is not dropped as a repeat"""
+        with self._lock:
+            for key, last in previous.items():
+                if last is None:
+                    self._last.pop(key, None)
+                else:
+                    self._last[key] = last
+
+    def __len__(self) -> int:
+        return len(self._last)
+
+# The process-wide deduplicator
+deduplicator = VisitDeduplicator()
+
+def record_visits(user_id: str, visits: List[Dict]) -> Dict:
+    """
+    Save a batch of a user's visits, dropping repeats
+
+    Kept visits are saved with a single write to the storage backend. Blocks
+    on that write; call from a worker thread.
+
+    Args:
+        user_id: The user's ID
+        visits: Dicts with url, title, timestamp and optionally metadata
+
+    Returns:
+        Dict with the ids of the saved visits and the number dropped as repeats
+    """
+    kept, previous = deduplicator.admit(user_id, visits)
+    duplicates = len(visits) - len(kept)
+    ids = []
+    if kept:
+        try:
+            ids = save_browsing_history_batch([{**visit, "user_id": user_id} for visit in kept])
+        except Exception:
+            deduplicator.forget(previous)
+            raise
+    if METRICS_ENABLED:
+        BROWSING_VISITS.inc(len(ids), outcome="saved")
+        BROWSING_VISITS.inc(duplicates, outcome="duplicate")
+    logger.debug("Recorded browsing visits", extra={"user_id": user_id, "saved": len(ids), "duplicates": duplicates})
+    return {"ids": ids, "duplicates": duplicates}
@@ -1,26 +1,25 @@
 # Content processing service using LangChain
-from langchain_openai import ChatOpenAI
 import requests
 from bs4 import BeautifulSoup
 import re
 from datetime import datetime
 
-from app.core.config import OPENAI_API_KEY
+from app.core.timing import timed
 from app.db.vector_store import add_to_vector_store, url_exists_in_vector_store
 
-# Initialize LLM
-llm = ChatOpenAI(
-    openai_api_key=OPENAI_API_KEY,
-    model_name="gpt-4o-mini",
-    temperature=0.2
-)
+# Outcomes of process_and_store_content
+CONTENT_STORED = "stored"    # fetched, chunked and stored now
+CONTENT_EXISTS = "exists"    # already in the vector store
+CONTENT_BLOCKED = "blocked"  # the site could not be fetched
+CONTENT_EMPTY = "empty"      # fetched, but nothing to store
 
-def extract_webpage_content(url: str) -> str:
+def extract_webpage_content(url: str, timings=None) -> str:
     """
     Extract content from a webpage URL using BeautifulSoup.
     
     Args:
         url: The URL of the webpage
+        timings: Optional StageTimings to record the download ("fetch") and parsing ("parse") in
     
     Returns:
         Extracted text content from the webpage
@@ -28,31 +27,33 @@ def extract_webpage_content(url: str) -> str:
     try:
         # Send GET request to the URL with a standard browser user agent
         headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"}
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # This will raise an exception for HTTP errors
+        with timed(timings, "fetch"):
+            response = requests.get(url, headers=headers, timeout=10)
+            response.raise_for_status()  # This will raise an exception for HTTP errors
         
-        # Parse HTML with BeautifulSoup
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Remove script and style elements
-        for script_or_style in soup(['script', 'style', 'header', 'footer', 'nav']):
-            script_or_style.decompose()
-        
-        # Extract title
-        title = soup.title.string if soup.title else ""
-        
-        # Find the main content (prioritize content containers)
-        main_content = soup.select_one('main, article, .content, #content')
-        if not main_content:
-            main_content = soup.body
-        
-        # Extract text content
-        text = main_content.get_text(separator='\n')
-        
-        # Clean up the text
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
+        with timed(timings, "parse"):
+            # Parse HTML with BeautifulSoup
+            soup = BeautifulSoup(response.text, 'html.parser')
+            
+            # Remove script and style elements
+            for script_or_style in soup(['script', 'style', 'header', 'footer', 'nav']):
+                script_or_style.decompose()
+            
+            # Extract title
+            title = soup.title.string if soup.title else ""
+            
+            # Find the main content (prioritize content containers)
+            main_content = soup.select_one('main, article, .content, #content')
+            if not main_content:
+                main_content = soup.body
+            
+            # Extract text content
+            text = main_content.get_text(separator='\n')
+            
+            # Clean up the text
+            lines = (line.strip() for line in text.splitlines())
+            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+            text = '\n'.join(chunk for chunk in chunks if chunk)
         
         # Prepend title
         if title:
@@ -64,7 +65,7 @@ def extract_webpage_content(url: str) -> str:
         # Return a special error message that can be recognized by the frontend
         return f"SITE_BLOCKED: Could not access content from {url}. The site may be blocking automated access."
 
-def process_and_store_content(user_id: str, url: str, embeddings) -> bool:
+def process_and_store_content(user_id: str, url: str, embeddings, timings=None) -> str:
     """
     Process and store content from a URL only if it doesn't already exist in the vector store.
     No summarization is performed - just extract and store the raw content.
@@ -73,20 +74,23 @@ def process_and_store_content(user_id: str, url: str, embeddings) -> bool:
         user_id: The ID of the user.
         url: The URL of the webpage to process.
         embeddings: The embeddings model to use for the vector store.
+        timings: Optional StageTimings to record each ingestion stage in.
 
     Returns:
-        True if new content was processed and stored, False if it already existed.
+        CONTENT_STORED, CONTENT_EXISTS, CONTENT_BLOCKED or CONTENT_EMPTY.
     """
     # Check if content for this URL already exists in the vector store
-    if url_exists_in_vector_store(user_id=user_id, url=url, embeddings=embeddings):
-        return False
+    with timed(timings, "exists_check"):
+        exists = url_exists_in_vector_store(user_id=user_id, url=url, embeddings=embeddings)
+    if exists:
+        return CONTENT_EXISTS
 
     # Extract content from the URL
-    content = extract_webpage_content(url)
+    content = extract_webpage_content(url, timings=timings)
     
     # Check if the site is blocked
     if content.startswith("SITE_BLOCKED:"):
-        return False
+        return CONTENT_BLOCKED
     
     if content and not content.startswith("Failed to extract content"):
         # Store content in vector store
@@ -96,9 +100,9 @@ def process_and_store_content(user_id: str, url: str, embeddings) -> bool:
             url=url,
             summary=None,
             embeddings=embeddings,
-            timestamp=datetime.utcnow()
+            timestamp=datetime.utcnow(),
+            timings=timings
         )
-        return True
+        return CONTENT_STORED
     else:
-        return False
-
+        return CONTENT_EMPTY
@@ -0,0 +1,141 @@
+# Context assembly: token-budgeted packing of retrieved chunks into the LLM prompt
+import re
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from app.core.config import (
+    LLM_MODEL_NAME,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_CHUNK_MAX_TOKENS,
+    CONTEXT_DEDUP_THRESHOLD,
+)
+from app.db.lexical_index import tokenize
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(LLM_MODEL_NAME)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # No tokenizer available (or its data cannot be loaded): fall back to an estimate
+        return None
+
+def count_tokens(text: str) -> int:
+    """Number of model tokens in `text` (about 4 characters per token if tiktoken is unavailable)"""
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of `text` of at most `max_tokens` tokens"""
+    encoding = _encoding()
+    if encoding is None:
+        return text[: max(0, max_tokens) * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    while max_tokens > 0:
+        # Decoding a token prefix can re-encode to slightly more tokens
+        prefix = encoding.decode(tokens[:max_tokens])
+        if count_tokens(prefix) <= max_tokens:
+            return prefix
+        max_tokens -= 1
+    return ""
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+def _normalize(sentence: str) -> str:
+    return " ".join(tokenize(sentence))
+
+def _trim_to_budget(sentences: List[str], query_terms: set, max_tokens: int) -> Tuple[List[str], int]:
+    """
+    Keep the sentences most relevant to the query, in their original order
+
+    Sentences are ranked by how many query terms they contain (earlier
+    sentences win ties) and added while they fit in `max_tokens`. A
+    sentence longer than `max_tokens` on its own (such as unpunctuated
+    text) is cut to whatever room is left instead of being dropped.
+    """
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(query_terms.intersection(tokenize(sentences[i]))), i)
+    )
+    kept, used = {}, 0
+    for i in ranked:
+        sentence = sentences[i]
+        cost = count_tokens(sentence)
+        if used + cost > max_tokens:
+            if cost <= max_tokens:
+                continue
+            sentence = truncate_to_tokens(sentence, max_tokens - used).strip()
+            if not sentence:
+                continue
+            cost = count_tokens(sentence)
+        kept[i] = sentence
+        used += cost
+    return [kept[i] for i in sorted(kept)], used
+
+def pack_context(
+    documents: Sequence[Document],
+    query: str,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    chunk_max_tokens: int = CONTEXT_CHUNK_MAX_TOKENS,
+    dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD
+) -> Tuple[List[Document], Dict]:
+    """
+    Assemble retrieved chunks into a context that fits a token budget
+
+    Chunks are taken in retrieval order. Sentences already used by a
+    higher-ranked chunk are dropped, and a chunk whose sentences mostly
+    repeat earlier ones (overlap >= dedup_threshold) is skipped. Each chunk
+    is then trimmed to its most query-relevant sentences, within both the
+    per-chunk limit and what is left of the overall budget.
+
+    Args:
+        documents: Retrieved chunks, best first
+        query: The user's question
+        token_budget: Maximum tokens for all chunk texts together
+        chunk_max_tokens: Maximum tokens kept from a single chunk
+        dedup_threshold: Fraction of repeated sentences at which a chunk is dropped
+
+    Returns:
+        (packed documents with trimmed text, stats dict)
+    """
+    query_terms = set(tokenize(query))
+    seen_sentences = set()
+    packed: List[Document] = []
+    stats = {"input_chunks": len(documents), "input_tokens": 0, "context_tokens": 0, "dropped_duplicates": 0}
+    remaining = token_budget
+
+    for doc in documents:
+        sentences = split_sentences(doc.page_content)
+        stats["input_tokens"] += count_tokens(doc.page_content)
+        if not sentences:
+            continue
+
+        keys = [_normalize(sentence) for sentence in sentences]
+        repeated = sum(1 for key in keys if key in seen_sentences)
+        if repeated / len(sentences) >= dedup_threshold:
+            stats["dropped_duplicates"] += 1
+            continue
+        fresh = [sentence for sentence, key in zip(sentences, keys) if key not in seen_sentences]
+        seen_sentences.update(keys)
+
+        if remaining <= 0:
+            break
+        kept, used = _trim_to_budget(fresh, query_terms, min(chunk_max_tokens, remaining))
+        if not kept:
+            continue
+        remaining -= used
+        stats["context_tokens"] += used
+        packed.append(Document(page_content=" ".join(kept), metadata=doc.metadata))
+
+    stats["output_chunks"] = len(packed)
+    return packed, stats
@@ -0,0 +1,293 @@
+# Write-behind persistence of query history: batched, off the request path
+import asyncio
+import random
+import sqlite3
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Optional
+
+from app.core.config import (
+    METRICS_ENABLED, HISTORY_WRITE_BEHIND, HISTORY_QUEUE_MAX, HISTORY_BATCH_SIZE,
+    HISTORY_FLUSH_INTERVAL_MS, HISTORY_ENQUEUE_TIMEOUT_S, HISTORY_WRITE_RETRIES,
+)
+from app.core.logging import get_logger
+from app.core.metrics import REGISTRY, Histogram, gauge_lines
+from app.db.storage_factory import save_query_history_batch
+
+logger = get_logger(__name__)
+
+HISTORY_WRITE_LAG = REGISTRY.register(Histogram(
+    "askify_history_write_lag_seconds",
+    "Time from a query history entry being queued to it being saved",
+))
+
+# Queued by stop() after the last entry; the writer saves what it has and exits
+_STOP = object()
+
+# Postgres error classes that a retry cannot fix: data exceptions, integrity constraint
+# violations, and syntax errors or missing privileges (SQLSTATE 22, 23 and 42)
+PERMANENT_SQLSTATE_CLASSES = ("22", "23", "42")
+UNIQUE_VIOLATION = "23505"
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed history write may succeed if repeated
+
+    Connection problems, timeouts and a busy database are transient. Errors
+    in the data itself (PostgREST's SQLSTATE codes and PGRST request errors,
+    SQLite constraint violations, bad entries) fail the same way every time.
+    """
+    code = str(getattr(error, "code", None) or "")
+    if code.startswith("PGRST") or code[:2] in PERMANENT_SQLSTATE_CLASSES:
+        return False
+    return not isinstance(error, (
+        sqlite3.IntegrityError, sqlite3.InterfaceError, AttributeError, KeyError, TypeError, ValueError
+    ))
+
+def _already_saved(error: Exception) -> bool:
+    """A duplicate key on the entry's own id: an earlier attempt that timed out did commit it"""
+    if isinstance(error, sqlite3.IntegrityError):
+        return "UNIQUE constraint failed" in str(error)
+    return str(getattr(error, "code", None) or "") == UNIQUE_VIOLATION
+
+class HistoryWriter:
+    """
+    Saves query history entries in batches from a background task
+
+    save() queues the entry and returns its id without waiting for the
+    database. The writer takes up to `batch_size` entries, or whatever
+    arrived within `flush_interval_ms` of the first, and saves them with one
+    multi-row write in a worker thread, retrying transient failures with
+    jittered backoff. A batch that fails for good (such as a constraint
+    violation) is saved entry by entry, so only the entries that fail on
+    their own are dropped. When the queue is full, save() waits up to
+    HISTORY_ENQUEUE_TIMEOUT_S for room (backpressure) and then saves the entry
+    itself, so entries are never dropped for lack of space. When the writer
+    is not running (disabled, or not started outside the app) save() writes
+    the entry directly.
+    """
+
+    def __init__(self, max_queued: int = HISTORY_QUEUE_MAX, batch_size: int = HISTORY_BATCH_SIZE,
+                 flush_interval_ms: float = HISTORY_FLUSH_INTERVAL_MS):
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._pending: deque = deque()  # queue times of entries not yet saved, oldest first
+        self._collecting: List = []  # the batch being gathered from the queue
+        self._writing: List = []  # the batch being written
+        self._write_lock = asyncio.Lock()  # held while a batch is written
+        self.counters = {"queued": 0, "saved": 0, "batches": 0, "dropped": 0, "backpressure": 0, "direct": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._closing
+
+    def start(self):
+        """Start the background task (from the running event loop)"""
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queued)
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 30.0):
+        """Save every queued entry, then stop the background task"""
+        if not self.running:
+            return
+        self._closing = True
+        try:
+            await asyncio.wait_for(self.queue.put(_STOP), timeout)
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.error("Query history writer did not finish saving before shutdown",
+                         extra={"unsaved": len(self._pending)})
+            self._task.cancel()
+
+    async def save(self, **entry) -> str:
+        """Queue a query history entry (the storage backend's save_query_history arguments); returns its id"""
+        entry.setdefault("id", str(uuid.uuid4()))
+        if not self.running:
+            await self._save_directly(entry)
+            return entry["id"]
+        item = (time.monotonic(), entry)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.counters["backpressure"] += 1
+            try:
+                await asyncio.wait_for(self.queue.put(item), HISTORY_ENQUEUE_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                self.counters["direct"] += 1
+                await self._save_directly(entry)
+                return entry["id"]
+        self._pending.append(item[0])
+        self.counters["queued"] += 1
+        return entry["id"]
+
+    async def _save_directly(self, entry: Dict):
+        await asyncio.to_thread(save_query_history_batch, [entry])
+
+    async def flush_user(self, user_id: str):
+        """
+        Save one user's unsaved entries now, and wait for any of theirs being written
+
+        Called before deleting a user's history, so the delete sees every
+        entry already answered and no queued entry is written after it.
+        """
+        if not self.running:
+            return
+        mine = [item for item in self._collecting if item[1]["user_id"] == user_id]
+        self._collecting[:] = [item for item in self._collecting if item[1]["user_id"] != user_id]
+        # Nothing else runs on the loop between taking the queue apart and refilling it
+        queued = []
+        while True:
+            try:
+                queued.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        for item in queued:
+            if item is not _STOP and item[1]["user_id"] == user_id:
+                mine.append(item)
+            else:
+                self.queue.put_nowait(item)
+
+        if any(entry["user_id"] == user_id for _, entry in self._writing):
+            async with self._write_lock:
+                pass
+        if not mine:
+            return
+        for queued_at, _ in mine:
+            self._pending.remove(queued_at)
+        entries = [entry for _, entry in mine]
+        try:
+            await self._save_with_retries(entries)
+            self.counters["saved"] += len(entries)
+        except Exception:
+            self.counters["dropped"] += len(entries)
+            logger.exception("Dropped query history entries while flushing a user", extra={"user_id": user_id, "entries": len(entries)})
+
+    async def _run(self):
+        while True:
+            batch, stopping = await self._next_batch()
+            self._collecting = []
+            if batch:
+                async with self._write_lock:
+                    self._writing = batch
+                    try:
+                        await self._write(batch)
+                    finally:
+                        self._writing = []
+            if stopping:
+                return
+
+    async def _next_batch(self):
+        """Up to batch_size queued items, waiting at most flush_interval after the first; and whether stop() was called"""
+        item = await self.queue.get()
+        if item is _STOP:
+            return [], True
+        batch = self._collecting = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _save_with_retries(self, entries: List[Dict]):
+        """Save entries with one write, retrying transient failures; raises the last error"""
+        for attempt in range(HISTORY_WRITE_RETRIES + 1):
+            try:
+                await asyncio.to_thread(save_query_history_batch, entries)
+                return
+            except Exception as e:
+                if attempt == HISTORY_WRITE_RETRIES or not is_retryable(e):
+                    raise
+                await asyncio.sleep(random.uniform(0, min(5.0, 0.2 * 2 ** attempt)))
+
+    async def _save_one_by_one(self, batch: List) -> List:
+        """Save a batch's entries separately; returns the items that were saved"""
+        saved = []
+        for item in batch:
+            entry = item[1]
+            try:
+                await self._save_with_retries([entry])
+            except Exception as e:
+                if not _already_saved(e):
+                    self.counters["dropped"] += 1
+                    logger.exception("Dropped query history entry", extra={"user_id": entry.get("user_id"), "query_id": entry.get("id")})
+                    continue
+            saved.append(item)
+        return saved
+
+    async def _write(self, batch: List):
+        entries = [entry for _, entry in batch]
+        try:
+            try:
+                await self._save_with_retries(entries)
+                saved = batch
+            except Exception as e:
+                if is_retryable(e):
+                    self.counters["dropped"] += len(entries)
+                    logger.exception("Dropped query history batch after retries", extra={"entries": len(entries)})
+                    return
+                logger.warning("Query history batch rejected, saving its entries one by one: %s", e,
+                               extra={"entries": len(entries)})
+                saved = await self._save_one_by_one(batch)
+            self.counters["saved"] += len(saved)
+            self.counters["batches"] += 1
+            if METRICS_ENABLED:
+                now = time.monotonic()
+                for queued_at, _ in saved:
+                    HISTORY_WRITE_LAG.observe(now - queued_at)
+        finally:
+            for _ in batch:
+                self._pending.popleft()
+
+    def stats(self) -> Dict:
+        oldest = self._pending[0] if self._pending else None
+        return {
+            **self.counters,
+            "running": self.running,
+            "unsaved": len(self._pending),
+            "lag_ms": round((time.monotonic() - oldest) * 1000, 1) if oldest is not None else 0.0,
+        }
+
+# The process-wide writer, started and stopped with the app
+history_writer = HistoryWriter()
+
+def start_history_writer():
+    if HISTORY_WRITE_BEHIND:
+        history_writer.start()
+
+def _collect_metrics() -> List[str]:
+    stats = history_writer.stats()
+    lines = []
+    for counter, documentation in (
+        ("queued", "Query history entries queued for the background writer"),
+        ("saved", "Query history entries saved by the background writer"),
+        ("batches", "Batch writes made by the background writer"),
+        ("dropped", "Query history entries dropped after failed writes"),
+        ("backpressure", "Saves that waited for room in a full queue"),
+        ("direct", "Saves written by the request after waiting too long for room"),
+    ):
+        lines += gauge_lines(f"askify_history_writer_{counter}_total", documentation, {(): stats[counter]}, kind="counter")
+    lines += gauge_lines("askify_history_writer_unsaved", "Query history entries queued or being saved", {(): stats["unsaved"]})
+    lines += gauge_lines("askify_history_writer_lag_seconds", "Age of the oldest unsaved query history entry",
+                         {(): stats["lag_ms"] / 1000})
+    return lines
+
+REGISTRY.add_collector(_collect_metrics)
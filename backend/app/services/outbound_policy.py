@@ -0,0 +1,348 @@
+# Outbound call policy for LLM and embedding APIs: adaptive concurrency, retries and hedging
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app.core.metrics import REGISTRY, gauge_lines
+from app.core.config import (
+    OUTBOUND_INITIAL_CONCURRENCY,
+    OUTBOUND_MIN_CONCURRENCY,
+    OUTBOUND_MAX_CONCURRENCY,
+    OUTBOUND_QUEUE_TIMEOUT_S,
+    OUTBOUND_MAX_RETRIES,
+    OUTBOUND_RETRY_BASE_MS,
+    OUTBOUND_RETRY_MAX_MS,
+    OUTBOUND_RETRY_BUDGET_RATIO,
+    HEDGE_EMBEDDINGS,
+    HEDGE_PERCENTILE,
+    HEDGE_MIN_SAMPLES,
+)
+
+# HTTP statuses worth retrying; 429 and timeouts also mean the upstream is overloaded
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+OVERLOAD_STATUSES = {408, 429, 503}
+
+class QueueTimeout(Exception):
+    """A call waited longer than OUTBOUND_QUEUE_TIMEOUT_S for a concurrency slot"""
+
+def _percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+def _operation(fn: Callable) -> str:
+    """Name under which a call's latency is tracked: the function's, or the callable's class"""
+    return getattr(fn, "__name__", type(fn).__name__)
+
+def classify_error(error: Exception):
+    """
+    (retryable, overloaded) for an exception raised by an API call
+
+    Uses the HTTP status when the error carries one (the OpenAI client's
+    errors do); connection errors and timeouts are retryable, and timeouts
+    count as overload.
+    """
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUSES, status in OVERLOAD_STATUSES
+    name = type(error).__name__
+    if "Timeout" in name:
+        return True, True
+    if "Connection" in name:
+        return True, False
+    return False, False
+
+def _retry_after_seconds(error: Exception) -> float:
+    """The server's Retry-After hint, if the error carries a response with one"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+class AIMDLimiter:
+    """
+    Adaptive concurrency limit: additive increase, multiplicative decrease
+
+    Each successful call while the limit is in use raises it by 1/limit
+    (about +1 per round of calls); an overload signal (429, timeout) halves
+    it. Only calls admitted after the last decrease can trigger another, so
+    one burst of rejections counts once.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.queued = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        """Wait for a slot; returns the admission time to pass to release()"""
+        start = time.monotonic()
+        with self._condition:
+            self.queued += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                    if remaining is not None and remaining <= 0:
+                        raise QueueTimeout(f"No outbound slot within {timeout}s (limit {int(self.limit)})")
+                    self._condition.wait(remaining)
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+        return time.monotonic()
+
+    def try_acquire(self) -> Optional[float]:
+        """Take a slot only if one is free right now"""
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return None
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, admitted_at: float, succeeded: bool, overloaded: bool = False):
+        with self._condition:
+            saturated = self.in_flight >= int(self.limit) or self.queued > 0
+            self.in_flight -= 1
+            if overloaded:
+                if admitted_at >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = time.monotonic()
+            elif succeeded and saturated:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of recent traffic: every call deposits `ratio`
+    tokens and every retry spends one, so retries cannot multiply load when
+    the upstream is failing. A small reserve allows retries at low traffic.
+    """
+
+    def __init__(self, ratio: float, reserve: float = 10.0):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = reserve
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.reserve + 100 * self.ratio, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class OutboundPolicy:
+    """
+    Shared policy for one kind of outbound call (LLM or embeddings)
+
+    Calls wait for a slot from an AIMD concurrency limiter, are retried with
+    full-jitter exponential backoff (honouring Retry-After) while the retry
+    budget allows. Calls of the operations listed in `hedge` get a duplicate
+    request if the first is still running after the HEDGE_PERCENTILE latency
+    of recent calls of the same operation; whichever answers first wins.
+    Latencies are tracked per operation (the called function's name), since
+    a single query embedding and a batch of documents take very different times.
+    """
+
+    def __init__(self, name: str, hedge: Tuple[str, ...] = ()):
+        self.name = name
+        self.hedge = hedge
+        self.limiter = AIMDLimiter(OUTBOUND_INITIAL_CONCURRENCY, OUTBOUND_MIN_CONCURRENCY, OUTBOUND_MAX_CONCURRENCY)
+        self.budget = RetryBudget(OUTBOUND_RETRY_BUDGET_RATIO)
+        self._executor = ThreadPoolExecutor(max_workers=OUTBOUND_MAX_CONCURRENCY * 2, thread_name_prefix=f"{name}-call")
+        self._latencies: Dict[str, deque] = {}
+        self._queue_waits = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0, "attempts": 0, "failures": 0, "retries": 0, "retries_denied": 0,
+            "overloads": 0, "hedges": 0, "hedge_wins": 0, "queue_timeouts": 0,
+        }
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _hedge_delay(self, operation: str) -> Optional[float]:
+        with self._lock:
+            latencies = self._latencies.get(operation, ())
+            if operation not in self.hedge or len(latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            return _percentile(latencies, HEDGE_PERCENTILE)
+
+    def _attempt(self, fn: Callable, args, kwargs, admitted_at: Optional[float] = None):
+        """One request under the concurrency limit (`admitted_at` if the slot is already held)"""
+        if admitted_at is None:
+            queued_at = time.monotonic()
+            try:
+                admitted_at = self.limiter.acquire(OUTBOUND_QUEUE_TIMEOUT_S)
+            except QueueTimeout:
+                self._count("queue_timeouts")
+                raise
+            with self._lock:
+                self._queue_waits.append(admitted_at - queued_at)
+        self._count("attempts")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            _, overloaded = classify_error(e)
+            if overloaded:
+                self._count("overloads")
+            self.limiter.release(admitted_at, succeeded=False, overloaded=overloaded)
+            raise
+        self.limiter.release(admitted_at, succeeded=True)
+        with self._lock:
+            self._latencies.setdefault(_operation(fn), deque(maxlen=1000)).append(time.monotonic() - admitted_at)
+        return result
+
+    def _attempt_hedged(self, fn: Callable, args, kwargs):
+        delay = self._hedge_delay(_operation(fn))
+        if delay is None:
+            return self._attempt(fn, args, kwargs)
+        # Attempts run in copies of the caller's context, so their log lines keep the request ID
+        primary = self._executor.submit(contextvars.copy_context().run, self._attempt, fn, args, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        # Hedge only with a free slot, so hedges never queue behind real traffic
+        admitted_at = None if done else self.limiter.try_acquire()
+        if admitted_at is None:
+            return primary.result()
+        self._count("hedges")
+        hedge = self._executor.submit(contextvars.copy_context().run, self._attempt, fn, args, kwargs, admitted_at)
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        winner = next(iter(done))
+        if winner.exception() is not None:
+            # The other request may still succeed
+            other = hedge if winner is primary else primary
+            return other.result()
+        if winner is hedge:
+            self._count("hedge_wins")
+        return winner.result()
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` under this policy"""
+        self._count("calls")
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return self._attempt_hedged(fn, args, kwargs)
+            except QueueTimeout:
+                self._count("failures")
+                raise
+            except Exception as e:
+                retryable, _ = classify_error(e)
+                if not retryable or attempt >= OUTBOUND_MAX_RETRIES:
+                    self._count("failures")
+                    raise
+                if not self.budget.withdraw():
+                    self._count("retries_denied")
+                    self._count("failures")
+                    raise
+                attempt += 1
+                self._count("retries")
+                backoff = random.uniform(0, min(OUTBOUND_RETRY_MAX_MS, OUTBOUND_RETRY_BASE_MS * 2 ** attempt)) / 1000
+                time.sleep(min(OUTBOUND_RETRY_MAX_MS / 1000, max(backoff, _retry_after_seconds(e))))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            latencies = [latency for values in self._latencies.values() for latency in values]
+            queue_waits = list(self._queue_waits)
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+            "queued": self.limiter.queued,
+            "queue_wait_p50_ms": round(_percentile(queue_waits, 50) * 1000, 1),
+            "queue_wait_p95_ms": round(_percentile(queue_waits, 95) * 1000, 1),
+            "latency_p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+            "latency_p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+            "latency_p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        }
+
+# One policy per upstream kind, shared by every caller in the process
+_policies = {
+    "llm": OutboundPolicy("llm"),
+    "embeddings": OutboundPolicy("embeddings", hedge=("embed_query",) if HEDGE_EMBEDDINGS else ()),
+}
+
+def get_policy(name: str) -> OutboundPolicy:
+    return _policies[name]
+
+def outbound_stats() -> Dict[str, Dict]:
+    """Current statistics of every outbound policy"""
+    return {name: policy.stats() for name, policy in _policies.items()}
+
+def _collect_metrics() -> List[str]:
+    stats = outbound_stats()
+    lines = []
+    for counter in ("calls", "attempts", "failures", "retries", "retries_denied", "overloads", "hedges", "hedge_wins", "queue_timeouts"):
+        lines += gauge_lines(
+            f"askify_outbound_{counter}_total", f"Outbound API {counter.replace('_', ' ')}",
+            {(("api", api),): values[counter] for api, values in stats.items()}, kind="counter",
+        )
+    for gauge in ("concurrency_limit", "in_flight", "queued"):
+        lines += gauge_lines(
+            f"askify_outbound_{gauge}", f"Outbound API {gauge.replace('_', ' ')}",
+            {(("api", api),): values[gauge] for api, values in stats.items()},
+        )
+    for name, key in (("queue_wait", "queue_wait_p{}_ms"), ("latency", "latency_p{}_ms")):
+        percentiles = (50, 95) if name == "queue_wait" else (50, 95, 99)
+        lines += gauge_lines(
+            f"askify_outbound_{name}_seconds", f"Outbound API {name.replace('_', ' ')} percentiles over recent calls",
+            {
+                (("api", api), ("quantile", str(p / 100))): values[key.format(p)] / 1000
+                for api, values in stats.items() for p in percentiles
+            },
+        )
+    return lines
+
+REGISTRY.add_collector(_collect_metrics)
+
+class PolicyEmbeddings(Embeddings):
+    """Embeddings model whose API calls go through the "embeddings" policy"""
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return get_policy("embeddings").call(self.embeddings.embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return get_policy("embeddings").call(self.embeddings.embed_query, text)
+
+class PolicyChatModel(BaseChatModel):
+    """Chat model whose API calls go through the "llm" policy"""
+
+    model: BaseChatModel
+
+    @property
+    def _llm_type(self) -> str:
+        return f"policy-{self.model._llm_type}"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        message = get_policy("llm").call(self.model.invoke, messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
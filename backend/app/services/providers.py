@@ -0,0 +1,144 @@
+# Provider registry - chooses the LLM and embeddings model (OpenAI or a local fake)
+import hashlib
+import json
+import math
+import re
+import time
+from functools import lru_cache
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app.core.config import (
+    LLM_PROVIDER,
+    LLM_MODEL_NAME,
+    OPENAI_API_KEY,
+    FAKE_EMBEDDING_DIM,
+    FAKE_EMBEDDING_LATENCY_MS,
+    FAKE_LLM_LATENCY_MS,
+    OUTBOUND_POLICY_ENABLED,
+    OPENAI_TIMEOUT_S,
+)
+from app.core.logging import get_logger
+from app.db.lexical_index import tokenize
+
+PROVIDERS = ("openai", "fake")
+
+logger = get_logger(__name__)
+
+if LLM_PROVIDER not in PROVIDERS:
+    raise ValueError(f"LLM_PROVIDER must be one of {PROVIDERS}, got '{LLM_PROVIDER}'")
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic local embeddings: hashed bag of lexical terms, L2-normalized.
+
+    Texts that share terms get similar vectors, so retrieval behaves sensibly,
+    and the same text always gets the same vector in every process. Each call
+    sleeps `latency_ms` to stand in for the API round trip.
+    """
+
+    def __init__(self, dim: int = FAKE_EMBEDDING_DIM, latency_ms: float = FAKE_EMBEDDING_LATENCY_MS):
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for term in tokenize(text):
+            digest = hashlib.blake2b(term.encode(), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dim] += 1.0 if value >> 63 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector))
+        if not norm:
+            # No terms at all: a fixed unit vector rather than a zero vector
+            vector[0], norm = 1.0, 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+def fake_completion(prompt: str) -> str:
+    """
+    The fake LLM's deterministic reply to a prompt: the first sentence of the
+    prompt's context. Prompts asking for a JSON "answers" list (batch
+    questions) get one such answer per numbered question.
+    """
+    questions_part, _, context = prompt.partition("Context:")
+    match = re.search(r"Content:\s*(.+?[.!?])(?:\s|$)", context, flags=re.DOTALL)
+    answer = f"According to the page: {match.group(1).strip()}" if match else "The page does not say."
+    if '"answers"' in prompt:
+        questions = re.findall(r"^\s*\d+\. ", questions_part, flags=re.MULTILINE)
+        return json.dumps({"answers": [answer] * len(questions)})
+    return answer
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic local chat model (see fake_completion); each call sleeps `latency_ms`"""
+
+    latency_ms: float = FAKE_LLM_LATENCY_MS
+
+    @property
+    def _llm_type(self) -> str:
+        return "askify-fake"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        prompt = "\n".join(str(message.content) for message in messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=fake_completion(prompt)))])
+
+def _create_llm():
+    if LLM_PROVIDER == "fake":
+        logger.info("Using the local fake LLM")
+        return FakeChatModel()
+    from langchain_openai import ChatOpenAI
+    # Retries are left to the outbound policy so they are budgeted and jittered in one place
+    return ChatOpenAI(
+        openai_api_key=OPENAI_API_KEY,
+        model_name=LLM_MODEL_NAME,
+        temperature=0.2,
+        request_timeout=OPENAI_TIMEOUT_S,
+        max_retries=0 if OUTBOUND_POLICY_ENABLED else 2,
+    )
+
+def _create_embeddings():
+    if LLM_PROVIDER == "fake":
+        logger.info("Using the local fake embeddings model")
+        return FakeEmbeddings()
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(
+        openai_api_key=OPENAI_API_KEY,
+        request_timeout=OPENAI_TIMEOUT_S,
+        max_retries=0 if OUTBOUND_POLICY_ENABLED else 2,
+    )
+
+@lru_cache(maxsize=1)
+def get_llm():
+    """The chat model used for answers, per LLM_PROVIDER, behind the outbound policy"""
+    llm = _create_llm()
+    if not OUTBOUND_POLICY_ENABLED:
+        return llm
+    from app.services.outbound_policy import PolicyChatModel
+    return PolicyChatModel(model=llm)
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """The embeddings model used for ingestion and retrieval, per LLM_PROVIDER, behind the outbound policy"""
+    embeddings = _create_embeddings()
+    if not OUTBOUND_POLICY_ENABLED:
+        return embeddings
+    from app.services.outbound_policy import PolicyEmbeddings
+    return PolicyEmbeddings(embeddings)
@@ -1,160 +1,349 @@
 # Query processing service using LangChain RAG
+import contextvars
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional, Sequence
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.chains import RetrievalQAWithSourcesChain
 from langchain_core.documents import Document
-from langchain.prompts import PromptTemplate
-from urllib.parse import urlparse
-from langchain_core.retrievers import BaseRetriever
-
-from app.core.config import OPENAI_API_KEY
-from app.db.vector_store import get_vector_store_for_user, collection_has_documents
-from app.services.content_service import process_and_store_content, extract_webpage_content
-
-# Initialize LLM
-llm = ChatOpenAI(
-    openai_api_key=OPENAI_API_KEY,
-    model_name="gpt-4o-mini",
-    temperature=0.2
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from app.core.config import BATCH_CONTEXT_TOKEN_BUDGET
+from app.db.vector_store import collection_has_documents
+from app.db.retention import record_page_access
+from app.core.logging import get_logger
+from app.core.timing import StageTimings, timed
+from app.services.retrieval_service import retrieve_relevant_documents, resolve_retrieval_mode
+from app.services.context_service import pack_context, count_tokens
+from app.services.content_service import process_and_store_content, CONTENT_BLOCKED
+from app.services.providers import get_llm, get_embeddings
+
+logger = get_logger(__name__)
+
+# Models from the configured provider
+llm = get_llm()
+embeddings = get_embeddings()
+
+# Answer generation prompt; the context is the pre-filtered chunks, "stuffed" into {summaries}
+ANSWER_PROMPT = PromptTemplate(
+    template="""You are a helpful, professional assistant that provides accurate and well-formatted information, try to be concise.
+                
+                Use Markdown formatting to organize your answers with headings, bullet points, bold text, etc.
+                For code blocks, use proper syntax highlighting with the appropriate language specified.
+                For tables, use proper Markdown table formatting.
+                For lists, use proper numbered or bulleted lists.
+                Use bold formatting for key points.
+                
+                Please answer the following question based on the provided context:
+                
+                {question}
+                
+                Context:
+                {summaries}
+                
+                Answer:""",
+    input_variables=["summaries", "question"]
 )
 
-# Initialize embeddings
-embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+# How each chunk is rendered into the context (same layout the "stuff" QA-with-sources chain used)
+DOCUMENT_TEMPLATE = "Content: {page_content}\nSource: {source}"
 
-class PreFilteredRetriever(BaseRetriever):
-    """A retriever that returns pre-filtered documents"""
-    
-    documents: Sequence[Document]
-    
-    model_config = {"arbitrary_types_allowed": True}
-    
-    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
-        """Return the already filtered documents"""
-        return list(self.documents)
-    
-    async def _aget_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
-        """Async version - return the already filtered documents"""
-        return list(self.documents)
+# Several questions about one page answered in a single call, as a JSON list in question order
+BATCH_ANSWER_PROMPT = PromptTemplate(
+    template="""You are a helpful, professional assistant that provides accurate and well-formatted information, try to be concise.
+                
+                Use Markdown formatting inside each answer: headings, bullet points, bold text, code blocks with the language specified, and Markdown tables.
+                
+                Answer each of the following questions based on the provided context. Answer every question separately and completely; do not refer to the other answers.
+                
+                Questions:
+                {questions}
+                
+                Context:
+                {summaries}
+                
+                Respond with only a JSON object of the form {{"answers": ["answer to question 1", "answer to question 2", ...]}}, with exactly one answer per question, in order.""",
+    input_variables=["summaries", "questions"]
+)
+
+# Fixed replies for requests that never reach the LLM
+BLOCKED_ANSWER = "I'm unable to access content on this website. The site appears to be blocking automated access."
+NO_CONTENT_ANSWER = "I don't have any information about this page yet. Please try again after browsing the page for a moment."
+NOT_FOUND_ANSWER = "I couldn't find any relevant information about that topic on this page. Please try a different question."
 
-def answer_query(user_id: str, query: str, url: str) -> Dict:
+def build_answer_chain(model):
+    """
+    Build the answer-generation runnable: prompt -> LLM -> plain text.
+    Built once and reused, since retrieval already happened before it runs.
+    """
+    return ANSWER_PROMPT | model | StrOutputParser()
+
+def build_batch_answer_chain(model):
+    """Like build_answer_chain, for BATCH_ANSWER_PROMPT"""
+    return BATCH_ANSWER_PROMPT | model | StrOutputParser()
+
+answer_chain = build_answer_chain(llm)
+batch_answer_chain = build_batch_answer_chain(llm)
+
+# Runs each request's query embedding alongside page ingestion
+_query_embedding_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="query-embed")
+
+def _embed_query(query: str, timings: StageTimings) -> List[float]:
+    with timed(timings, "query_embedding"):
+        return embeddings.embed_query(query)
+
+def format_documents(documents: Sequence[Document]) -> str:
+    """Render retrieved chunks into the prompt's context section"""
+    return "\n\n".join(
+        DOCUMENT_TEMPLATE.format(page_content=doc.page_content, source=doc.metadata.get("source", ""))
+        for doc in documents
+    )
+
+def strip_sources_section(answer: str) -> str:
+    """Drop a trailing "SOURCES:" section if the model adds one; sources are returned separately"""
+    match = re.search(r"SOURCES?:", answer, flags=re.IGNORECASE)
+    return answer[:match.start()].strip() if match else answer
+
+def format_sources(documents: Sequence[Document]) -> Dict[str, List[str]]:
+    """Group snippets of the retrieved chunks by source URL"""
+    sources = {}
+    for doc in documents:
+        source_url = doc.metadata.get("source")
+        if source_url:
+            snippet = doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
+            if source_url in sources:
+                sources[source_url].append(snippet)
+            else:
+                sources[source_url] = [snippet]
+    return sources
+
+def parse_batch_answers(output: str, expected: int) -> Optional[List[str]]:
+    """
+    Read the answers out of a batch completion
+
+    Returns:
+        One answer per question, or None if the output is not the expected JSON
+    """
+    # Models sometimes wrap JSON in a Markdown code block
+    output = re.sub(r"^```(?:json)?\s*|\s*```$", "", output.strip())
+    try:
+        answers = json.loads(output)["answers"]
+    except (ValueError, KeyError, TypeError):
+        return None
+    if not isinstance(answers, list) or len(answers) != expected or not all(isinstance(a, str) for a in answers):
+        return None
+    return [strip_sources_section(answer) for answer in answers]
+
+def _pack(documents: Sequence[Document], query: str, url: str, **options):
+    """Pack chunks into the prompt context; returns (context text, context stats)"""
+    context_docs, context_stats = pack_context(documents, query, **options)
+    logger.debug("Packed context", extra={"url": url, **context_stats})
+    return format_documents(context_docs), context_stats
+
+def answer_query(user_id: str, query: str, url: str, retrieval_mode: Optional[str] = None) -> Dict:
     """
     Answer a query using RAG (Retrieval Augmented Generation)
     
+    The query embedding does not depend on the page, so it is computed in the
+    background while the page is checked, fetched, chunked and embedded;
+    only the search waits for it.
+    
     Args:
         user_id: The ID of the user asking the question
         query: The question asked by the user
         url: The URL of the current page
+        retrieval_mode: Optional override of RETRIEVAL_MODE ("dense", "lexical" or "hybrid")
     
     Returns:
-        Dict containing the answer and source information
+        Dict containing the answer, source information and per-stage timings (ms)
     """
+    timings = StageTimings()
+    mode = resolve_retrieval_mode(retrieval_mode)
+    
+    # Lexical retrieval never needs the query embedding
+    query_vector_future = None
+    if mode != "lexical":
+        query_vector_future = _query_embedding_executor.submit(contextvars.copy_context().run, _embed_query, query, timings)
+    
+    def finish(result: Dict) -> Dict:
+        if query_vector_future is not None:
+            query_vector_future.cancel()
+        result["timings"] = timings.summary()
+        logger.info("Answered query", extra={"user_id": user_id, "url": url, "timings": result["timings"]})
+        return result
+    
     # Process and store content if it doesn't already exist
-    content_processed = process_and_store_content(user_id, url, embeddings)
-    
-    # If processing failed, check if it's because the site is blocking us
-    if not content_processed:
-        content = extract_webpage_content(url)
-        if content.startswith("SITE_BLOCKED:"):
-            return {
-                "answer": "I'm unable to access content on this website. The site appears to be blocking automated access.",
-                "sources": {},
-                "confidence": 0.0
-            }
+    content_status = process_and_store_content(user_id, url, embeddings, timings)
+    
+    # Processing reports when the site is blocking us, no need to fetch the page again
+    if content_status == CONTENT_BLOCKED:
+        return finish({
+            "answer": BLOCKED_ANSWER,
+            "sources": {},
+            "confidence": 0.0
+        })
     
     # Check if the collection has any documents at all
-    has_documents = collection_has_documents(user_id, embeddings)
+    with timings.stage("has_documents"):
+        has_documents = collection_has_documents(user_id, embeddings)
     if not has_documents:
-        return {
-            "answer": "I don't have any information about this page yet. Please try again after browsing the page for a moment.",
+        return finish({
+            "answer": NO_CONTENT_ANSWER,
             "sources": {},
             "confidence": 0.0
-        }
-    
-    # Get the user's vector store (now containing the URL's content if it was new)
-    vector_store = get_vector_store_for_user(user_id, embeddings)
-    
-    # Extract URL details for exact URL-specific filtering
-    parsed_url = urlparse(url)
+        })
     
-    # Get documents from the exact URL only
-    try:
-        url_specific_docs = vector_store.similarity_search_with_relevance_scores(
+    # Get documents from the exact URL only, using the configured (or requested) retrieval mode
+    query_vector = query_vector_future.result() if query_vector_future is not None else None
+    with timings.stage("retrieve"):
+        relevant_docs = retrieve_relevant_documents(
+            user_id=user_id,
             query=query,
-            k=5,
-            filter={"full_url": url}  # Filter for documents from this exact URL
+            url=url,
+            embeddings=embeddings,
+            mode=mode,
+            query_vector=query_vector
         )
-    except Exception as e:
-        # Fall back to source filter if full_url filter fails
-        try:
-            url_specific_docs = vector_store.similarity_search_with_relevance_scores(
-                query=query,
-                k=5,
-                filter={"source": url}  # Traditional source filter
-            )
-        except Exception:
-            url_specific_docs = []
-    
-    # Use only URL-specific docs
-    all_docs = url_specific_docs
-    
-    # Filter to only include documents with sufficient similarity (score > 0.5)
-    relevant_docs = [doc for doc, score in all_docs if score > 0.5]
+    record_page_access(user_id, url)
     
     if len(relevant_docs) == 0:
-        return {
-            "answer": "I couldn't find any relevant information about that topic on this page. Please try a different question.",
+        return finish({
+            "answer": NOT_FOUND_ANSWER,
             "sources": {},
             "confidence": 0.0
-        }
-    
-    # Create a custom document retriever with our pre-filtered documents
-    retriever = PreFilteredRetriever(documents=relevant_docs)
-    
-    # Create retrieval chain
-    qa_chain = RetrievalQAWithSourcesChain.from_chain_type(
-        llm=llm,
-        chain_type="stuff",  # "stuff" method concatenates all docs into one prompt
-        retriever=retriever,
-        return_source_documents=True,
-        chain_type_kwargs={
-            "prompt": PromptTemplate(
-                template="""You are a helpful, professional assistant that provides accurate and well-formatted information, try to be concise.
-                
-                Use Markdown formatting to organize your answers with headings, bullet points, bold text, etc.
-                For code blocks, use proper syntax highlighting with the appropriate language specified.
-                For tables, use proper Markdown table formatting.
-                For lists, use proper numbered or bulleted lists.
-                Use bold formatting for key points.
-                
-                Please answer the following question based on the provided context:
-                
-                {question}
-                
-                Context:
-                {summaries}
-                
-                Answer:""",
-                input_variables=["summaries", "question"]
+        })
+    
+    # Deduplicate and trim the chunks to the context token budget
+    with timings.stage("context"):
+        summaries, _ = _pack(relevant_docs, query, url)
+        prompt_tokens = count_tokens(ANSWER_PROMPT.format(question=query, summaries=summaries))
+    
+    # Generate the answer from the packed context with the prebuilt chain
+    with timings.stage("llm"):
+        answer = strip_sources_section(answer_chain.invoke({
+            "question": query,
+            "summaries": summaries
+        }))
+    
+    return finish({
+        "answer": answer,
+        "sources": format_sources(relevant_docs),
+        "confidence": 0.95,
+        "prompt_tokens": prompt_tokens
+    })
+
+def answer_questions(user_id: str, questions: List[str], url: str, retrieval_mode: Optional[str] = None) -> Dict:
+    """
+    Answer several questions about one page in one pass
+    
+    The page is ingested once, all questions are embedded in one batched call
+    (alongside ingestion, as in answer_query), and the union of their relevant
+    chunks goes into a single LLM call that answers every question. If that
+    output cannot be parsed, each question is answered from its own chunks
+    with the regular answer chain instead.
+    
+    Args:
+        user_id: The ID of the user asking the questions
+        questions: The questions, all about the same page
+        url: The URL of the current page
+        retrieval_mode: Optional override of RETRIEVAL_MODE ("dense", "lexical" or "hybrid")
+    
+    Returns:
+        Dict with "results" (one answer, sources and confidence per question, in
+        order), the total prompt tokens and per-stage timings (ms)
+    """
+    timings = StageTimings()
+    mode = resolve_retrieval_mode(retrieval_mode)
+    
+    def embed_questions() -> List[List[float]]:
+        with timings.stage("query_embedding"):
+            return embeddings.embed_documents(questions)
+    
+    query_vectors_future = None
+    if mode != "lexical":
+        query_vectors_future = _query_embedding_executor.submit(contextvars.copy_context().run, embed_questions)
+    
+    def finish(results: List[Dict], prompt_tokens: int = 0) -> Dict:
+        if query_vectors_future is not None:
+            query_vectors_future.cancel()
+        summary = timings.summary()
+        logger.info("Answered questions", extra={"user_id": user_id, "url": url, "questions": len(questions), "timings": summary})
+        return {"results": results, "prompt_tokens": prompt_tokens, "timings": summary}
+    
+    def same_answer(answer: str) -> List[Dict]:
+        return [{"query": question, "answer": answer, "sources": {}, "confidence": 0.0} for question in questions]
+    
+    content_status = process_and_store_content(user_id, url, embeddings, timings)
+    if content_status == CONTENT_BLOCKED:
+        return finish(same_answer(BLOCKED_ANSWER))
+    
+    with timings.stage("has_documents"):
+        has_documents = collection_has_documents(user_id, embeddings)
+    if not has_documents:
+        return finish(same_answer(NO_CONTENT_ANSWER))
+    
+    # Per-question retrieval is local (Chroma and the cached BM25 index); the embedding API was called once
+    query_vectors = query_vectors_future.result() if query_vectors_future is not None else [None] * len(questions)
+    with timings.stage("retrieve"):
+        relevant_docs = [
+            retrieve_relevant_documents(
+                user_id=user_id,
+                query=question,
+                url=url,
+                embeddings=embeddings,
+                mode=mode,
+                query_vector=query_vector
             )
-        }
-    )
+            for question, query_vector in zip(questions, query_vectors)
+        ]
+    record_page_access(user_id, url)
     
-    # Run the chain with invoke instead of __call__
-    result = qa_chain.invoke({"question": query})
+    results = [
+        {"query": question, "answer": NOT_FOUND_ANSWER, "sources": {}, "confidence": 0.0}
+        for question in questions
+    ]
+    answerable = [i for i, docs in enumerate(relevant_docs) if docs]
+    if not answerable:
+        return finish(results)
     
-    # Format sources
-    sources = {}
-    for doc in result.get("source_documents", []):
-        source_url = doc.metadata.get("source")
-        if source_url:
-            snippet = doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
-            if source_url in sources:
-                sources[source_url].append(snippet)
-            else:
-                sources[source_url] = [snippet]
+    # One context from the union of the answerable questions' chunks; chunks shared by
+    # several questions appear once, and pack_context drops overlapping text
+    with timings.stage("context"):
+        union_docs = list({
+            doc.metadata.get("chunk_id") or doc.page_content: doc
+            for i in answerable for doc in relevant_docs[i]
+        }.values())
+        batch_questions = [questions[i] for i in answerable]
+        summaries, _ = _pack(union_docs, " ".join(batch_questions), url, token_budget=BATCH_CONTEXT_TOKEN_BUDGET)
+        numbered = "\n".join(f"{n}. {question}" for n, question in enumerate(batch_questions, start=1))
+        prompt_tokens = count_tokens(BATCH_ANSWER_PROMPT.format(questions=numbered, summaries=summaries))
+    
+    with timings.stage("llm"):
+        answers = parse_batch_answers(
+            batch_answer_chain.invoke({"questions": numbered, "summaries": summaries}),
+            len(answerable)
+        )
+    
+    if answers is None:
+        # Fall back to one call per question, run concurrently, each with its own context
+        logger.warning("Batch answer could not be parsed; answering questions separately", extra={"user_id": user_id, "url": url})
+        
+        def answer_one(i: int):
+            question_summaries, _ = _pack(relevant_docs[i], questions[i], url)
+            tokens = count_tokens(ANSWER_PROMPT.format(question=questions[i], summaries=question_summaries))
+            answer = answer_chain.invoke({"question": questions[i], "summaries": question_summaries})
+            return strip_sources_section(answer), tokens
+        
+        with timings.stage("llm_fallback"), ThreadPoolExecutor(max_workers=len(answerable)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, answer_one, i) for i in answerable]
+            outputs = [future.result() for future in futures]
+        answers = [answer for answer, _ in outputs]
+        prompt_tokens += sum(tokens for _, tokens in outputs)
     
-    return {
-        "answer": result.get("answer"),
-        "sources": sources,
-        "confidence": 0.95
-    }
+    for i, answer in zip(answerable, answers):
+        results[i].update({
+            "answer": answer,
+            "sources": format_sources(relevant_docs[i]),
+            "confidence": 0.95
+        })
+    return finish(results, prompt_tokens)
@@ -0,0 +1,210 @@
+# Retrieval service: dense, lexical (BM25) and hybrid search over a page's chunks
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from app.core.logging import get_logger
+from app.core.timing import timed
+from app.core.config import (
+    RETRIEVAL_MODE,
+    RETRIEVAL_TOP_K,
+    DENSE_RELEVANCE_THRESHOLD,
+    RRF_K,
+    VECTOR_QUANTIZATION,
+)
+from app.db.vector_store import (
+    chunk_relevance,
+    collection_missing,
+    get_vector_store_for_user,
+    get_page_documents,
+    quantized_search,
+    page_filter,
+    with_page_metadata,
+)
+from app.db.lexical_index import get_page_index
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+
+logger = get_logger(__name__)
+
+def _document_key(doc: Document) -> str:
+    """Stable identity for a chunk across result lists"""
+    return doc.metadata.get("chunk_id") or doc.page_content
+
+def reciprocal_rank_fusion(
+    ranked_lists: Sequence[Sequence[Document]],
+    k: int = RRF_K,
+    limit: int = RETRIEVAL_TOP_K
+) -> List[Tuple[Document, float]]:
+    """
+    Fuse several ranked result lists with Reciprocal Rank Fusion
+
+    Each document scores sum(1 / (k + rank)) over the lists it appears in, so
+    rankings on incomparable scales (cosine relevance, BM25) can be combined.
+
+    Args:
+        ranked_lists: Result lists, each ordered best first
+        k: RRF damping constant
+        limit: Maximum number of fused results
+
+    Returns:
+        List of (document, fused score) tuples, best first
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, start=1):
+            key = _document_key(doc)
+            documents.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [(documents[key], score) for key, score in fused]
+
+def dense_search(
+    user_id: str,
+    query: str,
+    url: str,
+    embeddings,
+    k: int = RETRIEVAL_TOP_K,
+    query_vector: Optional[List[float]] = None
+) -> List[Document]:
+    """
+    Embedding similarity search restricted to one URL
+
+    Args:
+        query_vector: The query's embedding, if already computed; otherwise it is embedded here
+
+    Returns:
+        Documents whose relevance score passes DENSE_RELEVANCE_THRESHOLD, best first
+    """
+    if query_vector is None:
+        query_vector = embeddings.embed_query(query)
+
+    if VECTOR_QUANTIZATION != "none":
+        results = quantized_search(user_id, url, query_vector, k=k)
+        return [doc for doc, score in results if score > DENSE_RELEVANCE_THRESHOLD]
+
+    for attempt in range(2):
+        vector_store = get_vector_store_for_user(user_id, embeddings)
+        try:
+            results = _search_page(vector_store, user_id, url, query_vector, k)
+            break
+        except Exception as e:
+            if attempt == 0 and collection_missing(e):
+                # A rebuild swapped the collection out after it was opened; search the new one
+                logger.info("Collection was replaced during search, retrying", extra={"user_id": user_id})
+                continue
+            logger.exception("Dense search failed", extra={"user_id": user_id, "url": url})
+            raise
+    # Search by vector returns distances; convert them the way a search by query text does
+    relevance = vector_store._select_relevance_score_fn()
+    results = [(doc, relevance(distance)) for doc, distance in results]
+
+    return with_page_metadata([doc for doc, score in results if score > DENSE_RELEVANCE_THRESHOLD])
+
+def _search_page(vector_store, user_id: str, url: str, query_vector: List[float], k: int) -> List[Tuple[Document, float]]:
+    """Vector search of one page's chunks: (document, distance) pairs"""
+    try:
+        return vector_store.similarity_search_by_vector_with_relevance_scores(
+            embedding=query_vector,
+            k=k,
+            filter=page_filter(user_id, "full_url", url)  # Filter for documents from this exact URL
+        )
+    except Exception as e:
+        if collection_missing(e):
+            raise
+        # Fall back to source filter if full_url filter fails
+        logger.warning("Search by full_url failed, retrying by source: %s", e, extra={"user_id": user_id, "url": url})
+        return vector_store.similarity_search_by_vector_with_relevance_scores(
+            embedding=query_vector,
+            k=k,
+            filter=page_filter(user_id, "source", url)  # Traditional source filter
+        )
+
+def lexical_search(user_id: str, query: str, url: str, embeddings=None, k: int = RETRIEVAL_TOP_K) -> List[Document]:
+    """
+    BM25 search over one URL's chunks; never calls the embedding API
+
+    Returns:
+        Documents sharing at least one term with the query, best first
+    """
+    index = get_page_index(
+        user_id,
+        url,
+        loader=lambda: get_page_documents(user_id, url, embeddings)
+    )
+    if index is None:
+        return []
+    return [doc for doc, score in index.search(query, k=k)]
+
+def _passing_dense_threshold(
+    user_id: str,
+    url: str,
+    lexical_docs: List[Document],
+    dense_docs: List[Document],
+    query_vector: List[float]
+) -> List[Document]:
+    """
+    Drop lexical hits that dense search did not return and whose own dense
+    relevance is below DENSE_RELEVANCE_THRESHOLD. A chunk that shares a single
+    term with the question would otherwise reach the context; lexical search
+    still adds exact matches that ranked below the dense top k.
+    """
+    dense_keys = {_document_key(doc) for doc in dense_docs}
+    candidates = [doc.metadata.get("chunk_id") for doc in lexical_docs if _document_key(doc) not in dense_keys]
+    relevance = chunk_relevance(user_id, url, [chunk_id for chunk_id in candidates if chunk_id], query_vector)
+    return [
+        doc for doc in lexical_docs
+        if _document_key(doc) in dense_keys or relevance.get(doc.metadata.get("chunk_id"), 0.0) > DENSE_RELEVANCE_THRESHOLD
+    ]
+
+def resolve_retrieval_mode(mode: Optional[str] = None) -> str:
+    """The retrieval mode to use for a request; defaults to RETRIEVAL_MODE"""
+    mode = (mode or RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+    return mode
+
+def retrieve_relevant_documents(
+    user_id: str,
+    query: str,
+    url: str,
+    embeddings,
+    mode: Optional[str] = None,
+    k: int = RETRIEVAL_TOP_K,
+    query_vector: Optional[List[float]] = None
+) -> List[Document]:
+    """
+    Retrieve the chunks of a page that are relevant to a query
+
+    Args:
+        user_id: The ID of the user asking the question
+        query: The question asked by the user
+        url: The URL of the current page
+        embeddings: The embeddings model to use for dense search
+        mode: "dense", "lexical" or "hybrid"; defaults to RETRIEVAL_MODE
+        k: Maximum number of chunks to return
+        query_vector: The query's embedding, if already computed (unused in lexical mode)
+
+    Returns:
+        List of relevant documents, best first
+    """
+    mode = resolve_retrieval_mode(mode)
+
+    if mode == "lexical":
+        with timed(None, "lexical_search"):
+            return lexical_search(user_id, query, url, embeddings, k=k)
+    if mode == "dense":
+        with timed(None, "dense_search"):
+            return dense_search(user_id, query, url, embeddings, k=k, query_vector=query_vector)
+
+    # Hybrid: take a deeper candidate list from each retriever, then fuse
+    if query_vector is None:
+        query_vector = embeddings.embed_query(query)
+    with timed(None, "dense_search"):
+        dense_docs = dense_search(user_id, query, url, embeddings, k=2 * k, query_vector=query_vector)
+    with timed(None, "lexical_search"):
+        lexical_docs = lexical_search(user_id, query, url, embeddings, k=2 * k)
+        lexical_docs = _passing_dense_threshold(user_id, url, lexical_docs, dense_docs, query_vector)
+    return [doc for doc, score in reciprocal_rank_fusion([dense_docs, lexical_docs], limit=k)]
@@ -0,0 +1,147 @@
+# Cache of users resolved from access tokens: TTL + LRU, with hit rate and saved lookup time metrics
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import METRICS_ENABLED, AUTH_USER_CACHE_TTL_S, AUTH_USER_CACHE_MAX
+from app.core.metrics import REGISTRY, Histogram, gauge_lines
+from app.models.user import User
+from app.services.user_service import get_user_by_email
+
+AUTH_USER_DURATION = REGISTRY.register(Histogram(
+    "askify_auth_user_seconds",
+    "Time to resolve the user of an authenticated request, by source (claims, cache or database)",
+    ["source"],
+))
+
+# Weight of the newest database lookup in the running estimate of lookup time
+LOOKUP_EWMA_ALPHA = 0.1
+
+class UserCache:
+    """
+    Users by email, each kept for `ttl` seconds, at most `max_users` of them
+
+    The least recently used user is evicted when full. Nothing in the app
+    changes a user row once created, so entries are not invalidated: the TTL
+    bounds how long a change made directly in the database takes to show.
+    Also keeps a running average of database lookup time, so hits can be
+    counted as lookup time saved.
+    """
+
+    def __init__(self, ttl: float = AUTH_USER_CACHE_TTL_S, max_users: int = AUTH_USER_CACHE_MAX):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()  # email -> (expiry, user)
+        self._lock = threading.Lock()
+        self.lookup_seconds = 0.0  # running average of database lookups
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "saved_seconds": 0.0}
+
+    def get(self, email: str) -> Optional[User]:
+        with self._lock:
+            item = self._users.get(email)
+            if item is None:
+                self.counters["misses"] += 1
+                return None
+            expires, user = item
+            if expires <= time.monotonic():
+                del self._users[email]
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            self._users.move_to_end(email)
+            self.counters["hits"] += 1
+            self.counters["saved_seconds"] += self.lookup_seconds
+            return user
+
+    def put(self, user: User):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._users[user.email] = (time.monotonic() + self.ttl, user)
+            self._users.move_to_end(user.email)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def record_lookup(self, seconds: float):
+        """Add a database lookup's duration to the running average"""
+        with self._lock:
+            if self.lookup_seconds == 0.0:
+                self.lookup_seconds = seconds
+            else:
+                self.lookup_seconds += LOOKUP_EWMA_ALPHA * (seconds - self.lookup_seconds)
+
+    def record_saved(self):
+        """Count a lookup avoided some other way (signed claims) as time saved"""
+        with self._lock:
+            self.counters["saved_seconds"] += self.lookup_seconds
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "size": len(self._users),
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+                "lookup_ms": round(self.lookup_seconds * 1000, 2),
+            }
+
+# The process-wide cache
+user_cache = UserCache()
+
+def observe_auth(source: str, seconds: float):
+    if METRICS_ENABLED:
+        AUTH_USER_DURATION.observe(seconds, source=source)
+
+# Database lookups in progress, by email; concurrent misses for the same user wait for the same lookup
+_lookups: Dict[str, asyncio.Future] = {}
+
+async def _load_user(email: str) -> Optional[User]:
+    start = time.perf_counter()
+    try:
+        user = await get_user_by_email(email)
+    finally:
+        _lookups.pop(email, None)
+    user_cache.record_lookup(time.perf_counter() - start)
+    if user is not None:
+        user_cache.put(user)
+    return user
+
+async def lookup_user(email: str) -> Optional[User]:
+    """The user with this email, from the cache or else from the database"""
+    start = time.perf_counter()
+    user = user_cache.get(email)
+    if user is not None:
+        observe_auth("cache", time.perf_counter() - start)
+        return user
+    lookup = _lookups.get(email)
+    if lookup is None:
+        lookup = _lookups[email] = asyncio.ensure_future(_load_user(email))
+    # Shielded, so one cancelled request does not cancel the lookup the others wait for
+    user = await asyncio.shield(lookup)
+    observe_auth("database", time.perf_counter() - start)
+    return user
+
+def _collect_metrics() -> List[str]:
+    stats = user_cache.stats()
+    lines = []
+    for counter, documentation in (
+        ("hits", "Authenticated requests whose user came from the cache"),
+        ("misses", "Authenticated requests whose user was looked up in the database"),
+        ("evictions", "Users evicted from the cache to stay within AUTH_USER_CACHE_MAX"),
+    ):
+        lines += gauge_lines(f"askify_auth_user_cache_{counter}_total", documentation, {(): stats[counter]}, kind="counter")
+    lines += gauge_lines("askify_auth_user_cache_size", "Users in the cache", {(): stats["size"]})
+    lines += gauge_lines("askify_auth_user_cache_hit_ratio", "Fraction of user lookups served by the cache", {(): stats["hit_rate"]})
+    lines += gauge_lines("askify_auth_lookup_seconds_saved_total",
+                         "Estimated database lookup time avoided by the cache and signed claims",
+                         {(): stats["saved_seconds"]}, kind="counter")
+    return lines
+
+REGISTRY.add_collector(_collect_metrics)
@@ -1,33 +1,41 @@
 # User service functions
 from datetime import datetime
-from supabase import create_client
 import uuid
 
-from app.core.config import SUPABASE_URL, SUPABASE_KEY
 from app.models.user import User
-from app.auth.password import verify_password
+from app.auth.password import password_hasher
+from app.db.supabase_client import get_async_db
 
-# Initialize Supabase client
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+async def get_password_hash_of(user_id: str):
+    response = await get_async_db().table("user_credentials").select("password_hash").eq("user_id", user_id).execute()
+    if len(response.data) == 0:
+        return None
+    return response.data[0]["password_hash"]
 
-def authenticate_user(email: str, password: str):
-    user = get_user_by_email(email)
+async def authenticate_user(email: str, password: str):
+    """
+    The user with this email and password, or False
+    
+    Database calls go through the shared async client and bcrypt runs in
+    the password hashing pool, so the event loop never blocks; raises
+    PasswordHashingBusy when that pool is saturated.
+    """
+    user = await get_user_by_email(email)
     if not user:
         return False
     
     # Get user's hashed password from Supabase
-    response = supabase.table("user_credentials").select("password_hash").eq("user_id", user.id).execute()
-    if len(response.data) == 0:
+    stored_password_hash = await get_password_hash_of(user.id)
+    if stored_password_hash is None:
         return False
     
-    stored_password_hash = response.data[0]["password_hash"]
-    if not verify_password(password, stored_password_hash):
+    if not await password_hasher.verify(password, stored_password_hash):
         return False
     
     return user
 
-def get_user_by_email(email: str) -> User:
-    response = supabase.table("users").select("*").eq("email", email).execute()
+async def get_user_by_email(email: str) -> User:
+    response = await get_async_db().table("users").select("*").eq("email", email).execute()
     
     if len(response.data) == 0:
         return None
@@ -41,7 +49,7 @@ def get_user_by_email(email: str) -> User:
         created_at=datetime.fromisoformat(user_data["created_at"].replace("Z", "+00:00"))
     )
 
-def create_user(email: str, hashed_password: str, full_name: str = None) -> User:
+async def create_user(email: str, hashed_password: str, full_name: str = None) -> User:
     # Create user in the users table
     user_id = str(uuid.uuid4())
     
@@ -53,7 +61,7 @@ def create_user(email: str, hashed_password: str, full_name: str = None) -> User
         "created_at": datetime.utcnow().isoformat()
     }
     
-    response = supabase.table("users").insert(user_data).execute()
+    response = await get_async_db().table("users").insert(user_data).execute()
     
     # Store credentials separately
     credentials_data = {
@@ -61,6 +69,6 @@ def create_user(email: str, hashed_password: str, full_name: str = None) -> User
         "password_hash": hashed_password
     }
     
-    supabase.table("user_credentials").insert(credentials_data).execute()
+    await get_async_db().table("user_credentials").insert(credentials_data).execute()
     
     return User(**user_data)
@@ -0,0 +1 @@
+# Benchmarks and offline evaluation tools for the Askify backend
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Answer-generation overhead microbenchmark: building a RetrievalQAWithSourcesChain
+(with a fresh PromptTemplate and PreFilteredRetriever) on every request, as
+answer_query used to, vs invoking the prebuilt answer chain.
+
+Both paths run against a fake chat model that answers instantly, so the numbers
+are pure per-request framework overhead (construction, validation, prompt
+parsing and formatting), not LLM latency.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_answer_chain --iterations 500
+"""
+
+import argparse
+import statistics
+import time
+from typing import List, Sequence
+
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.prompts import PromptTemplate
+from langchain_core.retrievers import BaseRetriever
+
+from app.services.query_service import ANSWER_PROMPT, build_answer_chain, format_documents, strip_sources_section
+
+class PreFilteredRetriever(BaseRetriever):
+    """The retriever answer_query used to build per request"""
+
+    documents: Sequence[Document]
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return list(self.documents)
+
+def per_request_chain(model, documents, question):
+    """The previous answer path: construct everything, then invoke"""
+    from langchain.chains import RetrievalQAWithSourcesChain
+
+    qa_chain = RetrievalQAWithSourcesChain.from_chain_type(
+        llm=model,
+        chain_type="stuff",
+        retriever=PreFilteredRetriever(documents=documents),
+        return_source_documents=True,
+        chain_type_kwargs={
+            "prompt": PromptTemplate(template=ANSWER_PROMPT.template, input_variables=["summaries", "question"])
+        },
+    )
+    return qa_chain.invoke({"question": question})["answer"]
+
+def prebuilt_chain(chain, documents, question):
+    """The current answer path"""
+    return strip_sources_section(chain.invoke({"question": question, "summaries": format_documents(documents)}))
+
+def measure(fn, iterations: int) -> List[float]:
+    fn()  # warm up imports and caches
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-request answer chain overhead")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--chunks", type=int, default=5)
+    args = parser.parse_args()
+
+    documents = [
+        Document(page_content=f"Chunk {i}: " + "lorem ipsum dolor sit amet " * 40, metadata={"source": "https://example.com"})
+        for i in range(args.chunks)
+    ]
+    question = "What is this page about?"
+    model = FakeListChatModel(responses=["A short answer."])
+    chain = build_answer_chain(model)
+
+    results = {
+        "per-request RetrievalQAWithSourcesChain": measure(lambda: per_request_chain(model, documents, question), args.iterations),
+        "prebuilt runnable": measure(lambda: prebuilt_chain(chain, documents, question), args.iterations),
+    }
+
+    print(f"\n=== Answer chain overhead ({args.iterations} iterations, {args.chunks} chunks, instant fake LLM) ===\n")
+    for name, timings in results.items():
+        print(f"{name:42s} mean={statistics.mean(timings):.3f}ms "
+              f"p50={timings[len(timings) // 2]:.3f}ms p99={timings[int(len(timings) * 0.99)]:.3f}ms")
+    print()
+
+if __name__ == "__main__":
+    main()
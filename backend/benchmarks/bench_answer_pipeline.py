@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+First-question-on-a-new-page benchmark: per-stage timings of answer_query.
+
+Serves generated pages from a local HTTP server and answers one question per
+page with simulated embedding and LLM latency, so each run goes through the
+whole path: existence check, fetch, chunking, chunk embedding, storage,
+query embedding, search and answer. Reports the mean duration of each stage,
+their sum (what running them strictly one after another costs) and the
+elapsed time per request (the critical path).
+
+With --batch N it then asks N questions about one of the pages, first one
+/query/ask call at a time and then as a single batch (answer_questions).
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_answer_pipeline
+    python -m benchmarks.bench_answer_pipeline --embed-latency-ms 300 --concurrency 1
+    python -m benchmarks.bench_answer_pipeline --pages 1 --batch 5 --llm-latency-ms 800
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Keep the benchmark's vector store out of the real one; must happen before app imports
+WORKDIR = tempfile.mkdtemp(prefix="askify-pipeline-")
+os.environ["VECTOR_DB_PATH"] = WORKDIR
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("RETENTION_INTERVAL_MINUTES", "0")
+
+from app.db import vector_store
+from app.services import query_service
+from app.services.providers import FakeChatModel, FakeEmbeddings
+
+WORDS = ("index query vector page chunk browser answer token latency cache retrieval model "
+         "prompt context server request session history search extension user").split()
+
+def page_html(page: int, paragraphs: int) -> bytes:
+    rng = random.Random(page)
+    body = "".join(
+        f"<p>{' '.join(rng.choices(WORDS, k=12)).capitalize()}. {' '.join(rng.choices(WORDS, k=10)).capitalize()}.</p>"
+        for _ in range(paragraphs)
+    )
+    return f"<html><head><title>Page {page}</title></head><body><main>{body}</main></body></html>".encode()
+
+def serve_pages(paragraphs: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            content = page_html(int(self.path.strip("/").split("/")[-1]), paragraphs)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage timings of answering the first question on a new page")
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--paragraphs", type=int, default=120)
+    parser.add_argument("--embed-latency-ms", type=float, default=150)
+    parser.add_argument("--llm-latency-ms", type=float, default=0)
+    parser.add_argument("--concurrency", type=int, default=None, help="Override EMBEDDING_CONCURRENCY")
+    parser.add_argument("--mode", choices=["dense", "lexical", "hybrid"], default="hybrid")
+    parser.add_argument("--batch", type=int, default=0, help="Also compare N single questions with one batch of N")
+    args = parser.parse_args()
+
+    if args.concurrency:
+        vector_store._embedding_executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    query_service.embeddings = FakeEmbeddings(latency_ms=args.embed_latency_ms)
+    llm = FakeChatModel(latency_ms=args.llm_latency_ms)
+    query_service.answer_chain = query_service.build_answer_chain(llm)
+    query_service.batch_answer_chain = query_service.build_batch_answer_chain(llm)
+
+    server = serve_pages(args.paragraphs)
+    try:
+        runs = []
+        for page in range(args.pages):
+            url = f"http://127.0.0.1:{server.server_port}/pages/{page}"
+            result = query_service.answer_query("bench", "How does the retrieval cache work?", url, args.mode)
+            runs.append(result["timings"])
+
+        stages = list(dict.fromkeys(name for run in runs for name in run))
+        print(f"\n=== First question on a new page ({args.pages} pages, {args.mode}, "
+              f"{args.embed_latency_ms:.0f}ms per embedding call) ===\n")
+        for name in stages:
+            print(f"{name:16s} {statistics.mean(run.get(name, 0.0) for run in runs):9.1f} ms")
+        sequential = statistics.mean(run["sequential"] for run in runs)
+        elapsed = statistics.mean(run["elapsed"] for run in runs)
+        print(f"\ncritical path is {1 - elapsed / sequential:.1%} shorter than running the stages in sequence\n")
+
+        if args.batch:
+            url = f"http://127.0.0.1:{server.server_port}/pages/0"
+            questions = [f"What does the page say about {word}?" for word in WORDS[:args.batch]]
+
+            start = time.perf_counter()
+            single_tokens = sum(
+                query_service.answer_query("bench", question, url, args.mode).get("prompt_tokens", 0)
+                for question in questions
+            )
+            single_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            batch = query_service.answer_questions("bench", questions, url, args.mode)
+            batch_ms = (time.perf_counter() - start) * 1000
+
+            print(f"=== {args.batch} questions about one page ===\n")
+            print(f"one at a time   {single_ms:9.1f} ms  {args.batch} embedding + {args.batch} LLM calls, {single_tokens} prompt tokens")
+            print(f"batch           {batch_ms:9.1f} ms  1 embedding + 1 LLM call, {batch['prompt_tokens']} prompt tokens\n")
+    finally:
+        server.shutdown()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Authentication benchmark: the cost of resolving the user of each request.
+
+--requests authenticated requests from --users users (tokens reused, as
+an extension polling history does) run --concurrency at a time. The users
+table is simulated with a --rtt-ms round trip per lookup. Three ways:
+
+  lookup  every request looks the user up, on the event loop (the
+          previous get_current_user)
+  cache   users come from the TTL + LRU user cache; misses are looked up
+          through the shared async client
+  claims  tokens carry the user (AUTH_TOKEN_CLAIMS); no lookup at all
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_auth_cache
+    python -m benchmarks.bench_auth_cache --requests 20000 --users 2000 --rtt-ms 40
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app.api.endpoints import auth
+from app.models.user import User
+from app.services import user_cache as user_cache_module
+from app.services.user_cache import UserCache
+from benchmarks.bench_logging import percentile
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request user lookup, the user cache and signed claims")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rtt-ms", type=float, default=20, help="Users table round trip")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    users = {f"user{i}@example.com": User(id=f"id-{i}", email=f"user{i}@example.com", created_at=datetime(2024, 1, 1))
+             for i in range(args.users)}
+    lookups = [0]
+
+    def blocking_get_user_by_email(email):
+        lookups[0] += 1
+        time.sleep(args.rtt_ms / 1000)
+        return users.get(email)
+
+    async def get_user_by_email(email):
+        lookups[0] += 1
+        await asyncio.sleep(args.rtt_ms / 1000)
+        return users.get(email)
+
+    user_cache_module.get_user_by_email = get_user_by_email
+    rng = random.Random(args.seed)
+    order = [rng.choice(list(users)) for _ in range(args.requests)]
+
+    async def previous_get_current_user(token):
+        payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+        return blocking_get_user_by_email(payload["sub"])
+
+    async def run(mode):
+        lookups[0] = 0
+        user_cache_module.user_cache = auth.user_cache = UserCache()
+        auth.AUTH_TOKEN_CLAIMS = mode == "claims"
+        tokens = {
+            email: auth.create_access_token({"sub": email, **(auth.user_claims(user) if mode == "claims" else {})},
+                                            timedelta(minutes=60))
+            for email, user in users.items()
+        }
+        resolve = previous_get_current_user if mode == "lookup" else auth.get_current_user
+        slots = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def request(email):
+            async with slots:
+                start = time.perf_counter()
+                await resolve(tokens[email])
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(request(email) for email in order))
+        elapsed = time.perf_counter() - start
+        return latencies, elapsed
+
+    print(f"\n=== {args.requests} requests from {args.users} users, {args.concurrency} concurrent, "
+          f"users table round trip {args.rtt_ms}ms ===\n")
+    print(f"{'mode':7s} {'lookups':>8s} {'hit rate':>9s} {'auth p50':>10s} {'auth p99':>10s} {'requests/s':>11s}")
+    for mode in ("lookup", "cache", "claims"):
+        latencies, elapsed = asyncio.run(run(mode))
+        hit_rate = user_cache_module.user_cache.stats()["hit_rate"] if mode == "cache" else 0.0
+        print(f"{mode:7s} {lookups[0]:8d} {hit_rate:9.1%} {percentile(latencies, 50) * 1000:8.2f}ms "
+              f"{percentile(latencies, 99) * 1000:8.2f}ms {args.requests / elapsed:11.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Browsing history ingestion benchmark: visits per second one node can save.
+
+--users simulated extensions report --events tab events between them; a
+--repeat fraction repeat a URL the user visited seconds earlier (tab
+activations, reloads). A simulated remote history store takes --rtt-ms
+per round trip (a Supabase insert) plus --row-ms per row. Requests run on
+--workers threads (the server's threadpool), two ways:
+
+  per-visit  one request and one insert per event (a /history/record
+             call for every tab event)
+  batched    each user sends --batch events per /history/record/batch
+             request; repeats are dropped and the rest saved with one
+             insert
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_browsing_ingest
+    python -m benchmarks.bench_browsing_ingest --events 50000 --batch 100 --rtt-ms 40
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+os.environ["STORAGE_MODE"] = "local"
+os.environ["LOCAL_DB_DIR"] = tempfile.mkdtemp(prefix="askify-browsing-ingest-")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app.services import browsing_recorder
+from app.services.browsing_recorder import VisitDeduplicator, record_visits
+from benchmarks.bench_logging import percentile
+
+class RemoteStore:
+    """Simulated database: fixed round-trip time and per-row cost"""
+
+    def __init__(self, rtt_ms: float, row_ms: float):
+        self.rtt = rtt_ms / 1000
+        self.row = row_ms / 1000
+        self.round_trips = 0
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def save_browsing_history_batch(self, entries):
+        time.sleep(self.rtt + self.row * len(entries))
+        with self.lock:
+            self.round_trips += 1
+            self.rows += len(entries)
+        return [str(i) for i in range(len(entries))]
+
+def tab_events(args, rng: random.Random):
+    """Per user, a time-ordered list of visits"""
+    start = datetime(2026, 1, 1)
+    events = {f"user-{user}": [] for user in range(args.users)}
+    clock = {user_id: 0.0 for user_id in events}
+    for i in range(args.events):
+        user_id = f"user-{rng.randrange(args.users)}"
+        history = events[user_id]
+        clock[user_id] += rng.uniform(0.5, 20)
+        if history and rng.random() < args.repeat:
+            url = history[-1]["url"]
+        else:
+            url = f"https://site{rng.randrange(500)}.example.com/page/{rng.randrange(10000)}"
+        history.append({"url": url, "title": "Page", "timestamp": start + timedelta(seconds=clock[user_id]), "metadata": {}})
+    return events
+
+def run(mode: str, events, args) -> dict:
+    store = RemoteStore(args.rtt_ms, args.row_ms)
+    browsing_recorder.save_browsing_history_batch = store.save_browsing_history_batch
+    browsing_recorder.deduplicator = VisitDeduplicator()
+
+    if mode == "per-visit":
+        requests = [(user_id, [visit]) for user_id, visits in events.items() for visit in visits]
+        handle = lambda user_id, visits: store.save_browsing_history_batch([{**visits[0], "user_id": user_id}])
+    else:
+        requests = [(user_id, visits[i:i + args.batch]) for user_id, visits in events.items()
+                    for i in range(0, len(visits), args.batch)]
+        handle = record_visits
+
+    latencies = []
+
+    def request(user_id, visits):
+        start = time.perf_counter()
+        handle(user_id, visits)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for user_id, visits in requests:
+            pool.submit(request, user_id, visits)
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(requests),
+        "round_trips": store.round_trips,
+        "rows": store.rows,
+        "events_per_s": args.events / elapsed,
+        "request_p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-visit vs batched browsing history ingestion")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--repeat", type=float, default=0.3, help="Fraction of events repeating the previous URL")
+    parser.add_argument("--batch", type=int, default=50, help="Visits per batch request")
+    parser.add_argument("--workers", type=int, default=40)
+    parser.add_argument("--rtt-ms", type=float, default=30)
+    parser.add_argument("--row-ms", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    events = tab_events(args, random.Random(args.seed))
+    print(f"\n=== {args.events} tab events from {args.users} users, {args.repeat:.0%} repeats, "
+          f"store round trip {args.rtt_ms}ms + {args.row_ms}ms/row, {args.workers} workers ===\n")
+    print(f"{'mode':10s} {'requests':>9s} {'round trips':>12s} {'rows':>7s} {'events/s':>10s} {'request p99':>12s}")
+    for mode in ("per-visit", "batched"):
+        result = run(mode, events, args)
+        print(f"{mode:10s} {result['requests']:9d} {result['round_trips']:12d} {result['rows']:7d} "
+              f"{result['events_per_s']:10.0f} {result['request_p99_ms']:10.1f}ms")
+
+if __name__ == "__main__":
+    main()
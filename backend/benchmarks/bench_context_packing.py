@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Context packing benchmark: prompt size with whole retrieved chunks (what the
+"stuff" chain used to send) vs the deduplicated, trimmed context built by
+app.services.context_service.pack_context.
+
+Uses the offline retrieval evaluation set. To mimic long, overlapping
+semantic chunks, each "chunk" is a sliding window over several consecutive
+passages of a page, and the top-k windows are retrieved with BM25. Reports
+prompt tokens per question and how often the passages that answer the
+question survive packing.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_context_packing
+    python -m benchmarks.bench_context_packing --window 4 --budget 300
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from langchain_core.documents import Document
+
+from app.db.lexical_index import BM25Index
+from app.services.context_service import count_tokens, pack_context, split_sentences
+from app.services.query_service import ANSWER_PROMPT, format_documents
+from benchmarks.eval_retrieval import DEFAULT_DATASET
+
+def windowed_pages(path: str, window: int):
+    with open(path, "r") as f:
+        data = json.load(f)
+    pages = {}
+    for page in data["pages"]:
+        passages = page["chunks"]
+        pages[page["url"]] = {
+            "passages": passages,
+            "windows": [
+                Document(page_content="\n".join(passages[start:start + window]), metadata={"source": page["url"]})
+                for start in range(max(1, len(passages) - window + 1))
+            ],
+        }
+    return pages, data["questions"]
+
+def prompt_tokens(question: str, documents) -> int:
+    return count_tokens(ANSWER_PROMPT.format(question=question, summaries=format_documents(documents)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure prompt tokens with and without context packing")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    parser.add_argument("--window", type=int, default=3, help="Passages per simulated chunk")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--budget", type=int, default=None, help="Override CONTEXT_TOKEN_BUDGET")
+    args = parser.parse_args()
+
+    pages, questions = windowed_pages(args.dataset, args.window)
+    indexes = {url: BM25Index(page["windows"]) for url, page in pages.items()}
+    options = {"token_budget": args.budget} if args.budget else {}
+
+    before, after, retained, packing_ms = [], [], [], []
+    for item in questions:
+        retrieved = [doc for doc, _ in indexes[item["url"]].search(item["question"], args.k)]
+        start = time.perf_counter()
+        packed, _ = pack_context(retrieved, item["question"], **options)
+        packing_ms.append((time.perf_counter() - start) * 1000)
+
+        before.append(prompt_tokens(item["question"], retrieved))
+        after.append(prompt_tokens(item["question"], packed))
+        context = " ".join(doc.page_content for doc in packed)
+        answer_sentences = [split_sentences(pages[item["url"]]["passages"][i])[0] for i in item["relevant"]]
+        retained.append(all(sentence in context for sentence in answer_sentences))
+
+    print(f"\n=== Context packing ({len(questions)} questions, window={args.window}, k={args.k}) ===\n")
+    print(f"prompt tokens, whole chunks:  mean={statistics.mean(before):.0f} max={max(before)}")
+    print(f"prompt tokens, packed:        mean={statistics.mean(after):.0f} max={max(after)}")
+    print(f"reduction:                    {1 - sum(after) / sum(before):.1%}")
+    print(f"answer passages retained:     {statistics.mean(retained):.1%}")
+    print(f"packing time:                 mean={statistics.mean(packing_ms):.2f}ms\n")
+
+if __name__ == "__main__":
+    main()
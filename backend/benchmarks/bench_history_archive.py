@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+History archival benchmark: primary store size and read latency with old
+history moved into compressed segment files.
+
+--users users each have --rows query history entries spread over
+--days days (answers of about --answer-words words). The SQLite backend
+is the primary store. Everything older than HISTORY_ARCHIVE_AFTER_DAYS
+(default 90) is then archived with each codec, and this reports:
+
+  primary    size of the SQLite database before and after archiving
+  archive    size of the segment files, and their ratio to the same rows
+             in the primary store
+  pages      latency of the first page (primary store) and of pages past
+             the archive boundary, cold (segments read from disk) and warm
+             (segments cached)
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_history_archive
+    python -m benchmarks.bench_history_archive --users 50 --rows 5000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+WORKDIR = tempfile.mkdtemp(prefix="askify-history-archive-")
+os.environ["LOCAL_DB_DIR"] = WORKDIR
+os.environ["STORAGE_MODE"] = "sqlite"
+os.environ["HISTORY_ARCHIVE_AFTER_DAYS"] = os.environ.get("HISTORY_ARCHIVE_AFTER_DAYS", "90")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app.db import history_archive, sqlite_history_store, storage_factory
+from app.db.pagination import last_keyset
+
+WORDS = ("index vector query answer page search model token chunk embedding latency cache history "
+         "browser extension request response server database table column segment archive").split()
+
+def database_bytes() -> int:
+    path = sqlite_history_store.HISTORY_DB_FILE
+    sqlite_history_store._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(path)
+
+def fill(args, rng: random.Random):
+    now = datetime.utcnow()
+    for user in range(args.users):
+        entries = [
+            {
+                "user_id": f"user-{user}",
+                "query": " ".join(rng.choices(WORDS, k=8)) + "?",
+                "answer": " ".join(rng.choices(WORDS, k=args.answer_words)) + ".",
+                "url": f"https://site{rng.randrange(200)}.example.com/page/{rng.randrange(5000)}",
+                "timestamp": now - timedelta(seconds=args.days * 86400 * i / args.rows),
+            }
+            for i in range(args.rows)
+        ]
+        for i in range(0, len(entries), 1000):
+            sqlite_history_store.save_query_history_batch(entries[i:i + 1000])
+
+async def page_latencies(user_ids, limit: int, depth: int, cold: bool):
+    """(first page ms, page at `depth` ms) per user, paging with keyset cursors; cold drops cached segments first"""
+    first, deep = [], []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        rows = await storage_factory.get_query_history(user_id, limit=limit)
+        first.append((time.perf_counter() - start) * 1000)
+        before = last_keyset(rows)
+        # Skip to the deep page without timing the pages in between
+        for _ in range(depth - 2):
+            before = last_keyset(await storage_factory.get_query_history(user_id, limit=limit, before=before))
+        if cold:
+            history_archive.archive._cache.clear()
+        start = time.perf_counter()
+        await storage_factory.get_query_history(user_id, limit=limit, before=before)
+        deep.append((time.perf_counter() - start) * 1000)
+    return first, deep
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history archival")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=3000, help="Query history entries per user")
+    parser.add_argument("--days", type=int, default=730, help="Days the entries are spread over")
+    parser.add_argument("--answer-words", type=int, default=120)
+    parser.add_argument("--limit", type=int, default=50, help="Page size")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    user_ids = [f"user-{user}" for user in range(args.users)]
+    archived_fraction = 1 - int(os.environ["HISTORY_ARCHIVE_AFTER_DAYS"]) / args.days
+    depth = int(args.rows * (1 - archived_fraction / 2) / args.limit)  # a page halfway into the archived range
+
+    print(f"\n=== {args.users} users x {args.rows} entries over {args.days} days, archived after "
+          f"{os.environ['HISTORY_ARCHIVE_AFTER_DAYS']} days, pages of {args.limit} (deep page #{depth}) ===\n")
+    print(f"{'codec':6s} {'primary before':>15s} {'after':>9s} {'archive':>9s} {'vs rows':>8s} {'archive s':>10s} "
+          f"{'first p50':>10s} {'deep cold':>10s} {'deep warm':>10s}")
+    try:
+        for codec in ("zstd", "gzip"):
+            workdir = os.path.join(WORKDIR, codec)
+            os.makedirs(workdir)
+            sqlite_history_store.HISTORY_DB_FILE = os.path.join(workdir, "history.sqlite3")
+            sqlite_history_store._local = threading.local()
+            history_archive.HISTORY_ARCHIVE_CODEC = codec
+            history_archive.archive = history_archive.HistoryArchive(root=os.path.join(workdir, "archive"))
+            if codec == "zstd" and history_archive._zstd() is None:
+                print("zstd   (zstandard not installed, skipped)")
+                continue
+
+            fill(args, random.Random(args.seed))
+            before_bytes = database_bytes()
+            start = time.perf_counter()
+            history_archive.archive_old_history()
+            archive_seconds = time.perf_counter() - start
+            sqlite_history_store._connection().execute("VACUUM")
+            after_bytes = database_bytes()
+            archive_bytes = history_archive.archive.stats()["bytes"]
+
+            first, deep_cold = asyncio.run(page_latencies(user_ids, args.limit, depth, cold=True))
+            _, deep_warm = asyncio.run(page_latencies(user_ids, args.limit, depth, cold=False))
+            moved_bytes = before_bytes - after_bytes
+            print(f"{codec:6s} {before_bytes / 2**20:13.1f}MB {after_bytes / 2**20:7.1f}MB {archive_bytes / 2**20:7.1f}MB "
+                  f"{archive_bytes / moved_bytes:7.1%} {archive_seconds:9.1f}s {statistics.median(first):8.2f}ms "
+                  f"{statistics.median(deep_cold):8.2f}ms {statistics.median(deep_warm):8.2f}ms")
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
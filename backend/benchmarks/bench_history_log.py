@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Local history log benchmark: startup index build and compaction.
+
+The local store (STORAGE_MODE=local) keeps each history table as an
+append-only JSONL log and builds an in-memory per-user index by replaying
+it at startup. For each log size this writes a log in which --deleted of
+the records have since been deleted (tombstones included), then reports
+the file size, the time to build the index, the index's memory, and the
+time to compact the log and to rebuild the index from the compacted file.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_history_log
+    python -m benchmarks.bench_history_log --rows 100000 1000000 --deleted 0.3
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app.db.local_history_store import HistoryLog
+
+def write_log(path: str, rows: int, users: int, deleted: float):
+    """A log of `rows` records, with a `deleted` fraction of them followed later by tombstones"""
+    start = datetime(2024, 1, 1)
+    doomed = []
+    with open(path, "w") as f:
+        for i in range(rows):
+            record_id = str(uuid.uuid4())
+            f.write(json.dumps({
+                "id": record_id,
+                "user_id": f"user-{i % users}",
+                "query": f"What does section {i} say about retrieval?",
+                "answer": "It says the retrieval step ranks chunks by relevance. " * 4,
+                "url": f"https://site{i % 50}.example.com/articles/{i}",
+                "timestamp": (start + timedelta(seconds=i)).isoformat(),
+                "metadata": {},
+            }) + "\n")
+            if random.random() < deleted:
+                doomed.append(record_id)
+        for record_id in doomed:
+            f.write(json.dumps({"deleted": record_id}) + "\n")
+
+def build_seconds(path: str) -> float:
+    start = time.perf_counter()
+    HistoryLog(path).load()
+    return time.perf_counter() - start
+
+def index_mb(path: str) -> float:
+    tracemalloc.start()
+    log = HistoryLog(path)
+    log.load()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del log
+    return current / 2 ** 20
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark local history log index build and compaction")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--deleted", type=float, default=0.3, help="Fraction of records deleted")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="askify-history-log-")
+    results = []
+    try:
+        print(f"\n{'rows':>9s} {'log MB':>8s} {'build s':>8s} {'index MB':>9s} {'compact s':>10s} {'compacted MB':>13s} {'rebuild s':>10s}")
+        for rows in args.rows:
+            path = os.path.join(workdir, f"query_history_{rows}.jsonl")
+            write_log(path, rows, args.users, args.deleted)
+            log_mb = os.path.getsize(path) / 2 ** 20
+            build = build_seconds(path)
+            memory = index_mb(path)
+
+            log = HistoryLog(path)
+            log.load()
+            start = time.perf_counter()
+            log.compact()
+            compact = time.perf_counter() - start
+            compacted_mb = os.path.getsize(path) / 2 ** 20
+            rebuild = build_seconds(path)
+
+            result = {
+                "rows": rows,
+                "deleted": args.deleted,
+                "log_mb": round(log_mb, 1),
+                "build_seconds": round(build, 3),
+                "index_mb": round(memory, 1),
+                "compact_seconds": round(compact, 3),
+                "compacted_mb": round(compacted_mb, 1),
+                "rebuild_seconds": round(rebuild, 3),
+            }
+            results.append(result)
+            print(f"{rows:9d} {log_mb:8.1f} {build:8.2f} {memory:9.1f} {compact:10.2f} {compacted_mb:13.1f} {rebuild:10.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+History search benchmark: /query/history/search latency for a user with a
+large history.
+
+One user has --rows past questions and answers (plus --other-rows spread
+over other users), written from a Zipf-distributed vocabulary. For each
+local backend this times:
+
+  scan     what a client could do before: fetch the whole history and
+           keep entries containing every search word
+  search   search_query_history (SQLite FTS5, or the local store's
+           in-memory BM25 index; its one-off build on a user's first
+           search is reported separately)
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_history_search
+    python -m benchmarks.bench_history_search --rows 100000 --searches 200
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+WORKDIR = tempfile.mkdtemp(prefix="askify-history-search-")
+os.environ["LOCAL_DB_DIR"] = WORKDIR
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app.db import local_history_store, sqlite_history_store
+from benchmarks.bench_logging import percentile
+
+def vocabulary(size: int, rng: random.Random):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(size)]
+
+def sentence(words, weights, rng: random.Random, length: int) -> str:
+    return " ".join(rng.choices(words, weights, k=length))
+
+def entries(rows: int, user_id: str, words, weights, rng: random.Random):
+    start = datetime.utcnow() - timedelta(days=365)
+    return [
+        {
+            "user_id": user_id,
+            "query": sentence(words, weights, rng, 8) + "?",
+            "answer": sentence(words, weights, rng, 40) + ".",
+            "url": f"https://site{i % 50}.example.com/articles/{i}",
+            "timestamp": start + timedelta(seconds=i * 365 * 86400 / rows),
+        }
+        for i in range(rows)
+    ]
+
+def reset(store: str, workdir: str):
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    local_history_store.QUERY_HISTORY_LOG = os.path.join(workdir, "query_history.jsonl")
+    local_history_store.BROWSING_HISTORY_LOG = os.path.join(workdir, "browsing_history.jsonl")
+    local_history_store._logs.clear()
+    local_history_store._search_indexes.clear()
+    sqlite_history_store.HISTORY_DB_FILE = os.path.join(workdir, "history.sqlite3")
+    sqlite_history_store._local = threading.local()
+
+def scan(module, user_id: str, text: str):
+    words = text.lower().split()
+    return [
+        row for row in module.get_query_history(user_id, limit=sys.maxsize)
+        if all(word in (row["query"] + " " + row["answer"]).lower() for word in words)
+    ]
+
+def timed_ms(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history search against scanning the history")
+    parser.add_argument("--rows", type=int, default=20000, help="History entries of the searching user")
+    parser.add_argument("--other-rows", type=int, default=20000, help="History entries of other users")
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--searches", type=int, default=50)
+    parser.add_argument("--scans", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = vocabulary(args.vocabulary, rng)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    history = entries(args.rows, "heavy-user", words, weights, rng)
+    for user in range(20):
+        history += entries(args.other_rows // 20, f"user-{user}", words, weights, rng)
+    # Two-word searches over mid-frequency words, like someone recalling a topic
+    searches = [" ".join(rng.sample(words[50:1000], 2)) for _ in range(args.searches)]
+
+    workdir = os.path.join(WORKDIR, "run")
+    print(f"\n=== {args.rows} entries for the searching user, {args.other_rows} for others ===\n")
+    print(f"{'store':7s} {'scan p50':>10s} {'first search':>13s} {'search p50':>11s} {'search p99':>11s} {'hits/search':>12s}")
+    try:
+        for store in ("local", "sqlite"):
+            module = local_history_store if store == "local" else sqlite_history_store
+            reset(store, workdir)
+            for i in range(0, len(history), 1000):
+                module.save_query_history_batch(history[i:i + 1000])
+
+            scans = [timed_ms(scan, module, "heavy-user", text) for text in searches[:args.scans]]
+            first = timed_ms(module.search_query_history, "heavy-user", searches[0], 20)
+            latencies, hits = [], []
+            for text in searches:
+                start = time.perf_counter()
+                hits.append(len(module.search_query_history("heavy-user", text, 20)))
+                latencies.append((time.perf_counter() - start) * 1000)
+            print(f"{store:7s} {statistics.median(scans):8.1f}ms {first:11.1f}ms {statistics.median(latencies):9.2f}ms "
+                  f"{percentile(latencies, 99):9.2f}ms {statistics.mean(hits):12.1f}")
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
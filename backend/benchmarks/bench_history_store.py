@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+History store benchmark: append-only JSONL logs (STORAGE_MODE=local) vs
+SQLite in WAL mode (STORAGE_MODE=sqlite).
+
+For each history size this preloads --users users' worth of query history
+into both stores (in a temporary directory), then times the operations the
+API performs: save a query, read one user's most recent page, read a page
+halfway down one user's history (by offset and by keyset cursor), and
+delete one query. For the local store the preload time includes building its
+in-memory index. A final check saves from --threads threads at once and
+counts how many entries survived.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_history_store
+    python -m benchmarks.bench_history_store --rows 10000 100000 1000000 --ops 200
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Keep the stores (and the SQLite importer) away from ./local_db
+WORKDIR = tempfile.mkdtemp(prefix="askify-history-")
+os.environ["LOCAL_DB_DIR"] = WORKDIR
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app.db import local_history_store, sqlite_history_store
+from app.db.pagination import last_keyset
+
+def history_rows(count: int, users: int):
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        yield {
+            "id": str(uuid.uuid4()),
+            "user_id": f"user-{i % users}",
+            "query": f"What does section {i} say about retrieval?",
+            "answer": "It says the retrieval step ranks chunks by relevance. " * 4,
+            "url": f"https://site{i % 50}.example.com/articles/{i}",
+            "timestamp": (start + timedelta(seconds=i)).isoformat(),
+            "metadata": {"sources": [f"https://site{i % 50}.example.com/articles/{i}"]},
+        }
+
+def reset(workdir: str):
+    """Point both stores at a fresh directory"""
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    for module in (local_history_store, sqlite_history_store):
+        module.QUERY_HISTORY_FILE = os.path.join(workdir, "query_history.json")
+        module.BROWSING_HISTORY_FILE = os.path.join(workdir, "browsing_history.json")
+        module.QUERY_HISTORY_LOG = os.path.join(workdir, "query_history.jsonl")
+        module.BROWSING_HISTORY_LOG = os.path.join(workdir, "browsing_history.jsonl")
+    local_history_store._logs.clear()
+    sqlite_history_store.HISTORY_DB_FILE = os.path.join(workdir, "history.sqlite3")
+    sqlite_history_store._local = threading.local()
+
+def preload(store: str, rows: int, users: int) -> list:
+    """Bulk-write `rows` entries without going through the store API; returns their (user, id) pairs"""
+    ids = []
+    if store == "local":
+        with open(local_history_store.QUERY_HISTORY_LOG, "w") as f:
+            for row in history_rows(rows, users):
+                ids.append((row["user_id"], row["id"]))
+                f.write(json.dumps(row) + "\n")
+        local_history_store.load_history_logs()
+        return ids
+    conn = sqlite_history_store._connection()
+    batch = []
+    with conn:
+        for row in history_rows(rows, users):
+            ids.append((row["user_id"], row["id"]))
+            batch.append((row["id"], row["user_id"], row["query"], row["answer"], row["url"],
+                          row["timestamp"], json.dumps(row["metadata"])))
+            if len(batch) == 10000:
+                conn.executemany("INSERT INTO query_history VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                batch = []
+        if batch:
+            conn.executemany("INSERT INTO query_history VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+    return ids
+
+def timed_ms(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+def run(store: str, rows: int, users: int, ops: int, workdir: str) -> dict:
+    module = local_history_store if store == "local" else sqlite_history_store
+    reset(workdir)
+    start = time.perf_counter()
+    ids = preload(store, rows, users)
+    preload_seconds = time.perf_counter() - start
+
+    now = datetime.utcnow()
+    saves = [timed_ms(module.save_query_history, f"user-{random.randrange(users)}", "q", "a", "https://example.com", now)
+             for _ in range(ops)]
+    reads = [timed_ms(module.get_query_history, f"user-{random.randrange(users)}", 10, 0) for _ in range(ops)]
+    deep_offset, deep_keyset = [], []
+    middle = rows // users // 2
+    for _ in range(ops):
+        user = f"user-{random.randrange(users)}"
+        keyset = last_keyset(module.get_query_history(user, 10, middle - 10))
+        deep_offset.append(timed_ms(module.get_query_history, user, 10, middle))
+        deep_keyset.append(timed_ms(module.get_query_history, user, 10, 0, keyset))
+    deletes = [timed_ms(module.delete_specific_query, user, row_id) for user, row_id in random.sample(ids, ops)]
+
+    return {
+        "store": store,
+        "rows": rows,
+        "preload_seconds": round(preload_seconds, 2),
+        **{
+            f"{name}_ms": {"p50": round(statistics.median(values), 3), "p99": round(percentile(values, 99), 3)}
+            for name, values in (("save", saves), ("read", reads), ("deep_offset", deep_offset),
+                                 ("deep_keyset", deep_keyset), ("delete", deletes))
+        },
+    }
+
+def lost_updates(store: str, threads: int, per_thread: int, workdir: str) -> dict:
+    """Save from several threads at once and count the entries that survived"""
+    module = local_history_store if store == "local" else sqlite_history_store
+    reset(workdir)
+    preload(store, 1000, 10)
+
+    def writer(t):
+        for i in range(per_thread):
+            module.save_query_history(f"writer-{t}", f"q{i}", "a", "https://example.com", datetime.utcnow())
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(writer, range(threads)))
+    kept = sum(len(module.get_query_history(f"writer-{t}", per_thread, 0)) for t in range(threads))
+    return {"store": store, "written": threads * per_thread, "kept": kept}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSONL-log vs SQLite (WAL) query history")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--ops", type=int, default=50, help="Operations timed per kind and size")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    workdir = os.path.join(WORKDIR, "run")
+    results = []
+    try:
+        kinds = ("save_ms", "read_ms", "deep_offset_ms", "deep_keyset_ms", "delete_ms")
+        print(f"\n{'store':7s} {'rows':>9s} {'preload':>8s}   " + " ".join(f"{k[:-3] + ' p50/p99 ms':>22s}" for k in kinds))
+        for rows in args.rows:
+            for store in ("local", "sqlite"):
+                result = run(store, rows, args.users, args.ops, workdir)
+                results.append(result)
+                cells = [f"{result[k]['p50']:9.2f}/{result[k]['p99']:<9.2f}" for k in kinds]
+                print(f"{store:7s} {rows:9d} {result['preload_seconds']:7.1f}s   " + " ".join(f"{c:>22s}" for c in cells))
+                sys.stdout.flush()
+
+        print(f"\nConcurrent saves ({args.threads} threads x 50):")
+        for store in ("local", "sqlite"):
+            check = lost_updates(store, args.threads, 50, workdir)
+            results.append({"check": "lost_updates", **check})
+            print(f"  {store:7s} kept {check['kept']} of {check['written']}")
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
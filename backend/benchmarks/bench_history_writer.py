@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Query history write-behind benchmark: how long /query/ask waits on history.
+
+A simulated remote history store takes --rtt-ms per round trip (a
+Supabase insert) plus --row-ms per row and serves at most --connections
+writes at once. --requests answers arrive at --rate per second, and each
+saves its history entry one of two ways:
+
+  direct        the request saves its own entry (the previous behaviour,
+                but off the event loop)
+  write-behind  the request queues the entry with HistoryWriter, which
+                saves batches in the background
+
+Reports the time each request spends saving, the number of round trips,
+and how long entries took to reach the store.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_history_writer
+    python -m benchmarks.bench_history_writer --requests 2000 --rate 400 --rtt-ms 40
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+os.environ["STORAGE_MODE"] = "local"
+os.environ["LOCAL_DB_DIR"] = tempfile.mkdtemp(prefix="askify-history-writer-")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app.services import history_writer as writer_module
+from app.services.history_writer import HistoryWriter
+from benchmarks.bench_logging import percentile
+
+class RemoteStore:
+    """Simulated database: fixed round-trip time, per-row cost and a connection limit"""
+
+    def __init__(self, rtt_ms: float, row_ms: float, connections: int):
+        self.rtt = rtt_ms / 1000
+        self.row = row_ms / 1000
+        self.slots = threading.BoundedSemaphore(connections)
+        self.round_trips = 0
+        self.saved_at = {}
+        self.lock = threading.Lock()
+
+    def save_query_history_batch(self, entries):
+        with self.slots:
+            time.sleep(self.rtt + self.row * len(entries))
+        now = time.perf_counter()
+        with self.lock:
+            self.round_trips += 1
+            for entry in entries:
+                self.saved_at[entry["id"]] = now
+        return [entry["id"] for entry in entries]
+
+async def run(mode: str, args) -> dict:
+    store = RemoteStore(args.rtt_ms, args.row_ms, args.connections)
+    writer_module.save_query_history_batch = store.save_query_history_batch
+    writer = HistoryWriter()
+    if mode == "write-behind":
+        writer.start()
+
+    waits, queued_at = [], {}
+
+    async def request(i):
+        start = time.perf_counter()
+        entry_id = await writer.save(user_id=f"user-{i % 50}", query=f"question {i}", answer="answer",
+                                     url="https://example.com", timestamp=datetime.utcnow())
+        queued_at[entry_id] = start
+        waits.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tasks = []
+    for i in range(args.requests):
+        tasks.append(asyncio.create_task(request(i)))
+        await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*tasks)
+    answered = time.perf_counter() - start
+    await writer.stop()
+    lags = [store.saved_at[entry_id] - queued for entry_id, queued in queued_at.items()]
+    return {
+        "mode": mode,
+        "request_wait_p50_ms": percentile(waits, 50) * 1000,
+        "request_wait_p99_ms": percentile(waits, 99) * 1000,
+        "round_trips": store.round_trips,
+        "saved": len(store.saved_at),
+        "save_lag_p99_ms": percentile(lags, 99) * 1000,
+        "answered_seconds": answered,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark direct vs write-behind query history saves")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=200, help="Requests per second")
+    parser.add_argument("--rtt-ms", type=float, default=30)
+    parser.add_argument("--row-ms", type=float, default=0.2)
+    parser.add_argument("--connections", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"\n=== {args.requests} requests at {args.rate:.0f}/s, store round trip {args.rtt_ms}ms "
+          f"+ {args.row_ms}ms/row, {args.connections} connections ===\n")
+    print(f"{'mode':13s} {'wait p50':>10s} {'wait p99':>10s} {'round trips':>12s} {'saved':>7s} {'save lag p99':>13s}")
+    for mode in ("direct", "write-behind"):
+        result = asyncio.run(run(mode, args))
+        print(f"{mode:13s} {result['request_wait_p50_ms']:8.2f}ms {result['request_wait_p99_ms']:8.2f}ms "
+              f"{result['round_trips']:12d} {result['saved']:7d} {result['save_lag_p99_ms']:11.1f}ms")
+
+if __name__ == "__main__":
+    main()
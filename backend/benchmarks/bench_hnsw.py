@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+HNSW tuning benchmark: recall@k, query latency, build time and index size
+across distance metric, M, construction ef and search ef settings.
+
+Each setting gets a fresh Chroma collection in a temporary directory. Exact
+nearest neighbours are computed with numpy and used as ground truth.
+
+Corpora:
+  synthetic  Clustered random unit vectors (default 20k x 1536, like OpenAI embeddings)
+  real       Embeddings already stored in VECTOR_DB_PATH; queries are stored
+             vectors with a little noise added
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_hnsw
+    python -m benchmarks.bench_hnsw --corpus real --M 8,16,32 --search-ef 10,50,100
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+from chromadb.config import Settings
+
+from app.core.config import VECTOR_DB_PATH
+
+def synthetic_corpus(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Unit vectors drawn around random centroids, roughly mimicking text embeddings"""
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(clusters, dim))
+    vectors = centroids[rng.integers(0, clusters, size=n)] + 0.5 * rng.normal(size=(n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def real_corpus(limit: int) -> np.ndarray:
+    """All embeddings stored in the user collections under VECTOR_DB_PATH"""
+    client = chromadb.PersistentClient(path=VECTOR_DB_PATH, settings=Settings(anonymized_telemetry=False))
+    vectors = []
+    for collection in client.list_collections():
+        name = collection if isinstance(collection, str) else collection.name
+        if not name.startswith("user_"):
+            continue
+        result = client.get_collection(name).get(include=["embeddings"])
+        vectors.extend(result["embeddings"])
+        if len(vectors) >= limit:
+            break
+    if not vectors:
+        raise SystemExit(f"No stored embeddings found in {VECTOR_DB_PATH}")
+    return np.asarray(vectors[:limit], dtype=np.float32)
+
+def make_queries(corpus: np.ndarray, count: int, seed: int) -> np.ndarray:
+    """Perturbed corpus vectors, so every query has close but not identical neighbours"""
+    rng = np.random.default_rng(seed + 1)
+    picks = corpus[rng.integers(0, len(corpus), size=count)]
+    queries = picks + 0.05 * rng.normal(size=picks.shape)
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+def exact_neighbours(corpus: np.ndarray, queries: np.ndarray, k: int, space: str) -> np.ndarray:
+    if space == "l2":
+        distances = (queries ** 2).sum(1)[:, None] - 2 * queries @ corpus.T + (corpus ** 2).sum(1)[None, :]
+    elif space == "cosine":
+        normed = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+        distances = -(queries @ normed.T)
+    else:  # ip
+        distances = -(queries @ corpus.T)
+    return np.argsort(distances, axis=1)[:, :k]
+
+def directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+def run_setting(corpus, queries, truth, k, space, m, construction_ef, search_ef, batch_size):
+    """Build one collection with the given parameters and measure it"""
+    workdir = tempfile.mkdtemp(prefix="askify-hnsw-")
+    try:
+        client = chromadb.PersistentClient(path=workdir, settings=Settings(anonymized_telemetry=False))
+        collection = client.create_collection(
+            name="bench",
+            metadata={
+                "hnsw:space": space,
+                "hnsw:M": m,
+                "hnsw:construction_ef": construction_ef,
+                "hnsw:search_ef": search_ef,
+            },
+        )
+
+        ids = [str(i) for i in range(len(corpus))]
+        start = time.perf_counter()
+        for offset in range(0, len(corpus), batch_size):
+            collection.add(
+                ids=ids[offset:offset + batch_size],
+                embeddings=corpus[offset:offset + batch_size].tolist(),
+            )
+        build_seconds = time.perf_counter() - start
+
+        latencies_ms, recalls = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+            latencies_ms.append((time.perf_counter() - start) * 1000)
+            found = {int(i) for i in result["ids"][0]}
+            recalls.append(len(found.intersection(expected.tolist())) / k)
+
+        latencies_ms.sort()
+        # hnswlib keeps the vectors plus ~2*M neighbour links per element in memory
+        estimated_memory = len(corpus) * (corpus.shape[1] * 4 + 2 * m * 4)
+        return {
+            "space": space,
+            "M": m,
+            "construction_ef": construction_ef,
+            "search_ef": search_ef,
+            f"recall@{k}": round(statistics.mean(recalls), 4),
+            "latency_p50_ms": round(latencies_ms[len(latencies_ms) // 2], 3),
+            "latency_p99_ms": round(latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.99))], 3),
+            "build_seconds": round(build_seconds, 2),
+            "disk_mb": round(directory_size(workdir) / 2 ** 20, 1),
+            "est_index_memory_mb": round(estimated_memory / 2 ** 20, 1),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def int_list(value: str):
+    return [int(v) for v in value.split(",") if v]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HNSW parameters for Askify collections")
+    parser.add_argument("--corpus", choices=["synthetic", "real"], default="synthetic")
+    parser.add_argument("--n", type=int, default=20000, help="Corpus size")
+    parser.add_argument("--dim", type=int, default=1536, help="Vector dimension (synthetic corpus)")
+    parser.add_argument("--clusters", type=int, default=200, help="Number of clusters (synthetic corpus)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--space", default="l2", help="Comma-separated: l2,cosine,ip")
+    parser.add_argument("--M", type=int_list, default=[16])
+    parser.add_argument("--construction-ef", type=int_list, default=[100])
+    parser.add_argument("--search-ef", type=int_list, default=[10, 50, 100])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    if args.corpus == "synthetic":
+        corpus = synthetic_corpus(args.n, args.dim, args.clusters, args.seed)
+    else:
+        corpus = real_corpus(args.n)
+    queries = make_queries(corpus, args.queries, args.seed)
+    print(f"Corpus: {args.corpus}, {corpus.shape[0]} vectors x {corpus.shape[1]} dims, {len(queries)} queries")
+
+    results = []
+    for space in [s.strip() for s in args.space.split(",") if s.strip()]:
+        truth = exact_neighbours(corpus, queries, args.k, space)
+        for m, construction_ef, search_ef in itertools.product(args.M, args.construction_ef, args.search_ef):
+            result = run_setting(corpus, queries, truth, args.k, space, m, construction_ef, search_ef, args.batch_size)
+            print(" ".join(f"{key}={value}" for key, value in result.items()))
+            results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
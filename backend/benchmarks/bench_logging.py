@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Logging benchmark: time spent in the calling thread per log line.
+
+Request handlers used to print() directly, so every line waited for the
+write to stdout; with a slow consumer (a terminal, a container log driver
+under load) that wait lands on the request. The app now logs through a
+queue drained by a background thread (app.core.logging). This writes the
+same lines both ways to a stdout that takes --write-ms per write and
+reports the per-call latency seen by the caller, from --threads threads.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_logging
+    python -m benchmarks.bench_logging --lines 5000 --write-ms 0.2 --threads 8
+"""
+
+import argparse
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("LOG_FORMAT", "json")
+
+class SlowStream(io.TextIOBase):
+    """A stdout whose writes block for `write_ms`, like a pipe whose reader is falling behind"""
+
+    def __init__(self, write_ms: float):
+        self.write_ms = write_ms
+        self.lines = 0
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        with self._lock:
+            time.sleep(self.write_ms / 1000)
+            self.lines += text.count("\n")
+        return len(text)
+
+    def flush(self):
+        pass
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+def run(label: str, emit, lines: int, threads: int):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(i):
+        start = time.perf_counter()
+        emit(i)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(lines)))
+    total = time.perf_counter() - start
+    sys.__stdout__.write(
+        f"{label:8s} caller time per line: mean {sum(latencies) / len(latencies) * 1e6:9.1f} us  "
+        f"p99 {percentile(latencies, 99) * 1e6:9.1f} us   ({lines} lines in {total:.2f}s)\n"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Caller-side cost of print() versus queued logging")
+    parser.add_argument("--lines", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--write-ms", type=float, default=0.5, help="Time each write to stdout blocks")
+    args = parser.parse_args()
+
+    stream = SlowStream(args.write_ms)
+    sys.stdout = stream
+    from app.core import logging as app_logging
+    logger = app_logging.get_logger("app.bench")
+    timings = {"fetch": 12.5, "chunk": 40.1, "embed_chunks": 120.3, "retrieve": 8.2, "llm": 640.0}
+
+    sys.__stdout__.write(f"\n=== {args.lines} log lines from {args.threads} threads, {args.write_ms}ms per stdout write ===\n\n")
+    run("print", lambda i: print(f"[user-{i}] Stage timings for https://example.com/{i}: {timings}"), args.lines, args.threads)
+    run("logging", lambda i: logger.info("Answered query", extra={"user_id": f"user-{i}", "url": f"https://example.com/{i}", "timings": timings}),
+        args.lines, args.threads)
+
+    start = time.perf_counter()
+    app_logging.shutdown_logging()
+    sys.__stdout__.write(f"\nbackground writer drained its queue {time.perf_counter() - start:.2f}s after the last call returned\n\n")
+    sys.stdout = sys.__stdout__
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Outbound policy benchmark: a burst of API calls against a simulated upstream.
+
+The upstream serves at most --capacity requests at once and answers 429
+beyond that (like a provider rate limit), and a fraction --slow-fraction of
+its responses take --slow-factor times longer (a long tail). The same burst
+is sent twice from --threads threads:
+
+  direct   every thread calls the upstream, retrying 429s like the OpenAI
+           client's defaults (2 retries, exponential backoff, no budget)
+  policy   calls go through OutboundPolicy (AIMD limit, budgeted jittered
+           retries, hedging after the HEDGE_PERCENTILE latency)
+
+Reports throughput, latency percentiles, upstream 429s and failed calls.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_outbound_policy
+    python -m benchmarks.bench_outbound_policy --calls 1000 --threads 64 --capacity 8
+"""
+
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+
+from app.services.outbound_policy import OutboundPolicy, _percentile
+
+class RateLimited(Exception):
+    status_code = 429
+
+class Upstream:
+    """Simulated API: bounded concurrency, lognormal latency with a slow tail"""
+
+    def __init__(self, capacity: int, latency_ms: float, slow_fraction: float, slow_factor: float, seed: int = 7):
+        self.capacity = capacity
+        self.latency_ms = latency_ms
+        self.slow_fraction = slow_fraction
+        self.slow_factor = slow_factor
+        self.rng = random.Random(seed)
+        self.active = 0
+        self.rejected = 0
+        self.served = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, payload):
+        with self.lock:
+            if self.active >= self.capacity:
+                self.rejected += 1
+                raise RateLimited("Rate limit reached")
+            self.active += 1
+            latency = self.latency_ms * self.rng.lognormvariate(0, 0.25)
+            if self.rng.random() < self.slow_fraction:
+                latency *= self.slow_factor
+        try:
+            time.sleep(latency / 1000)
+            return payload
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.served += 1
+
+def direct_call(upstream: Upstream, payload, max_retries: int = 2):
+    """What the OpenAI client does by default: a few retries with growing backoff"""
+    for attempt in range(max_retries + 1):
+        try:
+            return upstream(payload)
+        except RateLimited:
+            if attempt == max_retries:
+                raise
+            time.sleep(min(0.5 * 2 ** attempt, 8.0) * (1 - 0.25 * random.random()))
+
+def run(label: str, call, calls: int, threads: int, upstream: Upstream):
+    latencies, failures = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            call(i)
+        except Exception:
+            with lock:
+                failures += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(calls)))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:8s} {calls / elapsed:8.1f} calls/s  "
+        f"p50 {_percentile(latencies, 50) * 1000:7.1f}  p95 {_percentile(latencies, 95) * 1000:7.1f}  "
+        f"p99 {_percentile(latencies, 99) * 1000:7.1f} ms  "
+        f"429s {upstream.rejected:5d}  failed {failures:4d}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Outbound policy under bursts, rate limits and slow responses")
+    parser.add_argument("--calls", type=int, default=600)
+    parser.add_argument("--threads", type=int, default=48)
+    parser.add_argument("--capacity", type=int, default=12, help="Concurrent requests the upstream accepts")
+    parser.add_argument("--latency-ms", type=float, default=40)
+    parser.add_argument("--slow-fraction", type=float, default=0.03)
+    parser.add_argument("--slow-factor", type=float, default=15)
+    parser.add_argument("--no-hedge", action="store_true")
+    args = parser.parse_args()
+
+    def upstream():
+        return Upstream(args.capacity, args.latency_ms, args.slow_fraction, args.slow_factor)
+
+    print(f"\n=== {args.calls} calls from {args.threads} threads, upstream capacity {args.capacity}, "
+          f"{args.slow_fraction:.0%} of responses {args.slow_factor:.0f}x slower ===\n")
+
+    direct = upstream()
+    run("direct", lambda i: direct_call(direct, i), args.calls, args.threads, direct)
+
+    policed = upstream()
+    policy = OutboundPolicy("bench", hedge=() if args.no_hedge else (Upstream.__name__,))
+    run("policy", lambda i: policy.call(policed, i), args.calls, args.threads, policed)
+
+    stats = policy.stats()
+    print(
+        f"\npolicy: final limit {stats['concurrency_limit']}, queue wait p95 {stats['queue_wait_p95_ms']} ms, "
+        f"{stats['retries']} retries ({stats['retries_denied']} denied by budget), "
+        f"{stats['hedges']} hedges ({stats['hedge_wins']} won)\n"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Page metadata storage benchmark: page attributes copied onto every chunk
+(the previous layout) vs a page table keyed by content_id.
+
+Both layouts store the same pages and chunks in a temporary directory, with
+a 1-d placeholder embedding so only text and metadata differ. Reports disk
+size, metadata bytes per chunk, and the latency of fetching one page's chunks
+by URL (what lexical search and /content/chunks do).
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_page_metadata
+    python -m benchmarks.bench_page_metadata --pages 2000 --summary-chars 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import chromadb
+from chromadb.config import Settings
+
+from app.db import page_store
+from benchmarks.bench_hnsw import directory_size
+
+WORDS = "page content chunk retrieval answer question browser extension vector index search token".split()
+
+def page_attributes(page: int, summary_chars: int) -> dict:
+    url = f"https://site{page % 50}.example.com/articles/{page}"
+    attributes = {
+        "source": url,
+        "domain": f"site{page % 50}.example.com",
+        "url_path": f"/articles/{page}",
+        "full_url": url,
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+    if summary_chars:
+        attributes["summary"] = ("Summary: " + " ".join(random.choices(WORDS, k=summary_chars // 6)))[:summary_chars]
+    return attributes
+
+def build(layout: str, workdir: str, pages: int, chunks_per_page: int, chunk_chars: int, summary_chars: int):
+    client = chromadb.PersistentClient(path=workdir, settings=Settings(anonymized_telemetry=False))
+    collection = client.create_collection("bench")
+    metadata_bytes = 0
+    for page in range(pages):
+        content_id = str(uuid.uuid4())
+        attributes = page_attributes(page, summary_chars)
+        metadatas = []
+        for i in range(chunks_per_page):
+            metadata = {"chunk_id": f"{content_id}_{i}", "content_id": content_id, "chunk_index": i}
+            if layout == "per-chunk":
+                metadata.update(attributes)
+            metadatas.append(metadata)
+            metadata_bytes += len(json.dumps(metadata))
+        if layout == "page-table":
+            page_store.add_page("bench", content_id, attributes)
+            metadata_bytes += len(json.dumps(attributes))
+        collection.add(
+            ids=[m["chunk_id"] for m in metadatas],
+            documents=[" ".join(random.choices(WORDS, k=chunk_chars // 6)) for _ in metadatas],
+            metadatas=metadatas,
+            embeddings=[[0.0]] * len(metadatas),
+        )
+    return collection, metadata_bytes
+
+def fetch_page(layout: str, collection, url: str):
+    if layout == "per-chunk":
+        return collection.get(where={"full_url": url}, include=["documents", "metadatas"])
+    content_ids = page_store.find_content_ids("bench", "full_url", url)
+    result = collection.get(where={"content_id": {"$in": content_ids}}, include=["documents", "metadatas"])
+    result["metadatas"] = page_store.with_page_attributes(result["metadatas"])
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-chunk vs page-table metadata storage")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--chunks-per-page", type=int, default=30)
+    parser.add_argument("--chunk-chars", type=int, default=800)
+    parser.add_argument("--summary-chars", type=int, default=1000, help="0 disables summaries")
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for layout in ("per-chunk", "page-table"):
+        random.seed(args.seed)
+        workdir = tempfile.mkdtemp(prefix="askify-pages-")
+        try:
+            # Point the page table at this run's directory
+            page_store.PAGE_DB_FILE = os.path.join(workdir, "pages.sqlite3")
+            page_store._local = threading.local()
+
+            start = time.perf_counter()
+            collection, metadata_bytes = build(
+                layout, workdir, args.pages, args.chunks_per_page, args.chunk_chars, args.summary_chars
+            )
+            build_seconds = time.perf_counter() - start
+
+            latencies_ms = []
+            for _ in range(args.lookups):
+                url = page_attributes(random.randrange(args.pages), 0)["full_url"]
+                start = time.perf_counter()
+                fetched = fetch_page(layout, collection, url)
+                latencies_ms.append((time.perf_counter() - start) * 1000)
+                assert len(fetched["ids"]) == args.chunks_per_page and fetched["metadatas"][0]["full_url"] == url
+
+            latencies_ms.sort()
+            result = {
+                "layout": layout,
+                "chunks": args.pages * args.chunks_per_page,
+                "disk_mb": round(directory_size(workdir) / 2 ** 20, 2),
+                "metadata_bytes_per_chunk": round(metadata_bytes / (args.pages * args.chunks_per_page), 1),
+                "build_seconds": round(build_seconds, 2),
+                "page_fetch_p50_ms": round(latencies_ms[len(latencies_ms) // 2], 3),
+                "page_fetch_p95_ms": round(latencies_ms[int(len(latencies_ms) * 0.95)], 3),
+            }
+            print(" ".join(f"{key}={value}" for key, value in result.items()))
+            results.append(result)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Quantized vector storage benchmark: float32 (HNSW) vs int8 and binary codes.
+
+Stores the same chunks, grouped into pages, once per encoding in a temporary
+directory the way app.db.vector_store does (Chroma for float vectors; Chroma
+with placeholder embeddings plus the SQLite quantized store otherwise), then
+reports:
+  - bytes per stored vector and on-disk size of the collection
+  - estimated resident index memory
+  - page-scoped search latency (p50/p95)
+  - quality vs exact float search: top-k overlap and agreement on which
+    chunks pass DENSE_RELEVANCE_THRESHOLD (what ends up in the LLM prompt)
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_quantization
+    python -m benchmarks.bench_quantization --corpus real --pages 200
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+import chromadb
+import numpy as np
+from chromadb.config import Settings
+
+from app.core.config import DENSE_RELEVANCE_THRESHOLD, HNSW_M
+from app.db import quantized_store
+from app.db.quantization import encode_vector, score_vectors, similarity_to_relevance
+from benchmarks.bench_hnsw import synthetic_corpus, real_corpus, make_queries, directory_size
+
+def page_url(page: int) -> str:
+    return f"https://bench.example.com/page/{page}"
+
+def build_collection(client, name: str, corpus: np.ndarray, chunks_per_page: int, mode: str):
+    collection = client.create_collection(name=name, metadata={"hnsw:space": "l2"})
+    batch = 1000
+    for offset in range(0, len(corpus), batch):
+        vectors = corpus[offset:offset + batch]
+        ids = [str(i) for i in range(offset, offset + len(vectors))]
+        metadatas = [{"full_url": page_url(i // chunks_per_page)} for i in range(offset, offset + len(vectors))]
+        documents = [f"chunk {i}" for i in range(offset, offset + len(vectors))]
+        if mode == "none":
+            collection.add(ids=ids, embeddings=vectors.tolist(), metadatas=metadatas, documents=documents)
+            continue
+        collection.add(ids=ids, embeddings=[[0.0]] * len(vectors), metadatas=metadatas, documents=documents)
+        pages = {}
+        for i, chunk_id, vector in zip(range(offset, offset + len(vectors)), ids, vectors):
+            pages.setdefault(page_url(i // chunks_per_page), []).append((chunk_id, *encode_vector(vector, mode)))
+        for url, rows in pages.items():
+            quantized_store.add_vectors("bench", url, mode, rows)
+    return collection
+
+def search(collection, mode: str, query: np.ndarray, url: str, k: int):
+    """Page-scoped search returning [(chunk index, relevance)] like the app's dense path"""
+    if mode == "none":
+        result = collection.query(
+            query_embeddings=[query.tolist()], n_results=k, where={"full_url": url}, include=["distances"]
+        )
+        # LangChain's relevance for Chroma's squared L2 distance
+        return [(int(i), 1.0 - d / np.sqrt(2)) for i, d in zip(result["ids"][0], result["distances"][0])]
+    rows = quantized_store.get_page_vectors("bench", url, mode)
+    ranked = score_vectors(query, [(codes, scale) for _, codes, scale in rows], mode, k, "l2")
+    # The app then loads the winning chunks' texts from Chroma
+    collection.get(ids=[rows[i][0] for i, _ in ranked], include=["documents", "metadatas"])
+    return [(int(rows[i][0]), score) for i, score in ranked]
+
+def exact(corpus: np.ndarray, query: np.ndarray, page: int, chunks_per_page: int, k: int):
+    start = page * chunks_per_page
+    block = corpus[start:start + chunks_per_page]
+    similarities = block @ query / (np.linalg.norm(block, axis=1) * np.linalg.norm(query))
+    order = np.argsort(-similarities)[:k]
+    return [(start + int(i), similarity_to_relevance(float(similarities[i]), "l2")) for i in order]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized chunk vector storage")
+    parser.add_argument("--corpus", choices=["synthetic", "real"], default="synthetic")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--chunks-per-page", type=int, default=30)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    n = args.pages * args.chunks_per_page
+    corpus = synthetic_corpus(n, args.dim, max(1, n // 20), args.seed) if args.corpus == "synthetic" else real_corpus(n)
+    pages = len(corpus) // args.chunks_per_page
+    corpus = corpus[: pages * args.chunks_per_page]
+    dim = corpus.shape[1]
+
+    rng = np.random.default_rng(args.seed)
+    query_pages = rng.integers(0, pages, size=args.queries)
+    # Queries close to a chunk of the page they are asked on
+    queries = make_queries(
+        np.vstack([corpus[p * args.chunks_per_page + rng.integers(0, args.chunks_per_page)] for p in query_pages]),
+        args.queries,
+        args.seed,
+    )
+    truth = [exact(corpus, q, p, args.chunks_per_page, args.k) for q, p in zip(queries, query_pages)]
+    print(f"Corpus: {args.corpus}, {pages} pages x {args.chunks_per_page} chunks, {dim} dims, {args.queries} queries")
+
+    results = []
+    for mode in ("none", "int8", "binary"):
+        workdir = tempfile.mkdtemp(prefix="askify-quant-")
+        try:
+            client = chromadb.PersistentClient(path=workdir, settings=Settings(anonymized_telemetry=False))
+            # Point the quantized store at this run's directory
+            quantized_store.QUANTIZED_DB_FILE = os.path.join(workdir, "quantized_vectors.sqlite3")
+            quantized_store._local = threading.local()
+            start = time.perf_counter()
+            collection = build_collection(client, "bench", corpus, args.chunks_per_page, mode)
+            build_seconds = time.perf_counter() - start
+
+            latencies_ms, overlaps, threshold_agreement = [], [], []
+            for query, page, expected in zip(queries, query_pages, truth):
+                start = time.perf_counter()
+                found = search(collection, mode, query, page_url(int(page)), args.k)
+                latencies_ms.append((time.perf_counter() - start) * 1000)
+
+                overlaps.append(len({i for i, _ in found} & {i for i, _ in expected}) / args.k)
+                passed = {i for i, score in found if score > DENSE_RELEVANCE_THRESHOLD}
+                expected_passed = {i for i, score in expected if score > DENSE_RELEVANCE_THRESHOLD}
+                threshold_agreement.append(passed == expected_passed)
+
+            vector_bytes = {"none": dim * 4, "int8": dim + 4, "binary": dim // 8 + 4}[mode]
+            # The HNSW index keeps full vectors plus neighbour links resident; quantized
+            # collections only index a 1-d placeholder and decode one page at a time
+            index_dim = dim if mode == "none" else 1
+            latencies_ms.sort()
+            result = {
+                "encoding": mode,
+                "bytes_per_vector": vector_bytes,
+                "disk_mb": round(directory_size(workdir) / 2 ** 20, 1),
+                "est_index_memory_mb": round(len(corpus) * (index_dim * 4 + 2 * HNSW_M * 4) / 2 ** 20, 1),
+                "build_seconds": round(build_seconds, 2),
+                "search_p50_ms": round(latencies_ms[len(latencies_ms) // 2], 3),
+                "search_p95_ms": round(latencies_ms[int(len(latencies_ms) * 0.95)], 3),
+                f"top{args.k}_overlap": round(statistics.mean(overlaps), 4),
+                "threshold_agreement": round(statistics.mean(threshold_agreement), 4),
+            }
+            print(" ".join(f"{key}={value}" for key, value in result.items()))
+            results.append(result)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
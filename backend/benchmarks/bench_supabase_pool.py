@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Supabase client benchmark: user and history lookups through the previous
+per-module client and through the shared async client.
+
+--requests lookups run --concurrency at a time against the local PostgREST
+stand-in (in a process of its own), which answers each request after
+--rtt-ms. With --lookup user a lookup is the users table query of
+get_user_by_email; with --lookup history it is get_user_history (a page of
+both history tables, read at the same time). Three ways:
+
+  threads  a module-level synchronous client (as user_service and
+           history_store created at import) called from the threadpool, as
+           the endpoints did; get_user_history read the two tables on a
+           pool of its own
+  http1    user_service.get_user_by_email / history_store.get_user_history
+           on the shared async client, on the event loop, over HTTP/1.1 (one
+           request per connection at a time, at most
+           SUPABASE_POOL_MAX_CONNECTIONS)
+  http2    the same over HTTP/2, as with Supabase over HTTPS: requests
+           are multiplexed over few connections (the stand-in has no TLS,
+           so the client uses HTTP/2 prior knowledge)
+
+Reports lookup latency, throughput, the CPU time the client process
+spent per lookup, the connections opened and the largest number of
+threads alive during the run.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_supabase_pool
+    python -m benchmarks.bench_supabase_pool --requests 5000 --concurrency 200 --rtt-ms 40
+    python -m benchmarks.bench_supabase_pool --lookup history
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from fastapi.concurrency import run_in_threadpool
+from postgrest import SyncPostgrestClient
+
+from app.db import history_store, supabase_client
+from app.db.pagination import HISTORY_TABLES
+from app.services import user_service
+from benchmarks.bench_logging import percentile
+from benchmarks.loadtest.standins import start_fake_postgrest_server
+
+def serve(tables, latency_ms: float, port, connections):
+    """Run the stand-in in its own process, so it does not compete with the client for the GIL"""
+    server = start_fake_postgrest_server(latency_ms=latency_ms, tables=tables)
+    port.value = server.server_port
+    while True:
+        time.sleep(0.05)
+        connections.value = server.connections
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shared async Supabase client against per-module sync clients")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rtt-ms", type=float, default=20, help="Stand-in latency per request")
+    parser.add_argument("--lookup", choices=["user", "history"], default="user")
+    parser.add_argument("--history-rows", type=int, default=20, help="Rows per user and history table")
+    args = parser.parse_args()
+
+    users = [{"id": f"id-{i}", "email": f"user{i}@example.com", "full_name": None, "is_active": True,
+              "created_at": datetime(2024, 1, 1).isoformat()} for i in range(args.users)]
+    tables = {"users": users}
+    if args.lookup == "history":
+        start = datetime(2024, 1, 1)
+        tables["query_history"] = [
+            {"id": f"q-{i}-{j}", "user_id": f"id-{i}", "query": "question", "answer": "answer", "url": "https://example.com",
+             "timestamp": (start + timedelta(minutes=j)).isoformat()}
+            for i in range(args.users) for j in range(args.history_rows)
+        ]
+        tables["browsing_history"] = [
+            {"id": f"b-{i}-{j}", "user_id": f"id-{i}", "url": "https://example.com", "title": "page", "metadata": {},
+             "timestamp": (start + timedelta(minutes=j)).isoformat()}
+            for i in range(args.users) for j in range(args.history_rows)
+        ]
+    port, opened = multiprocessing.Value("i", 0), multiprocessing.Value("i", 0)
+    server = multiprocessing.Process(target=serve, args=(tables, args.rtt_ms, port, opened), daemon=True)
+    server.start()
+    while not port.value:
+        time.sleep(0.05)
+    supabase_client.SUPABASE_REST_URL = f"http://127.0.0.1:{port.value}/rest/v1"
+
+    client_options = supabase_client._client_options
+
+    def blocking_lookup(client: SyncPostgrestClient, i: int):
+        return client.table("users").select("*").eq("email", f"user{i}@example.com").execute().data
+
+    def blocking_page(client: SyncPostgrestClient, table: str, user_id: str):
+        return client.table(table).select("*").eq("user_id", user_id)\
+            .order("timestamp", desc=True).order("id", desc=True).limit(100).offset(0).execute().data
+
+    def blocking_history(client: SyncPostgrestClient, read_pool: ThreadPoolExecutor, i: int):
+        futures = [read_pool.submit(blocking_page, client, table, f"id-{i}") for table in HISTORY_TABLES]
+        return [future.result() for future in futures]
+
+    async def run(mode: str):
+        if mode == "threads":
+            client = SyncPostgrestClient(supabase_client.rest_url(), headers=supabase_client._headers())
+            read_pool = ThreadPoolExecutor(max_workers=8)
+            if args.lookup == "user":
+                lookup = lambda i: run_in_threadpool(blocking_lookup, client, i)
+            else:
+                lookup = lambda i: run_in_threadpool(blocking_history, client, read_pool, i)
+        else:
+            supabase_client._client_options = lambda: {**client_options(), "http1": mode == "http1"}
+            if args.lookup == "user":
+                lookup = lambda i: user_service.get_user_by_email(f"user{i}@example.com")
+            else:
+                lookup = lambda i: history_store.get_user_history(f"id-{i}")
+        slots = asyncio.Semaphore(args.concurrency)
+        latencies, peak_threads = [], [threading.active_count()]
+
+        async def request(i: int):
+            async with slots:
+                start = time.perf_counter()
+                await lookup(i % args.users)
+                latencies.append(time.perf_counter() - start)
+                peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+        connections = opened.value
+        start, cpu_start = time.perf_counter(), time.process_time()
+        await asyncio.gather(*(request(i) for i in range(args.requests)))
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+        if mode == "threads":
+            client.session.close()
+            read_pool.shutdown()
+        else:
+            await supabase_client.close_db()
+        await asyncio.sleep(0.1)  # the stand-in publishes its connection count every 50ms
+        return latencies, elapsed, cpu, opened.value - connections, peak_threads[0]
+
+    print(f"\n=== {args.requests} {args.lookup} lookups, {args.concurrency} concurrent, {args.rtt_ms}ms per request, "
+          f"pool of {supabase_client.SUPABASE_POOL_MAX_CONNECTIONS} ===\n")
+    print(f"{'mode':8s} {'p50':>9s} {'p99':>9s} {'requests/s':>11s} {'CPU/lookup':>11s} {'connections':>12s} {'threads':>8s}")
+    try:
+        for mode in ("threads", "http1", "http2"):
+            latencies, elapsed, cpu, connections, threads = asyncio.run(run(mode))
+            print(f"{mode:8s} {percentile(latencies, 50) * 1000:7.2f}ms {percentile(latencies, 99) * 1000:7.2f}ms "
+                  f"{args.requests / elapsed:11.0f} {cpu / args.requests * 1000:9.2f}ms {connections:12d} {threads:8d}")
+    finally:
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
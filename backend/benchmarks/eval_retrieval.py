@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Offline retrieval evaluation: recall and latency of dense, lexical (BM25) and
+hybrid (reciprocal rank fusion) retrieval on a fixed set of pages and questions.
+
+Lexical retrieval runs fully offline. Dense and hybrid retrieval need an
+embeddings model and are skipped when OPENAI_API_KEY is not set, unless
+LLM_PROVIDER=fake selects the local fake embeddings.
+
+Usage (from the backend directory):
+    python -m benchmarks.eval_retrieval
+    python -m benchmarks.eval_retrieval --modes lexical --k 3 --json results.json
+"""
+
+import argparse
+import json
+import math
+import os
+import statistics
+import time
+from typing import Dict, List
+
+from langchain_core.documents import Document
+
+from app.core.config import DENSE_RELEVANCE_THRESHOLD, HNSW_SPACE, OPENAI_API_KEY, LLM_PROVIDER
+from app.db.lexical_index import BM25Index
+from app.db.quantization import similarity_to_relevance
+from app.services.retrieval_service import reciprocal_rank_fusion
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(__file__), "data", "retrieval_eval.json")
+
+def load_dataset(path: str):
+    """Load pages as chunk Documents (tagged with their index) plus the questions"""
+    with open(path, "r") as f:
+        data = json.load(f)
+    pages = {}
+    for page in data["pages"]:
+        pages[page["url"]] = [
+            Document(page_content=text, metadata={"chunk_id": f"{page['url']}#{i}", "chunk_index": i})
+            for i, text in enumerate(page["chunks"])
+        ]
+    return pages, data["questions"]
+
+def cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+class DenseIndex:
+    """Brute-force cosine search over precomputed chunk embeddings"""
+
+    def __init__(self, documents: List[Document], embeddings):
+        self.documents = documents
+        self.embeddings = embeddings
+        self.vectors = embeddings.embed_documents([doc.page_content for doc in documents])
+
+    def search(self, query: str, k: int) -> List[Document]:
+        query_vector = self.embeddings.embed_query(query)
+        scored = [(doc, similarity_to_relevance(cosine(query_vector, vector), HNSW_SPACE)) for doc, vector in zip(self.documents, self.vectors)]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return [doc for doc, score in scored[:k] if score > DENSE_RELEVANCE_THRESHOLD]
+
+def evaluate(mode: str, pages, questions, k: int, dense_indexes: Dict, lexical_indexes: Dict) -> Dict:
+    """Run every question through one retrieval mode and collect recall, MRR and latency"""
+    recalls, reciprocal_ranks, latencies_ms = [], [], []
+    for item in questions:
+        url, relevant = item["url"], set(item["relevant"])
+
+        start = time.perf_counter()
+        if mode == "lexical":
+            results = [doc for doc, score in lexical_indexes[url].search(item["question"], k=k)]
+        elif mode == "dense":
+            results = dense_indexes[url].search(item["question"], k=k)
+        else:
+            dense_docs = dense_indexes[url].search(item["question"], k=2 * k)
+            lexical_docs = [doc for doc, score in lexical_indexes[url].search(item["question"], k=2 * k)]
+            results = [doc for doc, score in reciprocal_rank_fusion([dense_docs, lexical_docs], limit=k)]
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+
+        retrieved = [doc.metadata["chunk_index"] for doc in results]
+        recalls.append(len(relevant.intersection(retrieved)) / len(relevant))
+        first_hit = next((rank for rank, idx in enumerate(retrieved, start=1) if idx in relevant), None)
+        reciprocal_ranks.append(1.0 / first_hit if first_hit else 0.0)
+
+    latencies_ms.sort()
+    return {
+        "mode": mode,
+        "questions": len(questions),
+        f"recall@{k}": round(statistics.mean(recalls), 3),
+        "mrr": round(statistics.mean(reciprocal_ranks), 3),
+        "latency_p50_ms": round(latencies_ms[len(latencies_ms) // 2], 3),
+        "latency_p95_ms": round(latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.95))], 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate Askify retrieval modes offline")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="Path to the evaluation set")
+    parser.add_argument("--modes", default="lexical,dense,hybrid", help="Comma-separated retrieval modes")
+    parser.add_argument("--k", type=int, default=5, help="Number of chunks to retrieve")
+    parser.add_argument("--json", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    pages, questions = load_dataset(args.dataset)
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+
+    lexical_indexes = {url: BM25Index(docs) for url, docs in pages.items()}
+    dense_indexes = {}
+    if any(mode in ("dense", "hybrid") for mode in modes):
+        if LLM_PROVIDER == "openai" and not OPENAI_API_KEY:
+            print("OPENAI_API_KEY is not set; skipping dense and hybrid modes.")
+            modes = [mode for mode in modes if mode == "lexical"]
+        else:
+            from app.services.providers import get_embeddings
+            embeddings = get_embeddings()
+            dense_indexes = {url: DenseIndex(docs, embeddings) for url, docs in pages.items()}
+
+    results = [evaluate(mode, pages, questions, args.k, dense_indexes, lexical_indexes) for mode in modes]
+
+    print(f"\n=== Retrieval evaluation ({len(questions)} questions, k={args.k}) ===\n")
+    for result in results:
+        print(" ".join(f"{key}={value}" for key, value in result.items()))
+    print("\nDense latency includes the query embedding round trip; lexical needs none.\n")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# End-to-end load test of the FastAPI backend against local stand-ins
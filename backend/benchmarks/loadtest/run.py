@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the FastAPI backend.
+
+Boots the real app in-process (uvicorn) against local stand-ins: a fixture
+server for web pages, a fake OpenAI-compatible API with configurable latency
+(the app's OpenAI clients run unchanged), local JSON history storage and a
+temporary vector store. With --provider inprocess, or when tiktoken's
+tokenizer data (needed by OpenAIEmbeddings) cannot be loaded offline, the
+app uses the in-process fake models (LLM_PROVIDER=fake) with the same
+latencies instead of the fake API. With --storage supabase, history goes
+through the app's Supabase client to a local PostgREST stand-in answering
+after --db-latency-ms. Authentication is replaced by a dependency override
+that maps the bearer token to a test user. Virtual users then drive an
+extension-like traffic mix over HTTP for a fixed duration.
+
+Reports throughput, p50/p95/p99 latency per endpoint and the per-stage
+breakdown /query/ask returns. Results can be stored as a baseline in
+benchmarks/baselines/ and later runs are compared against it. Baselines are
+only comparable on the same machine with the same options.
+
+Usage (from the backend directory):
+    python -m benchmarks.loadtest.run
+    python -m benchmarks.loadtest.run --mix ask-heavy --users 16 --duration 60
+    python -m benchmarks.loadtest.run --mix history-heavy --storage supabase
+    python -m benchmarks.loadtest.run --save-baseline
+    python -m benchmarks.loadtest.run --fail-on-regression 0.25
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+# Point the app at local, temporary state; must happen before any app import
+WORKDIR = tempfile.mkdtemp(prefix="askify-loadtest-")
+os.environ.update({
+    "VECTOR_DB_PATH": os.path.join(WORKDIR, "chromadb"),
+    "LOCAL_DB_DIR": os.path.join(WORKDIR, "local_db"),
+    "STORAGE_MODE": "local",
+    "OPENAI_API_KEY": "loadtest",
+    "SUPABASE_URL": "http://127.0.0.1:9",  # never contacted: auth is overridden, history is local or the stand-in
+    "SUPABASE_KEY": "loadtest",
+    "RETENTION_INTERVAL_MINUTES": "0",
+})
+
+import httpx
+import uvicorn
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "baselines")
+
+# Relative weights of extension actions
+MIXES = {
+    # Browsing with the popup open now and then
+    "extension": {"record": 25, "process": 10, "ask": 35, "ask_batch": 5, "query_history": 15, "history": 10},
+    "ask-heavy": {"ask": 80, "process": 10, "query_history": 10},
+    "history-heavy": {"query_history": 45, "history": 30, "record": 25},
+}
+
+def percentile(sorted_values, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))]
+
+def tiktoken_available() -> bool:
+    """
+    Whether the tokenizer data OpenAIEmbeddings needs is available; tiktoken
+    downloads it on first use, so a disconnected machine may not have it
+    """
+    try:
+        import tiktoken
+        tiktoken.get_encoding("cl100k_base")
+        return True
+    except Exception:
+        return False
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_app(port: int) -> uvicorn.Server:
+    """Run the app with uvicorn in a background thread, authenticating by test token"""
+    from fastapi import Header
+    from app.main import app
+    from app.api.endpoints.auth import get_current_user
+    from app.models.user import User
+
+    async def loadtest_user(authorization: str = Header(...)) -> User:
+        user_id = authorization.split()[-1]
+        return User(id=user_id, email=f"{user_id}@loadtest.local", created_at=datetime(2024, 1, 1))
+
+    app.dependency_overrides[get_current_user] = loadtest_user
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.stages = defaultdict(list)
+
+    def add(self, action: str, elapsed_ms: float, response=None, error: bool = False):
+        self.latencies[action].append(elapsed_ms)
+        if error or response is None or response.status_code >= 400:
+            self.errors[action] += 1
+            return
+        if action == "ask":
+            for stage, ms in (response.json().get("timings") or {}).items():
+                self.stages[stage].append(ms)
+
+async def virtual_user(client, user_index: int, args, deadline: float, recorder: Recorder, rng: random.Random):
+    headers = {"Authorization": f"Bearer loadtest-user-{user_index}"}
+    actions, weights = zip(*MIXES[args.mix].items())
+    from benchmarks.loadtest.standins import page_questions
+
+    page = rng.randrange(args.pages)
+    while time.perf_counter() < deadline:
+        # Users move on to another page now and then; the first question there ingests it
+        if rng.random() < args.new_page_rate:
+            page = rng.randrange(args.pages)
+        url = f"{args.fixture_base}/pages/{page}"
+        timestamp = datetime.utcnow().isoformat()
+        action = rng.choices(actions, weights)[0]
+        questions = page_questions(page)
+
+        if action == "record":
+            request = client.post("/api/v1/history/record", headers=headers,
+                                  json={"url": url, "title": f"Fixture page {page}", "timestamp": timestamp})
+        elif action == "process":
+            request = client.post("/api/v1/content/process", headers=headers, json={"url": url, "timestamp": timestamp})
+        elif action == "ask":
+            request = client.post("/api/v1/query/ask", headers=headers,
+                                  json={"query": rng.choice(questions), "url": url, "timestamp": timestamp})
+        elif action == "ask_batch":
+            request = client.post("/api/v1/query/ask/batch", headers=headers,
+                                  json={"questions": questions, "url": url, "timestamp": timestamp})
+        elif action == "query_history":
+            request = client.get("/api/v1/query/history", headers=headers)
+        else:
+            request = client.get("/api/v1/history", headers=headers)
+
+        start = time.perf_counter()
+        try:
+            response = await request
+            recorder.add(action, (time.perf_counter() - start) * 1000, response)
+        except httpx.HTTPError:
+            recorder.add(action, (time.perf_counter() - start) * 1000, error=True)
+
+async def drive(base_url: str, args, recorder: Recorder) -> float:
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            virtual_user(client, i % args.accounts, args, deadline, recorder, random.Random(rng.random()))
+            for i in range(args.users)
+        ))
+        return time.perf_counter() - start
+
+def summarize(recorder: Recorder, elapsed: float, args) -> dict:
+    endpoints = {}
+    for action, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        endpoints[action] = {
+            "requests": len(values),
+            "errors": recorder.errors[action],
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 50), 1),
+            "p95_ms": round(percentile(values, 95), 1),
+            "p99_ms": round(percentile(values, 99), 1),
+        }
+    stages = {}
+    for stage, values in recorder.stages.items():
+        values = sorted(values)
+        stages[stage] = {"samples": len(values), "mean_ms": round(sum(values) / len(values), 1),
+                         "p95_ms": round(percentile(values, 95), 1)}
+    total = sum(len(values) for values in recorder.latencies.values())
+    return {
+        "options": {key: getattr(args, key) for key in
+                    ("mix", "users", "accounts", "duration", "pages", "paragraphs", "new_page_rate",
+                     "provider", "embed_latency_ms", "llm_latency_ms", "storage", "seed")},
+        "throughput_rps": round(total / elapsed, 2),
+        "requests": total,
+        "errors": sum(recorder.errors.values()),
+        "endpoints": endpoints,
+        "ask_stages": stages,
+    }
+
+def report(summary: dict):
+    print(f"\n=== Load test: mix={summary['options']['mix']} users={summary['options']['users']} "
+          f"duration={summary['options']['duration']}s ===\n")
+    print(f"throughput {summary['throughput_rps']} req/s, {summary['requests']} requests, {summary['errors']} errors\n")
+    print(f"{'endpoint':15s} {'requests':>8s} {'errors':>6s} {'rps':>7s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for action, row in summary["endpoints"].items():
+        print(f"{action:15s} {row['requests']:8d} {row['errors']:6d} {row['rps']:7.2f} "
+              f"{row['p50_ms']:9.1f} {row['p95_ms']:9.1f} {row['p99_ms']:9.1f}")
+    if summary["ask_stages"]:
+        print(f"\n{'/query/ask stage':18s} {'samples':>7s} {'mean ms':>9s} {'p95 ms':>9s}")
+        for stage, row in summary["ask_stages"].items():
+            print(f"{stage:18s} {row['samples']:7d} {row['mean_ms']:9.1f} {row['p95_ms']:9.1f}")
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> list:
+    """Print the change against a baseline; returns the regressions beyond `tolerance`"""
+    if baseline["options"] != summary["options"]:
+        print("\nBaseline was recorded with different options; the comparison is indicative only")
+    regressions = []
+    print(f"\n{'vs baseline':15s} {'rps':>9s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+    for action, row in summary["endpoints"].items():
+        base = baseline["endpoints"].get(action)
+        if not base:
+            continue
+        changes = {key: (row[key] - base[key]) / base[key] if base[key] else 0.0
+                   for key in ("rps", "p50_ms", "p95_ms", "p99_ms")}
+        print(f"{action:15s} " + " ".join(f"{changes[key]:+9.1%}" for key in ("rps", "p50_ms", "p95_ms", "p99_ms")))
+        if changes["p95_ms"] > tolerance:
+            regressions.append(f"{action} p95 {base['p95_ms']}ms -> {row['p95_ms']}ms")
+    throughput_change = (summary["throughput_rps"] - baseline["throughput_rps"]) / baseline["throughput_rps"]
+    print(f"{'throughput':15s} {throughput_change:+9.1%}")
+    if throughput_change < -tolerance:
+        regressions.append(f"throughput {baseline['throughput_rps']} -> {summary['throughput_rps']} req/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the Askify backend")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="extension")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent virtual users")
+    parser.add_argument("--accounts", type=int, default=4, help="Distinct user accounts they share")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of traffic")
+    parser.add_argument("--pages", type=int, default=40, help="Distinct fixture pages")
+    parser.add_argument("--paragraphs", type=int, default=60, help="Paragraphs per fixture page")
+    parser.add_argument("--new-page-rate", type=float, default=0.15, help="Chance a user moves to another page")
+    parser.add_argument("--provider", choices=["api", "inprocess"], default="api",
+                        help="Fake OpenAI HTTP API, or the app's in-process fake models")
+    parser.add_argument("--embed-latency-ms", type=float, default=80)
+    parser.add_argument("--llm-latency-ms", type=float, default=400)
+    parser.add_argument("--storage", choices=["local", "sqlite", "supabase"], default="local",
+                        help="History storage; supabase uses the local PostgREST stand-in")
+    parser.add_argument("--db-latency-ms", type=float, default=2, help="PostgREST stand-in latency per request")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Optional path to write the results as JSON")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as this mix's baseline")
+    parser.add_argument("--fail-on-regression", type=float, metavar="FRACTION",
+                        help="Exit with status 1 if p95 latency or throughput is this much worse than the baseline")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's own output")
+    args = parser.parse_args()
+
+    # The app reads its settings on first import, so pick the provider before importing anything from it
+    if args.provider == "api" and not tiktoken_available():
+        print("tiktoken data for OpenAIEmbeddings is not available offline; using the in-process fake models")
+        args.provider = "inprocess"
+    os.environ["LLM_PROVIDER"] = "fake" if args.provider == "inprocess" else "openai"
+    os.environ["FAKE_EMBEDDING_LATENCY_MS"] = str(args.embed_latency_ms)
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["STORAGE_MODE"] = args.storage
+    if not args.verbose:
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from benchmarks.loadtest import standins
+
+    fixtures = standins.start_fixture_server(args.paragraphs)
+    fake_openai = standins.start_fake_openai_server(args.embed_latency_ms, args.llm_latency_ms)
+    args.fixture_base = f"http://127.0.0.1:{fixtures.server_port}"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{fake_openai.server_port}/v1"
+    fake_postgrest = None
+    if args.storage == "supabase":
+        from app.db import supabase_client
+        fake_postgrest = standins.start_fake_postgrest_server(args.db_latency_ms)
+        supabase_client.SUPABASE_REST_URL = f"http://127.0.0.1:{fake_postgrest.server_port}/rest/v1"
+
+    port = free_port()
+    recorder = Recorder()
+    try:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, "w")):
+            server = start_app(port)
+            elapsed = asyncio.run(drive(f"http://127.0.0.1:{port}", args, recorder))
+            server.should_exit = True
+    finally:
+        fixtures.shutdown()
+        fake_openai.shutdown()
+        if fake_postgrest:
+            fake_postgrest.shutdown()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    summary = summarize(recorder, elapsed, args)
+    report(summary)
+
+    baseline_path = os.path.join(BASELINE_DIR, f"loadtest-{args.mix}.json")
+    regressions = []
+    if os.path.exists(baseline_path) and not args.save_baseline:
+        with open(baseline_path, "r") as f:
+            regressions = compare(summary, json.load(f), args.fail_on_regression or 0.25)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nBaseline saved to {baseline_path}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    print()
+
+    if regressions and args.fail_on_regression is not None:
+        print("Regressions:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+# Local stand-ins for the backend's external services: web pages, the OpenAI API and Supabase's PostgREST API
+import base64
+import json
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+from urllib.parse import parse_qsl, urlsplit
+
+from app.services.context_service import count_tokens
+from app.services.providers import FakeEmbeddings, fake_completion
+
+TOPICS = {
+    "caching": "cache entries expire after a TTL and the eviction policy is least recently used",
+    "indexing": "the vector index uses HNSW graphs and queries are filtered by page URL",
+    "tokens": "prompts are packed into a token budget before the model is called",
+    "sync": "sync errors such as ERR_SYNC_TIMEOUT are retried with exponential backoff",
+    "auth": "access tokens are signed JWTs that expire after seven days",
+    "history": "query history is stored per user and listed newest first",
+    "extension": "the browser extension sends the current page URL with every question",
+    "pricing": "the team plan costs 12 dollars per seat per month billed annually",
+}
+FILLER = ("overview details section notes example usage configuration behaviour reference "
+          "setting option limit default value request response client server").split()
+
+def page_html(page: int, paragraphs: int) -> str:
+    """A deterministic article built from a few topics, with navigation noise around it"""
+    rng = random.Random(page)
+    topics = rng.sample(sorted(TOPICS), 3)
+    body = []
+    for i in range(paragraphs):
+        topic = topics[i % len(topics)]
+        body.append(
+            f"<p>{topic.capitalize()}: {TOPICS[topic]}. "
+            f"{' '.join(rng.choices(FILLER, k=14)).capitalize()}.</p>"
+        )
+    return (
+        f"<html><head><title>Fixture page {page}: {', '.join(topics)}</title>"
+        f"<script>var tracking = true;</script></head><body>"
+        f"<nav>Home Docs Blog</nav><main><h1>Fixture page {page}</h1>{''.join(body)}</main>"
+        f"<footer>Copyright</footer></body></html>"
+    )
+
+def page_questions(page: int):
+    """Questions a user might ask about a fixture page"""
+    rng = random.Random(page)
+    return [f"How does {topic} work here?" for topic in rng.sample(sorted(TOPICS), 3)]
+
+def _cl100k():
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default listen backlog of 5 drops connection bursts (and clients retry after 1s)
+
+def _start(handler) -> ThreadingHTTPServer:
+    server = _Server(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_fixture_server(paragraphs: int = 60, latency_ms: float = 0) -> ThreadingHTTPServer:
+    """
+    Serve fixture pages at /pages/<n>; /blocked/<n> answers 403 like a site
+    that refuses automated access
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            kind, _, number = self.path.strip("/").partition("/")
+            if kind != "pages" or not number.isdigit():
+                self.send_error(403 if kind == "blocked" else 404)
+                return
+            content = page_html(int(number), paragraphs).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    return _start(Handler)
+
+def start_fake_openai_server(embed_latency_ms: float = 0, llm_latency_ms: float = 0) -> ThreadingHTTPServer:
+    """
+    Minimal OpenAI-compatible API (/v1/embeddings, /v1/chat/completions) with
+    deterministic output, so the app's real OpenAI client code runs unchanged
+    with OPENAI_BASE_URL pointing here
+    """
+    embedder = FakeEmbeddings(latency_ms=0)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, payload: dict):
+            content = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.endswith("/embeddings"):
+                self._embeddings(request)
+            elif self.path.endswith("/chat/completions"):
+                self._chat(request)
+            else:
+                self.send_error(404)
+
+        def _embeddings(self, request: dict):
+            time.sleep(embed_latency_ms / 1000)
+            inputs = request["input"]
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            # The client sends token IDs by default; decode them back to text
+            texts = [item if isinstance(item, str) else _cl100k().decode(item) for item in inputs]
+            data = []
+            for i, vector in enumerate(embedder.embed_documents(texts)):
+                if request.get("encoding_format") == "base64":
+                    vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode()
+                data.append({"object": "embedding", "index": i, "embedding": vector})
+            tokens = sum(count_tokens(text) for text in texts)
+            self._reply({
+                "object": "list", "data": data, "model": request.get("model", "fake"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+
+        def _chat(self, request: dict):
+            time.sleep(llm_latency_ms / 1000)
+            prompt = "\n".join(str(message.get("content", "")) for message in request["messages"])
+            answer = fake_completion(prompt)
+            prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(answer)
+            self._reply({
+                "id": "chatcmpl-loadtest", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+
+        def log_message(self, *args):
+            pass
+
+    return _start(Handler)
+
+# Query parameters of a PostgREST request that are not column filters
+_POSTGREST_PARAMETERS = {"select", "order", "limit", "offset", "columns", "on_conflict"}
+
+def _postgrest_text(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+def _postgrest_split(items: str) -> List[str]:
+    """Split "a,b,and(c,d)" at the commas outside parentheses and quotes"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(items):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in "()":
+            depth += 1 if char == "(" else -1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append(items[start:i])
+            start = i + 1
+    parts.append(items[start:])
+    return [part for part in parts if part]
+
+def _postgrest_filter(column: str, expression: str) -> Callable[[Dict], bool]:
+    """A row predicate for one filter such as ("timestamp", 'lt."2024-01-01"'); values compare as text"""
+    if column in ("or", "and"):
+        return _postgrest_group(column, expression)
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    operator, _, value = expression.partition(".")
+    value = value.strip('"')
+    if operator == "in":
+        values = {item.strip('"') for item in _postgrest_split(value.strip("()"))}
+        test = lambda text: text in values
+    elif operator in ("eq", "is"):
+        test = lambda text: text == value
+    elif operator in ("neq", "lt", "lte", "gt", "gte"):
+        test = {
+            "neq": lambda text: text != value,
+            "lt": lambda text: text < value,
+            "lte": lambda text: text <= value,
+            "gt": lambda text: text > value,
+            "gte": lambda text: text >= value,
+        }[operator]
+    else:
+        raise ValueError(f"unsupported filter operator {operator!r}")
+    return lambda row: test(_postgrest_text(row.get(column))) != negate
+
+def _postgrest_group(kind: str, expression: str) -> Callable[[Dict], bool]:
+    """A row predicate for or=(...) / and=(...), whose items may nest and(...) / or(...)"""
+    tests = []
+    for item in _postgrest_split(expression[1:-1]):
+        if item.startswith(("and(", "or(")):
+            nested, _, rest = item.partition("(")
+            tests.append(_postgrest_group(nested, "(" + rest))
+        else:
+            column, _, condition = item.partition(".")
+            tests.append(_postgrest_filter(column, condition))
+    combine = any if kind == "or" else all
+    return lambda row: combine(test(row) for test in tests)
+
+def _search_query_history(tables: Dict[str, List[Dict]], params: Dict) -> List[Dict]:
+    """The search_query_history function of supabase_setup.sql, approximated by counting matched words"""
+    terms = [term for term in str(params.get("p_query", "")).lower().split() if term]
+    results = []
+    for row in tables.get("query_history", []):
+        if row.get("user_id") != params.get("p_user_id"):
+            continue
+        text = f"{row.get('query', '')} {row.get('answer', '')}".lower()
+        score = sum(term in text for term in terms)
+        if score:
+            results.append({**row, "score": float(score)})
+    results.sort(key=lambda row: (row["score"], str(row.get("timestamp"))), reverse=True)
+    return results[:int(params.get("p_limit", 20))]
+
+# Clients speaking HTTP/2 without TLS ("prior knowledge") open the connection with this
+_H2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+
+def _serve_h2(sock, rfile, respond: Callable):
+    """
+    Serve one HTTP/2 connection, answering each stream in a thread of its own
+    with respond(method, target, headers, body) -> (status, content)
+    """
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+
+    connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+    lock = threading.Lock()
+    requests, unsent = {}, {}  # stream id -> (headers, body); stream id -> response bytes waiting for flow control
+
+    def send(stream_id: int, data: bytes):
+        """Send what the flow control windows allow (with lock held); the rest waits for a WINDOW_UPDATE"""
+        while data:
+            size = min(len(data), connection.local_flow_control_window(stream_id), connection.max_outbound_frame_size)
+            if size <= 0:
+                unsent[stream_id] = data
+                return
+            connection.send_data(stream_id, data[:size])
+            data = data[size:]
+        unsent.pop(stream_id, None)
+        connection.end_stream(stream_id)
+
+    def answer(stream_id: int, headers: Dict[str, str], body: bytes):
+        status, content = respond(headers[":method"], headers[":path"], headers, body)
+        with lock:
+            try:
+                connection.send_headers(stream_id, [
+                    (":status", str(status)), ("content-type", "application/json"), ("content-length", str(len(content))),
+                ])
+                send(stream_id, content)
+            except h2.exceptions.StreamClosedError:
+                unsent.pop(stream_id, None)
+            sock.sendall(connection.data_to_send())
+
+    with lock:
+        connection.initiate_connection()
+        sock.sendall(connection.data_to_send())
+    while True:
+        data = rfile.read1(65536)
+        if not data:
+            return
+        with lock:
+            for event in connection.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    requests[event.stream_id] = (dict(event.headers), bytearray())
+                elif isinstance(event, h2.events.DataReceived):
+                    requests[event.stream_id][1].extend(event.data)
+                    connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    headers, body = requests.pop(event.stream_id)
+                    threading.Thread(target=answer, args=(event.stream_id, headers, bytes(body)), daemon=True).start()
+                elif isinstance(event, h2.events.WindowUpdated):
+                    for stream_id, pending in list(unsent.items()):
+                        send(stream_id, pending)
+            sock.sendall(connection.data_to_send())
+
+def start_fake_postgrest_server(latency_ms: float = 0, tables: Dict[str, List[Dict]] = None) -> ThreadingHTTPServer:
+    """
+    In-memory stand-in for Supabase's PostgREST API, serving /rest/v1/<table>
+    (GET, POST, DELETE) and /rest/v1/rpc/search_query_history, so the app's
+    Supabase code runs unchanged with SUPABASE_REST_URL pointing here
+
+    Supports the filters the app uses (eq, neq, lt, lte, gt, gte, in, is,
+    not., or/and groups), order, limit, offset and select of columns. Speaks
+    HTTP/1.1, and HTTP/2 to clients that open with the HTTP/2 preface (httpx
+    with http1=False). Every request waits latency_ms, as a round trip to the
+    database would. server.tables holds the rows and server.connections
+    counts the connections opened, to check client pooling.
+    """
+    tables = tables if tables is not None else {}
+    functions = {"search_query_history": _search_query_history}
+    lock = threading.Lock()
+
+    def query(method: str, target: str, prefer: str, body):
+        """(status, payload) of one PostgREST request"""
+        url = urlsplit(target)
+        prefix = "/rest/v1/"
+        if not url.path.startswith(prefix):
+            return 404, {"code": "PGRST125", "message": f"Invalid path {url.path}"}
+        name = url.path[len(prefix):]
+        parameters = parse_qsl(url.query, keep_blank_values=True)
+        if name.startswith("rpc/"):
+            function = functions.get(name[4:])
+            if function is None or method != "POST":
+                return 404, {"code": "PGRST202", "message": f"Unknown function {name[4:]}"}
+            with lock:
+                return 200, function(tables, body or {})
+        tests = [_postgrest_filter(key, value) for key, value in parameters if key not in _POSTGREST_PARAMETERS]
+        parameters = dict(parameters)
+        with lock:
+            rows = tables.setdefault(name, [])
+            if method == "POST":
+                inserted = [dict(row) for row in (body if isinstance(body, list) else [body])]
+                rows.extend(inserted)
+                return 201, inserted if "return=representation" in prefer else None
+            matched = [row for row in rows if all(test(row) for test in tests)]
+            if method == "DELETE":
+                tables[name] = [row for row in rows if not all(test(row) for test in tests)]
+                return 200, matched
+        for order in reversed(_postgrest_split(parameters.get("order", ""))):
+            column, _, direction = order.partition(".")
+            matched.sort(key=lambda row: (row.get(column) is None, _postgrest_text(row.get(column))),
+                         reverse=direction.startswith("desc"))
+        offset = int(parameters.get("offset", 0))
+        limit = int(parameters["limit"]) if "limit" in parameters else None
+        matched = matched[offset:offset + limit if limit is not None else None]
+        columns = parameters.get("select", "*")
+        if columns != "*":
+            matched = [{column: row.get(column) for column in columns.split(",")} for row in matched]
+        return 200, matched
+
+    def respond(method: str, target: str, headers, body: bytes):
+        time.sleep(latency_ms / 1000)
+        try:
+            status, payload = query(method, target, headers.get("prefer", ""), json.loads(body or b"null"))
+        except ValueError as e:
+            status, payload = 400, {"code": "PGRST100", "message": str(e)}
+        return status, json.dumps(payload).encode() if payload is not None else b""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # headers and body are written separately; don't wait for delayed ACKs
+
+        def setup(self):
+            super().setup()
+            with lock:
+                self.server.connections += 1
+
+        def handle(self):
+            if self.rfile.peek(len(_H2_PREFACE)).startswith(_H2_PREFACE):
+                _serve_h2(self.connection, self.rfile, respond)
+            else:
+                super().handle()
+
+        def _handle(self, method: str):
+            # Read the body even when unused (DELETE sends "{}"), or it is taken for the next request
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            status, content = respond(method, self.path, self.headers, body)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+        def log_message(self, *args):
+            pass
+
+    server = _start(Handler)
+    server.tables = tables
+    server.connections = 0
+    return server
@@ -38,8 +38,49 @@ create table public.query_history (
 );
 
 -- Create indexes
-create index idx_browsing_history_user_id on public.browsing_history(user_id);
-create index idx_query_history_user_id on public.query_history(user_id);
+-- (user_id, timestamp, id) serves the newest-first keyset pagination of /history and /query/history
+create index idx_browsing_history_user_time_id on public.browsing_history(user_id, timestamp desc, id desc);
+create index idx_query_history_user_time_id on public.query_history(user_id, timestamp desc, id desc);
+-- (timestamp, id) serves the archival job's scan for the oldest rows of all users
+create index idx_browsing_history_time_id on public.browsing_history(timestamp, id);
+create index idx_query_history_time_id on public.query_history(timestamp, id);
+
+-- Full-text search over query history (/query/history/search): questions weigh more than answers,
+-- and the (user_id, search) GIN index needs btree_gin for the uuid column
+create extension if not exists btree_gin;
+alter table public.query_history add column search tsvector generated always as (
+    setweight(to_tsvector('english', coalesce(query, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(answer, '')), 'B')
+) stored;
+create index idx_query_history_search on public.query_history using gin(user_id, search);
+
+-- Matches any of the search words, ranked by relevance boosted for recent entries:
+-- rank * (1 + recency_weight * 0.5 ^ (age in days / half_life_days)), as in app/db/history_search.py
+create or replace function public.search_query_history(
+    p_user_id uuid,
+    p_query text,
+    p_limit int default 20,
+    p_candidates int default 200,
+    p_recency_weight float default 0.5,
+    p_half_life_days float default 30
+)
+returns table (id uuid, query text, answer text, url text, "timestamp" timestamptz, score float)
+language sql stable
+as $$
+    with matches as (
+        select h.id, h.query, h.answer, h.url, h."timestamp", ts_rank_cd(h.search, q, 1) as relevance
+        from public.query_history h,
+             to_tsquery('english', nullif(replace(plainto_tsquery('english', p_query)::text, '&', '|'), '')) q
+        where h.user_id = p_user_id and h.search @@ q
+        order by relevance desc
+        limit p_candidates
+    )
+    select id, query, answer, url, "timestamp",
+           relevance * (1 + p_recency_weight * power(0.5, extract(epoch from now() - "timestamp") / 86400 / p_half_life_days)) as score
+    from matches
+    order by score desc
+    limit p_limit;
+$$;
 
 -- Row level security policies
 -- Only allow users to see their own data